@@ -0,0 +1,51 @@
+# coding: utf-8
+"""Run the rpm-repo-maker command line against the stand-ins in fakes/.
+
+Hooks that change the host are switched off: adding online repositories
+and writing .repo files or shell aliases outside of $BENCH_HOME. Zypper
+install roots are faked from a small stand-in of the host configuration
+and rpm database. Everything else runs as in production.
+
+    python benchmarks/driver.py generate NAME -c package.json ...
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+
+def patch():
+    from rpm_repo_maker.exporter import FINDER, RPMRepoExporter
+    from rpm_repo_maker.exporter.pm_zypper_nir import ZypperNIRRepoExporter
+    from rpm_repo_maker.importer import IMPORTER
+
+    for finder in FINDER.values():
+        finder._ensure_repo_source = classmethod(lambda cls: None)
+    RPMRepoExporter.get_releasever = lambda self: '8'
+
+    home = os.environ['BENCH_HOME']
+    # a small stand-in of the host zypper configuration and rpm database
+    sources = []
+    for path, content in (('etc/zypp', 'zypp.conf'), ('var/lib/rpm', 'Packages')):
+        source = os.path.join(home, 'host', path)
+        if not os.path.isdir(source):
+            os.makedirs(source)
+            with open(os.path.join(source, content), 'wb') as f:
+                f.write(b'\0' * 1024 * 1024)
+        sources.append((path, source))
+    ZypperNIRRepoExporter.ROOT_SOURCES = tuple(sources)
+    ZypperNIRRepoExporter.HOST_CACHEDIR = os.path.join(home, 'host', 'var', 'cache', 'zypp')
+
+    for importer in IMPORTER.values():
+        importer.REPO_PATH = os.path.join(home, 'repos.d')
+        importer.SHELL_CONFIG_PATH = os.path.join(home, '.bashrc')
+    if not os.path.isdir(os.path.join(home, 'repos.d')):
+        os.makedirs(os.path.join(home, 'repos.d'))
+
+
+if __name__ == '__main__':
+    patch()
+    from rpm_repo_maker.__main__ import main
+    main()
@@ -0,0 +1,252 @@
+# coding: utf-8
+"""Synthetic repository seen by the stand-in package managers.
+
+The repository directory comes from $BENCH_REPO and is described by its
+catalogue.json, see benchmarks/synthrepo.py. Requires are plain package
+names resolved to the newest version, like a package manager installing
+into an empty root would.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+
+CATALOGUE_FILE = 'catalogue.json'
+
+
+class Package(object):
+
+    def __init__(self, repo, data):
+        self.repo = repo
+        self.name = data['name']
+        self.epoch = data['epoch']
+        self.version = data['version']
+        self.release = data['release']
+        self.arch = data['arch']
+        self.requires = data['requires']
+        self.location = data['location']
+        self.size = data['size']
+        self.checksum = data['checksum']
+        self.repoid = repo.repoid
+
+    @property
+    def nevra(self):
+        return "{}-{}:{}-{}.{}".format(self.name, self.epoch, self.version, self.release, self.arch)
+
+    @property
+    def nvra(self):
+        return "{}-{}-{}.{}".format(self.name, self.version, self.release, self.arch)
+
+    @property
+    def path(self):
+        return os.path.join(self.repo.root, self.location)
+
+    @property
+    def url(self):
+        return self.repo.baseurl + self.location
+
+    def __repr__(self):
+        return "<{}>".format(self.nevra)
+
+
+class Repository(object):
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ['BENCH_REPO'])
+        with open(os.path.join(self.root, CATALOGUE_FILE)) as f:
+            data = json.load(f)
+        self.repoid = data['repoid']
+        self.baseurl = data['baseurl']
+        self.packages = [Package(self, entry) for entry in data['packages']]
+        self.by_name = {}
+        for pkg in self.packages:
+            self.by_name.setdefault(pkg.name, []).append(pkg)
+        for pkgs in self.by_name.values():
+            pkgs.sort(key=lambda pkg: [int(part) for part in pkg.version.split('.')])
+        self.by_nevra = dict((pkg.nevra, pkg) for pkg in self.packages)
+        self.by_nevra.update((pkg.nvra, pkg) for pkg in self.packages)
+
+    def newest(self, name):
+        return self.by_name[name][-1]
+
+    def find(self, spec):
+        """Package of a nevra, nvra, name-version, name[.arch]=version[-release]
+        or name, None if unknown.
+        """
+        if spec in self.by_nevra:
+            return self.by_nevra[spec]
+        if spec in self.by_name:
+            return self.newest(spec)
+        name, _, version = spec.rpartition('=' if '=' in spec else '-')
+        arch = None
+        if name not in self.by_name and '.' in name:
+            name, arch = name.rsplit('.', 1)
+        for pkg in self.by_name.get(name, []):
+            if version in (pkg.version, "{}-{}".format(pkg.version, pkg.release)) and arch in (None, pkg.arch):
+                return pkg
+        return None
+
+    def closure(self, pkgs):
+        """Packages with all their requires."""
+        result, todo = {}, list(pkgs)
+        while todo:
+            pkg = todo.pop()
+            if pkg.nevra in result:
+                continue
+            result[pkg.nevra] = pkg
+            todo.extend(self.newest(name) for name in pkg.requires)
+        return sorted(result.values(), key=lambda pkg: pkg.nevra)
+
+
+def _latency():
+    # package manager start-up and metadata check of a real invocation
+    time.sleep(float(os.environ.get('BENCH_PM_LATENCY', '0')))
+
+
+def _options(argv):
+    """Split argv into ({--key: value, -x: True}, positional args)."""
+    options, args = {}, []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith('--') and '=' in arg:
+            key, value = arg.split('=', 1)
+            options[key] = value
+        elif arg in ('-R', '--root'):
+            options['-R'] = argv[i + 1]
+            i += 1
+        elif arg.startswith('-'):
+            options[arg] = True
+        else:
+            args.append(arg)
+        i += 1
+    return options, args
+
+
+def _copy(repo, pkgs, dest):
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    for pkg in pkgs:
+        shutil.copyfile(pkg.path, os.path.join(dest, os.path.basename(pkg.location)))
+
+
+def _lookup(repo, specs):
+    pkgs = []
+    for spec in specs:
+        pkg = repo.find(spec)
+        if pkg is None:
+            sys.stderr.write("No match for argument: {}\n".format(spec))
+            sys.exit(1)
+        pkgs.append(pkg)
+    return pkgs
+
+
+def _metadata(repo, installroot, cachedir):
+    """Fetch repository metadata into the cache of an install root,
+    unless it is there already.
+    """
+    path = os.path.join(installroot, cachedir, repo.repoid, 'repodata', 'repomd.xml')
+    if os.path.isfile(path):
+        return
+    _latency()
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    shutil.copyfile(os.path.join(repo.root, 'repodata', 'repomd.xml'), path)
+
+
+def dnf_main(argv, cachedir='var/cache/dnf'):
+    options, args = _options(argv)
+    if not args or '--help' in options:
+        return 0
+    command, specs = args[0], args[1:]
+    if command == 'repolist':
+        print("repo id    repo name")
+        print("{0}      {0}".format(Repository().repoid))
+        return 0
+    if command == 'makecache' and '--installroot' in options:
+        _metadata(Repository(), options['--installroot'], cachedir)
+        return 0
+    if command not in ('install', 'download'):
+        # remove, config-manager ... change nothing here
+        return 0
+    repo = Repository()
+    _latency()
+    if '--installroot' in options:
+        _metadata(repo, options['--installroot'], cachedir)
+    if command == 'download':
+        _copy(repo, _lookup(repo, specs), options['--destdir'])
+    elif '--downloaddir' in options:
+        _copy(repo, repo.closure(_lookup(repo, specs)), options['--downloaddir'])
+    return 0
+
+
+def yumdownloader_main(argv):
+    options, specs = _options(argv)
+    repo = Repository()
+    _latency()
+    _copy(repo, _lookup(repo, specs), options['--destdir'])
+    return 0
+
+
+def _zypper_summary(pkgs):
+    print("<?xml version='1.0'?>")
+    print("<stream>")
+    print('<message type="info">Loading repository data...</message>')
+    print('<install-summary packages-to-change="{}">'.format(len(pkgs)))
+    print("<to-install>")
+    for pkg in pkgs:
+        edition = "{}-{}".format(pkg.version, pkg.release)
+        if pkg.epoch and str(pkg.epoch) != '0':
+            edition = "{}:{}".format(pkg.epoch, edition)
+        print('<solvable type="package" name="{}" edition="{}" arch="{}" repository="{}"/>'.format(
+            pkg.name, edition, pkg.arch, pkg.repoid))
+    print("</to-install>")
+    print("</install-summary>")
+    print("</stream>")
+
+
+def zypper_main(argv):
+    options, args = _options(argv)
+    if not args:
+        return 0
+    repo = Repository()
+    root = options.get('-R', '/')
+    cachedir = os.path.join('var', 'cache', 'zypp', 'raw')
+    if args[0] == 'refresh':
+        if root != '/':
+            _metadata(repo, root, cachedir)
+        else:
+            _latency()
+        return 0
+    if args[0] != 'install':
+        return 0
+    if root != '/' and '--no-refresh' not in options:
+        _metadata(repo, root, cachedir)
+    if '--dry-run' in options:
+        _latency()
+        pkgs = []
+        for spec in args[1:]:
+            pkg = repo.find(spec)
+            if pkg is None:
+                print("<?xml version='1.0'?>")
+                print('<stream><message type="error">No provider of \'{}\' found.</message></stream>'.format(spec))
+                return 104
+            pkgs.append(pkg)
+        _zypper_summary(repo.closure(pkgs))
+        return 0
+    if root == '/':
+        return 0
+    _latency()
+    cachedir = os.path.join(root, 'var', 'cache', 'zypp', 'packages', repo.repoid)
+    _copy(repo, repo.closure(_lookup(repo, args[1:])), cachedir)
+    return 0
+
+
+def createrepo_main(argv):
+    from rpm_repo_maker.repodata import RepodataGenerator
+
+    _, args = _options(argv)
+    RepodataGenerator().generate(args[-1])
+    return 0
@@ -0,0 +1,119 @@
+# coding: utf-8
+"""Stand-in of the dnf API used by DnfResolveEngine, backed by $BENCH_REPO."""
+
+from _benchrepo import Repository
+
+
+class Package(object):
+
+    def __init__(self, pkg):
+        self._pkg = pkg
+        self.name = pkg.name
+        self.epoch = pkg.epoch
+        self.version = pkg.version
+        self.release = pkg.release
+        self.arch = pkg.arch
+        self.repoid = pkg.repoid
+        self.downloadsize = pkg.size
+        self.location = pkg.location
+
+    def returnIdSum(self):
+        return 'sha256', self._pkg.checksum
+
+    def remote_location(self):
+        return self._pkg.url
+
+    def __eq__(self, other):
+        return isinstance(other, Package) and self._pkg.nevra == other._pkg.nevra
+
+    def __hash__(self):
+        return hash(self._pkg.nevra)
+
+
+class Query(list):
+
+    def filter(self, name=None):
+        return Query(pkg for pkg in self if pkg.name == name)
+
+
+class Sack(object):
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.packages = [Package(pkg) for pkg in repo.packages]
+
+    def query(self):
+        return Query(self.packages)
+
+
+class Transaction(object):
+
+    def __init__(self, install_set):
+        self.install_set = install_set
+
+
+class _LibRepo(object):
+
+    def __init__(self, root):
+        self.root = root
+
+    def getCachedir(self):
+        return self.root
+
+
+class Repo(object):
+
+    def __init__(self, repo):
+        self.id = repo.repoid
+        self._repo = _LibRepo(repo.root)
+
+    def load(self):
+        pass
+
+
+class RepoDict(object):
+
+    def __init__(self):
+        self._repos = []
+
+    def iter_enabled(self):
+        return iter(self._repos)
+
+
+class Base(object):
+
+    def __init__(self):
+        self.repo = None
+        self.repos = RepoDict()
+        self.sack = None
+        self.transaction = None
+        self._goal = []
+
+    def read_all_repos(self):
+        self.repo = Repository()
+        self.repos._repos = [Repo(self.repo)]
+
+    def fill_sack(self, load_system_repo=True, load_available_repos=True):
+        self.sack = Sack(self.repo)
+
+    def reset(self, sack=False, repos=False, goal=False):
+        if goal:
+            self._goal = []
+            self.transaction = None
+
+    def package_install(self, pkg, strict=True):
+        self._goal.append(pkg)
+
+    def resolve(self, allow_erasing=False):
+        closure = self.repo.closure(pkg._pkg for pkg in self._goal)
+        self.transaction = Transaction(set(Package(pkg) for pkg in closure))
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
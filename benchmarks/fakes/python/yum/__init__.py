@@ -0,0 +1,122 @@
+# coding: utf-8
+"""Stand-in of the yum API used by YumResolveEngine, backed by $BENCH_REPO."""
+
+import os
+
+from _benchrepo import Repository
+
+
+class Package(object):
+
+    def __init__(self, pkg):
+        self._pkg = pkg
+        self.name = pkg.name
+        self.epoch = str(pkg.epoch)
+        self.version = pkg.version
+        self.release = pkg.release
+        self.arch = pkg.arch
+        self.repoid = pkg.repoid
+        self.size = pkg.size
+        self.relativepath = pkg.location
+        self.remote_url = pkg.url
+
+    def returnIdSum(self):
+        return 'sha256', self._pkg.checksum
+
+
+class PackageSack(object):
+
+    def __init__(self, repo):
+        self.by_name = {}
+        for pkg in repo.packages:
+            self.by_name.setdefault(pkg.name, []).append(Package(pkg))
+
+    def searchNames(self, names):
+        return [pkg for name in names for pkg in self.by_name.get(name, [])]
+
+
+class TransactionMember(object):
+
+    def __init__(self, po):
+        self.po = po
+
+
+class TransactionData(object):
+
+    def __init__(self):
+        self.goal = []
+        self.members = []
+
+    def getMembers(self):
+        return list(self.members)
+
+
+class Repo(object):
+
+    def __init__(self, repo):
+        self.id = repo.repoid
+        # yum keeps repomd.xml directly in the cache directory
+        self.cachedir = os.path.join(repo.root, 'repodata')
+        self.repoXML = None
+
+
+class RepoStorage(object):
+
+    def __init__(self, repo):
+        self._repos = [Repo(repo)]
+
+    def listEnabled(self):
+        return list(self._repos)
+
+
+class Config(object):
+
+    def __init__(self):
+        self.yumvar = {'releasever': '7', 'basearch': 'x86_64'}
+
+
+class PreConfig(object):
+    root = '/'
+    releasever = None
+
+
+class YumBase(object):
+
+    def __init__(self):
+        self.repo = Repository()
+        self.conf = Config()
+        self.preconf = PreConfig()
+        self.repos = RepoStorage(self.repo)
+        self._sack = None
+        self._ts = None
+
+    @property
+    def pkgSack(self):
+        if self._sack is None:
+            self._sack = PackageSack(self.repo)
+        return self._sack
+
+    @property
+    def tsInfo(self):
+        if self._ts is None:
+            self._ts = TransactionData()
+        return self._ts
+
+    @tsInfo.deleter
+    def tsInfo(self):
+        # a new transaction is started on next access, like yum does
+        self._ts = None
+
+    def install(self, po=None, name=None):
+        if po is None:
+            po = Package(self.repo.newest(name))
+        self.tsInfo.goal.append(po)
+        return [po]
+
+    def resolveDeps(self):
+        closure = self.repo.closure(po._pkg for po in self.tsInfo.goal)
+        self.tsInfo.members = [TransactionMember(Package(pkg)) for pkg in closure]
+        return 2, []
+
+    def close(self):
+        pass
@@ -0,0 +1,182 @@
+# coding: utf-8
+"""Time generate and import on synthetic repositories of several sizes.
+
+Every (manager, scale) pair gets a fresh synthetic repository and a fresh
+home directory, so package and resolve caches start cold. The tool runs
+through driver.py with the stand-ins of fakes/ first on PATH and
+PYTHONPATH, per-phase timings come from its --metrics-file.
+
+    python benchmarks/run.py --scales 50,200,1000 --managers dnf,yum
+    python benchmarks/run.py --python2 /usr/bin/python2.7 --managers yum
+    python benchmarks/run.py --output new.json --baseline old.json
+"""
+
+import os
+import sys
+import glob
+import json
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJ_DIR = os.path.dirname(HERE)
+sys.path.insert(0, PROJ_DIR)
+
+import synthrepo  # noqa: E402
+
+BUNDLE_NAME = 'bench'
+# managers whose finders run on python 2, as on their target hosts
+PY2_MANAGERS = ('yum', 'zypper-nir')
+# phases faster than this are noise, never reported as regressions
+NOISE_FLOOR = 0.05
+
+
+def tool_env(repo, home, pm_latency):
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join([os.path.join(HERE, 'fakes', 'bin'), env.get('PATH', '')])
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(HERE, 'fakes', 'python'), PROJ_DIR])
+    env['HOME'] = home
+    env['BENCH_HOME'] = home
+    env['BENCH_REPO'] = repo
+    env['BENCH_PM_LATENCY'] = str(pm_latency)
+    return env
+
+
+def run_tool(args, python, env, metrics_file):
+    cmd = [python, os.path.join(HERE, 'driver.py')] + args + ['--metrics-file', metrics_file]
+    p = subprocess.Popen(cmd, env=env, cwd=env['HOME'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        sys.stderr.write(err.decode('utf-8', 'replace')[-4000:])
+        raise SystemExit("command failed: {}".format(" ".join(cmd)))
+    with open(metrics_file) as f:
+        return json.load(f)
+
+
+def interpreter(opts, manager):
+    return opts.python2 if manager in PY2_MANAGERS else opts.python
+
+
+def bench_one(opts, workdir, manager, scale):
+    repo = os.path.join(workdir, 'repo-{}'.format(scale))
+    if not os.path.isdir(repo):
+        synthrepo.build(repo, scale, fanout=opts.fanout, files=opts.files, payload=opts.payload,
+                        versions=opts.versions, seed=opts.seed)
+    home = os.path.join(workdir, 'home-{}-{}'.format(manager, scale))
+    shutil.rmtree(home, ignore_errors=True)
+    os.makedirs(home)
+    env = tool_env(repo, home, opts.pm_latency)
+
+    config = os.path.join(home, 'package.json')
+    with open(config, 'w') as f:
+        json.dump({manager: synthrepo.roots(scale, opts.roots)}, f)
+
+    generate = run_tool(['generate', BUNDLE_NAME, '-m', manager, '-c', config] + shlex.split(opts.generate_args),
+                        interpreter(opts, manager), env, os.path.join(home, 'generate.metrics.json'))
+    bundle = sorted(glob.glob(os.path.join(home, BUNDLE_NAME + '.tar*')))[0]
+    imported = os.path.join(home, 'imported')
+    os.makedirs(imported)
+    import_ = run_tool(['import', BUNDLE_NAME, '-m', manager, '-f', bundle, '-p', imported]
+                       + shlex.split(opts.import_args),
+                       interpreter(opts, manager), env, os.path.join(home, 'import.metrics.json'))
+    return {'manager': manager, 'scale': scale, 'generate': generate, 'import': import_}
+
+
+def phase_rows(result):
+    for command in ('generate', 'import'):
+        for phase, entry in result[command]['phases'].items():
+            yield phase, entry['wall'], entry['cpu']
+
+
+def report(results):
+    print("{:<12} {:>8} {:<22} {:>9} {:>9}".format('manager', 'packages', 'phase', 'wall', 'cpu'))
+    for result in results:
+        for phase, wall, cpu in phase_rows(result):
+            print("{:<12} {:>8} {:<22} {:>8.3f}s {:>8.3f}s".format(
+                result['manager'], result['scale'], phase, wall, cpu))
+        counters = result['generate']['counters']
+        print("{:<12} {:>8} resolved {} packages, {} bytes downloaded, {} bytes archived".format(
+            result['manager'], result['scale'], counters.get('packages_resolved', 0),
+            counters.get('bytes_downloaded', 0), counters.get('bytes_written', 0)))
+
+
+def compare(results, baseline, threshold):
+    """Print phases slower than the baseline by more than threshold,
+    return whether there were any.
+    """
+    old = {}
+    for result in baseline:
+        for phase, wall, _ in phase_rows(result):
+            old[(result['manager'], result['scale'], phase)] = wall
+    regressions = 0
+    for result in results:
+        for phase, wall, _ in phase_rows(result):
+            before = old.get((result['manager'], result['scale'], phase))
+            if before is None or wall - before < NOISE_FLOOR or wall <= before * (1 + threshold):
+                continue
+            regressions += 1
+            print("REGRESSION {} {} {}: {:.3f}s -> {:.3f}s (+{:.0f}%)".format(
+                result['manager'], result['scale'], phase, before, wall, (wall / before - 1) * 100))
+    return regressions > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', type=str, default='50,200,1000',
+                        help='comma separated numbers of package names')
+    parser.add_argument('--managers', type=str, default='dnf,yum',
+                        help='comma separated package managers: yum, dnf, dnf-kylin, zypper-nir')
+    parser.add_argument('--fanout', type=int, default=3, help='requires per package')
+    parser.add_argument('--files', type=int, default=10, help='files per package')
+    parser.add_argument('--payload', type=int, default=16384, help='payload bytes per package')
+    parser.add_argument('--versions', type=int, default=1, help='versions per package name')
+    parser.add_argument('--roots', type=int, default=None,
+                        help='requested packages, default is a tenth of the scale')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the dependency graph')
+    parser.add_argument('--pm-latency', dest='pm_latency', type=float, default=0.2,
+                        help='seconds added to every package manager invocation')
+    parser.add_argument('--generate-args', dest='generate_args', type=str, default='',
+                        help='extra generate arguments, e.g. "--batch-size 20 --jobs 4"')
+    parser.add_argument('--import-args', dest='import_args', type=str, default='',
+                        help='extra import arguments')
+    parser.add_argument('--python', type=str, default=sys.executable,
+                        help='interpreter running rpm-repo-maker')
+    parser.add_argument('--python2', type=str, default='python2',
+                        help='interpreter running rpm-repo-maker for yum and zypper-nir')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='keep repositories and bundles here instead of a temporary directory')
+    parser.add_argument('--output', type=str, default=None, help='write results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='results of an earlier run, exit 1 when a phase got slower')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown reported as regression')
+    opts = parser.parse_args()
+
+    workdir = opts.workdir or tempfile.mkdtemp(prefix='repomaker-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    results = []
+    try:
+        for scale in [int(s) for s in opts.scales.split(',')]:
+            for manager in opts.managers.split(','):
+                sys.stderr.write("benchmarking {} with {} packages ...\n".format(manager, scale))
+                results.append(bench_one(opts, workdir, manager, scale))
+    finally:
+        if opts.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            if compare(results, json.load(f), opts.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
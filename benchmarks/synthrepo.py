@@ -0,0 +1,164 @@
+# coding: utf-8
+"""Synthetic rpm repositories for benchmarks.
+
+Packages are named bench-00000, bench-00001, ... and only require packages
+with a higher number, so dependencies form a DAG whose fan-out is set per
+package. The rpm files carry real headers (name, version, requires, files)
+so rpm_repo_maker reads them like any other package, the payload is random
+bytes of the requested size. `catalogue.json` describes the repository for
+the stand-in package managers in fakes/.
+"""
+
+import os
+import json
+import random
+import struct
+
+from rpm_repo_maker.helper import file_checksum
+from rpm_repo_maker.repodata import RepodataGenerator
+from rpm_repo_maker.rpmheader import (
+    HEADER_MAGIC, LEAD_MAGIC, LEAD_SIZE,
+    RPM_INT32_TYPE, RPM_STRING_TYPE, RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE,
+    RPMTAG_NAME, RPMTAG_EPOCH, RPMTAG_VERSION, RPMTAG_RELEASE, RPMTAG_SUMMARY, RPMTAG_DESCRIPTION, RPMTAG_BUILDTIME,
+    RPMTAG_BUILDHOST, RPMTAG_SIZE, RPMTAG_LICENSE, RPMTAG_GROUP, RPMTAG_ARCH, RPMTAG_FILEMODES,
+    RPMTAG_SOURCERPM, RPMTAG_PROVIDENAME, RPMTAG_REQUIREFLAGS, RPMTAG_REQUIRENAME, RPMTAG_REQUIREVERSION,
+    RPMTAG_PROVIDEFLAGS, RPMTAG_PROVIDEVERSION, RPMTAG_DIRINDEXES, RPMTAG_BASENAMES, RPMTAG_DIRNAMES,
+    RPMSENSE_EQUAL,
+)
+
+CATALOGUE_FILE = 'catalogue.json'
+REPOID = 'bench'
+BASEURL = 'http://bench.invalid/bench/'
+ARCH = 'x86_64'
+# signature header tag of header + payload size
+RPMSIGTAG_SIZE = 1000
+
+
+def _header(entries):
+    """Serialize (tag, type, value) entries into a header section."""
+    index, store = [], b''
+    for tag, typ, value in sorted(entries):
+        if typ == RPM_INT32_TYPE:
+            store += b'\x00' * ((4 - len(store) % 4) % 4)
+            offset, count = len(store), len(value)
+            store += struct.pack('>{}I'.format(count), *value)
+        elif typ == RPM_STRING_TYPE:
+            offset, count = len(store), 1
+            store += value.encode('utf-8') + b'\x00'
+        else:
+            offset, count = len(store), len(value)
+            store += b''.join(v.encode('utf-8') + b'\x00' for v in value)
+        index.append(struct.pack('>iiii', tag, typ, offset, count))
+    return HEADER_MAGIC + b'\x00' * 4 + struct.pack('>II', len(index), len(store)) + b''.join(index) + store
+
+
+def _dependencies(deps):
+    """Names, flags and versions of dependencies given as names or
+    (name, RPMSENSE flags, evr) tuples.
+    """
+    deps = [dep if isinstance(dep, tuple) else (dep, 0, '') for dep in deps]
+    return [dep[0] for dep in deps], [dep[1] for dep in deps], [dep[2] for dep in deps]
+
+
+def write_rpm(path, name, version, release, requires=(), files=(), payload=0, epoch=None, provides=(), arch=ARCH):
+    """Write a binary rpm with a real header and `payload` random bytes.
+    requires and provides are names or (name, RPMSENSE flags, evr) tuples,
+    the package always provides its own name.
+    """
+    evr = "{}-{}".format(version, release)
+    if epoch is not None:
+        evr = "{}:{}".format(epoch, evr)
+    provide_names, provide_flags, provide_versions = _dependencies([(name, RPMSENSE_EQUAL, evr)] + list(provides))
+    entries = [
+        (RPMTAG_NAME, RPM_STRING_TYPE, name),
+        (RPMTAG_VERSION, RPM_STRING_TYPE, version),
+        (RPMTAG_RELEASE, RPM_STRING_TYPE, release),
+        (RPMTAG_ARCH, RPM_STRING_TYPE, arch),
+        (RPMTAG_SOURCERPM, RPM_STRING_TYPE, "{}-{}-{}.src.rpm".format(name, version, release)),
+        (RPMTAG_SUMMARY, RPM_I18NSTRING_TYPE, ["Synthetic package {}".format(name)]),
+        (RPMTAG_DESCRIPTION, RPM_I18NSTRING_TYPE, ["Synthetic benchmark package."]),
+        (RPMTAG_LICENSE, RPM_STRING_TYPE, 'MIT'),
+        (RPMTAG_GROUP, RPM_I18NSTRING_TYPE, ['Unspecified']),
+        (RPMTAG_BUILDTIME, RPM_INT32_TYPE, [1700000000]),
+        (RPMTAG_BUILDHOST, RPM_STRING_TYPE, 'bench'),
+        (RPMTAG_SIZE, RPM_INT32_TYPE, [payload]),
+        (RPMTAG_PROVIDENAME, RPM_STRING_ARRAY_TYPE, provide_names),
+        (RPMTAG_PROVIDEFLAGS, RPM_INT32_TYPE, provide_flags),
+        (RPMTAG_PROVIDEVERSION, RPM_STRING_ARRAY_TYPE, provide_versions),
+    ]
+    if epoch is not None:
+        entries.append((RPMTAG_EPOCH, RPM_INT32_TYPE, [epoch]))
+    if requires:
+        require_names, require_flags, require_versions = _dependencies(requires)
+        entries += [
+            (RPMTAG_REQUIRENAME, RPM_STRING_ARRAY_TYPE, require_names),
+            (RPMTAG_REQUIREFLAGS, RPM_INT32_TYPE, require_flags),
+            (RPMTAG_REQUIREVERSION, RPM_STRING_ARRAY_TYPE, require_versions),
+        ]
+    if files:
+        dirs = sorted(set(os.path.dirname(fn) + '/' for fn in files))
+        entries += [
+            (RPMTAG_BASENAMES, RPM_STRING_ARRAY_TYPE, [os.path.basename(fn) for fn in files]),
+            (RPMTAG_DIRNAMES, RPM_STRING_ARRAY_TYPE, dirs),
+            (RPMTAG_DIRINDEXES, RPM_INT32_TYPE, [dirs.index(os.path.dirname(fn) + '/') for fn in files]),
+            (RPMTAG_FILEMODES, RPM_INT32_TYPE, [0o100644] * len(files)),
+        ]
+    main = _header(entries)
+    signature = _header([(RPMSIGTAG_SIZE, RPM_INT32_TYPE, [len(main) + payload])])
+    lead = LEAD_MAGIC + b'\x03\x00\x00\x00' + name.encode('utf-8')[:65].ljust(66, b'\x00')
+    lead = lead.ljust(LEAD_SIZE, b'\x00')
+    with open(path, 'wb') as f:
+        f.write(lead)
+        f.write(signature + b'\x00' * ((8 - len(signature) % 8) % 8))
+        f.write(main)
+        remain = payload
+        while remain > 0:
+            n = min(remain, 1024 * 1024)
+            f.write(os.urandom(n))
+            remain -= n
+
+
+def package_name(i):
+    return "bench-{:05d}".format(i)
+
+
+def build(root, packages, fanout=3, files=10, payload=4096, versions=1, seed=0):
+    """Build a repository of `packages` names, `versions` versions each,
+    into root with repodata and a catalogue. Return the catalogue.
+    """
+    rng = random.Random(seed)
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    entries = []
+    for i in range(packages):
+        name = package_name(i)
+        later = list(range(i + 1, packages))
+        requires = [package_name(j) for j in sorted(rng.sample(later, min(fanout, len(later))))]
+        paths = ["/usr/share/{}/file-{}".format(name, j) for j in range(files)]
+        for v in range(versions):
+            version = "{}.0".format(v + 1)
+            filename = "{}-{}-1.{}.rpm".format(name, version, ARCH)
+            path = os.path.join(root, filename)
+            write_rpm(path, name, version, '1', requires=requires, files=paths, payload=payload)
+            entries.append({
+                'name': name,
+                'epoch': 0,
+                'version': version,
+                'release': '1',
+                'arch': ARCH,
+                'requires': requires,
+                'location': filename,
+                'size': os.path.getsize(path),
+                'checksum': file_checksum(path),
+            })
+    RepodataGenerator().generate(root)
+    catalogue = {'repoid': REPOID, 'baseurl': BASEURL, 'packages': entries}
+    with open(os.path.join(root, CATALOGUE_FILE), 'w') as f:
+        json.dump(catalogue, f, indent=2)
+    return catalogue
+
+
+def roots(packages, count=None):
+    """Names requested by the benchmark config, the first tenth by default."""
+    count = count or max(1, packages // 10)
+    return [package_name(i) for i in range(min(count, packages))]
@@ -5,9 +5,14 @@ import sys
 import json
 import argparse
 
-from .exporter import FINDER, EXPORTER
+from .archive import SUFFIXES, list_archive
+from .config import CACHE_DIR
+from .exporter import FINDER, EXPORTER, DownloadError, Lockfile, PackageCache, ResolveCache
 from .importer import IMPORTER
 from .helper import cmd_exists
+from .metrics import METRICS
+from .runner import CommandError, cancel_all
+from .server import COMMANDS, Server, submit
 
 NO_SUB_CMD_MSG = 'command required'
 
@@ -61,22 +66,95 @@ def print_config(parser, args):
     print(cfg)
 
 
-def generate_offline_bundle(parser, args):
-    read_manager(parser, args)
+def resolve_packages(parser, args, empty_root=False):
     cfg = read_config(parser, args)
-    # resolve dependency
+    if cfg is None:
+        parser.error('need specify "-s" or "-c" option')
     finder = FINDER[args.pkg_mgr]
-    pkgs = finder.get_rpm_dependency(cfg)
-    print(pkgs)
+    if args.pkg_mgr == 'offline':
+        finder.configure(read_repo_urls(parser, args.repos), arch=args.arch)
+    resolve_cache = None
+    if not args.no_resolve_cache:
+        resolve_cache = ResolveCache(os.path.join(CACHE_DIR, 'resolve'))
+    return finder.get_rpm_dependency(cfg, resolve_cache=resolve_cache, empty_root=empty_root,
+                                     jobs=args.resolve_jobs)
+
+
+def read_repo_urls(parser, values):
+    """Parse REPOID=URL options into {repoid: [url, ...]}."""
+    urls = {}
+    for value in values:
+        repoid, sep, url = value.partition('=')
+        if not sep or not repoid or not url:
+            parser.error("expect REPOID=URL: {}".format(value))
+        urls.setdefault(repoid, []).append(url)
+    return urls
+
+
+def lock_packages(parser, args):
+    read_manager(parser, args)
+    if not FINDER[args.pkg_mgr].LOCKABLE:
+        parser.error("{} does not report package checksums, its closures cannot be locked".format(args.pkg_mgr))
+    pkgs = resolve_packages(parser, args, empty_root=True)
+    Lockfile(args.pkg_mgr, pkgs).save(args.lockfile)
+    print("{} packages locked in {}".format(len(pkgs), args.lockfile))
+
+
+def generate_offline_bundle(parser, args):
+    lock = None
+    if args.lock:
+        lock = Lockfile.load(args.lock)
+        args.pkg_mgr = args.pkg_mgr or lock.manager
+    else:
+        read_manager(parser, args)
 
     # make repo
+    cache = None
+    if not args.no_cache:
+        cache = PackageCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.resume and args.workdir is None:
+        parser.error("--resume needs the --workdir of the failed run")
     exporter_cls = EXPORTER[args.pkg_mgr]
     exporter = exporter_cls(
         args.repository,
         os.path.expanduser('~'),
         platform_suffix=args.suffix,
+        batch_size=args.batch_size,
+        jobs=args.jobs,
+        cache=cache,
+        base=args.base,
+        repodata=args.repodata,
+        compression=args.compression,
+        compress_level=args.compress_level,
+        compress_jobs=args.compress_jobs,
+        indexed=args.indexed,
+        exact=lock is not None,
+        downloader=args.downloader,
+        mirrors=read_repo_urls(parser, args.mirrors),
+        mirrorlists=read_repo_urls(parser, args.mirrorlists),
+        mirror_stats=os.path.join(CACHE_DIR, 'mirrors.json'),
+        workdir=args.workdir,
+        resume=args.resume,
+        pm_timeout=args.pm_timeout,
+        root_cache=None if args.no_root_cache else os.path.join(CACHE_DIR, 'roots'),
     )
-    exporter(pkgs)
+
+    pkgs = exporter.resolved()
+    if pkgs is None:
+        if lock is not None:
+            # locked closure, no resolution at all
+            pkgs = lock.packages
+        else:
+            # resolve dependency
+            pkgs = resolve_packages(parser, args)
+        exporter.record_resolved(pkgs)
+    print(pkgs)
+
+    try:
+        exporter(pkgs)
+    except DownloadError as e:
+        sys.stderr.write('download error: {}\n'.format(e))
+        sys.exit(3)
 
 
 def import_offline_bundle(parser, args):
@@ -86,18 +164,40 @@ def import_offline_bundle(parser, args):
     importer = importer_cls(
         args.repository,
         args.repo_file,
+        repodata_only=args.repodata_only,
+        packages=args.packages,
     )
     importer(args.repo_path)
 
 
-def main():
+def list_offline_bundle(parser, args):
+    for name, size in list_archive(args.bundle):
+        print("{:>12} {}".format(size, name))
+
+
+def serve(parser, args):
+    server = Server(execute, refresh_interval=args.refresh_interval)
+    try:
+        server.serve()
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def add_metrics_arguments(cmd):
+    cmd.add_argument('--metrics-file', dest='metrics_file', type=str, default=None,
+                     help='write phase timings and counters of the run to this JSON file')
+    cmd.add_argument('--progress-file', dest='progress_file', type=str, default=None,
+                     help='append progress events to this file as JSON lines')
+
+
+def build_parser():
     # root parser
     parser = MyParser(
         prog="rpm-repo-maker",
         description="RPM repository maker",
         formatter_class=argparse.RawTextHelpFormatter,
     )
-    sp = parser.add_subparsers(help='sub-command help')
+    sp = parser.add_subparsers(dest='command', help='sub-command help')
 
     # command print
     cmd_print = sp.add_parser('print', help='Print for debug.')
@@ -115,7 +215,82 @@ def main():
     cmd_gen.add_argument('repository', type=str, help='generated repository name')
     cmd_gen.add_argument('-u', '--suffix', dest='suffix', type=str, help='use customized suffix')
     cmd_gen.add_argument('-m', '--manager', dest='pkg_mgr', type=str, help='specify package manager')
-    group_cfg = cmd_gen.add_mutually_exclusive_group(required=True)
+    cmd_gen.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=None,
+                         help='packages per package manager invocation, 0 downloads one by one')
+    cmd_gen.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                         help='parallel package manager invocations')
+    cmd_gen.add_argument('--cache-dir', dest='cache_dir', type=str, default=os.path.join(CACHE_DIR, 'packages'),
+                         help='persistent package cache directory')
+    cmd_gen.add_argument('--cache-size', dest='cache_size', type=int, default=10240,
+                         help='package cache size limit in MiB')
+    cmd_gen.add_argument('--no-cache', dest='no_cache', action='store_true',
+                         help='do not use the package cache')
+    cmd_gen.add_argument('--resolve-jobs', dest='resolve_jobs', type=int, default=1,
+                         help='processes resolving dependencies in parallel, default is 1')
+    cmd_gen.add_argument('--no-resolve-cache', dest='no_resolve_cache', action='store_true',
+                         help='always resolve dependencies, ignore cached results')
+    cmd_gen.add_argument('--no-root-cache', dest='no_root_cache', action='store_true',
+                         help='prepare install roots and repository metadata afresh on every run')
+    cmd_gen.add_argument('--lock', dest='lock', type=str, default=None,
+                         help='lockfile from the lock command, download exactly its packages')
+    cmd_gen.add_argument('--downloader', dest='downloader', type=str, default='auto',
+                         choices=['auto', 'native', 'pm'],
+                         help='with --lock, fetch over http (native) or with the package manager (pm), '
+                              'auto fetches natively when all packages have urls')
+    cmd_gen.add_argument('--pm-timeout', dest='pm_timeout', type=int, default=None,
+                         help='seconds a package manager invocation may take, no limit by default')
+    cmd_gen.add_argument('--mirror', dest='mirrors', action='append', default=[], metavar='REPOID=URL',
+                         help='extra base url of a repository for the native downloader, repeatable')
+    cmd_gen.add_argument('--mirrorlist', dest='mirrorlists', action='append', default=[], metavar='REPOID=URL',
+                         help='mirrorlist or metalink of a repository for the native downloader, repeatable')
+    cmd_gen.add_argument('--repo', dest='repos', action='append', default=[], metavar='REPOID=URL',
+                         help='base url of a repository for the offline manager, repeatable')
+    cmd_gen.add_argument('--arch', dest='arch', type=str, default=None,
+                         help='target architecture for the offline manager, default is this host')
+    cmd_gen.add_argument('--workdir', dest='workdir', type=str, default=None,
+                         help='work directory kept on failure for --resume, '
+                              'default is a temporary directory removed at the end')
+    cmd_gen.add_argument('--resume', dest='resume', action='store_true',
+                         help='continue a failed run from its work directory')
+    cmd_gen.add_argument('--base', dest='base', type=str, default=None,
+                         help='previous bundle or manifest, generate a delta bundle against it')
+    cmd_gen.add_argument('--repodata', dest='repodata', type=str, default='auto',
+                         choices=['auto', 'builtin', 'createrepo'],
+                         help='repodata generator, auto uses createrepo when installed')
+    cmd_gen.add_argument('--compression', dest='compression', type=str, default='gzip',
+                         choices=list(SUFFIXES), help='bundle compression')
+    cmd_gen.add_argument('--compress-level', dest='compress_level', type=int, default=None,
+                         help='compression level, default depends on compression')
+    cmd_gen.add_argument('--compress-jobs', dest='compress_jobs', type=int, default=None,
+                         help='compression threads, default is the number of cpus')
+    cmd_gen.add_argument('--indexed', dest='indexed', action='store_true',
+                         help='write a member index for selective import, gzip only')
+    cmd_gen.add_argument('--local', dest='local', action='store_true',
+                         help='run in this process even when a serve daemon is running')
+    add_metrics_arguments(cmd_gen)
+    group_cfg = cmd_gen.add_mutually_exclusive_group()
+    group_cfg.add_argument('-s', '--string', dest='config_str', type=str, default='',
+                           help='configuration string')
+    group_cfg.add_argument('-c', '--config', dest='config_file', type=argparse.FileType('r'),
+                           help='configuration file path')
+
+    # command lock
+    cmd_lock = sp.add_parser('lock', help='Resolve packages into a lockfile for generate --lock.')
+    cmd_lock.set_defaults(func=lock_packages)
+    cmd_lock.add_argument('lockfile', type=str, help='lockfile path to write')
+    cmd_lock.add_argument('-m', '--manager', dest='pkg_mgr', type=str, help='specify package manager')
+    cmd_lock.add_argument('--resolve-jobs', dest='resolve_jobs', type=int, default=1,
+                          help='processes resolving dependencies in parallel, default is 1')
+    cmd_lock.add_argument('--no-resolve-cache', dest='no_resolve_cache', action='store_true',
+                          help='always resolve dependencies, ignore cached results')
+    cmd_lock.add_argument('--repo', dest='repos', action='append', default=[], metavar='REPOID=URL',
+                          help='base url of a repository for the offline manager, repeatable')
+    cmd_lock.add_argument('--arch', dest='arch', type=str, default=None,
+                          help='target architecture for the offline manager, default is this host')
+    cmd_lock.add_argument('--local', dest='local', action='store_true',
+                          help='run in this process even when a serve daemon is running')
+    add_metrics_arguments(cmd_lock)
+    group_cfg = cmd_lock.add_mutually_exclusive_group(required=True)
     group_cfg.add_argument('-s', '--string', dest='config_str', type=str, default='',
                            help='configuration string')
     group_cfg.add_argument('-c', '--config', dest='config_file', type=argparse.FileType('r'),
@@ -130,15 +305,66 @@ def main():
                             help='repository bundle to import')
     cmd_import.add_argument('-p', '--path', dest='repo_path', type=str, default='/opt/rpm',
                             help='local repository path')
+    cmd_import.add_argument('--repodata-only', dest='repodata_only', action='store_true',
+                            help='extract only manifest and repodata, needs an indexed bundle')
+    cmd_import.add_argument('--package', dest='packages', action='append', default=[],
+                            help='extract this package (name or file name) too, needs an indexed bundle')
+    add_metrics_arguments(cmd_import)
 
-    # args
-    args = parser.parse_args()
+    # command list
+    cmd_list = sp.add_parser('list', help='List members of an offline repository bundle.')
+    cmd_list.set_defaults(func=list_offline_bundle)
+    cmd_list.add_argument('bundle', type=str, help='repository bundle')
+
+    # command serve
+    cmd_serve = sp.add_parser('serve', help='Keep repository metadata loaded, run generate and lock for clients.')
+    cmd_serve.set_defaults(func=serve)
+    cmd_serve.add_argument('--refresh-interval', dest='refresh_interval', type=int, default=300,
+                           help='seconds between checks for changed repositories, default is 300')
+
+    return parser
+
+
+def run(parser, args):
     if hasattr(args, 'func'):
-        args.func(parser, args)
+        METRICS.reset(args.command, getattr(args, 'metrics_file', None), getattr(args, 'progress_file', None))
+        status = 'failed'
+        try:
+            with METRICS.phase(args.command):
+                args.func(parser, args)
+            status = 'ok'
+        except CommandError as e:
+            sys.stderr.write('{}\n'.format(e))
+            sys.exit(3)
+        finally:
+            # commands run in their own process groups, stop them on interrupt
+            cancel_all()
+            METRICS.finish(status)
     else:
         # no cmd fallback
         raise parser.error(NO_SUB_CMD_MSG)
 
 
+def execute(argv):
+    """Run a command line in this process, as the serve daemon does."""
+    parser = build_parser()
+    run(parser, parser.parse_args(argv))
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.command == 'serve':
+        # metrics are reported per command the daemon runs
+        args.func(parser, args)
+        return
+    if args.command in COMMANDS and not args.local:
+        # a running daemon has the metadata loaded already
+        status = submit(sys.argv[1:], os.getcwd())
+        if status is not None:
+            sys.exit(status)
+    run(parser, args)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,528 @@
+# coding: utf-8
+
+import io
+import os
+import gzip
+import json
+import time
+import zlib
+import struct
+import tarfile
+import subprocess
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .config import ROOT_LOGGER
+from .helper import cmd_exists
+
+logger = ROOT_LOGGER.getChild("archive")
+
+# compression -> archive suffix
+SUFFIXES = collections.OrderedDict([
+    ('gzip', '.tar.gz'),
+    ('zstd', '.tar.zst'),
+    ('xz', '.tar.xz'),
+    ('none', '.tar'),
+])
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'zstd': 3,
+    'xz': 6,
+    'none': 0,
+}
+
+# external programs used when the python module is missing
+EXTERNAL_COMPRESSORS = {
+    'zstd': ('zstd', ['zstd', '-q', '-c', '-T{jobs}', '-{level}'], ['zstd', '-q', '-d', '-c']),
+    'xz': ('xz', ['xz', '-c', '-T{jobs}', '-{level}'], ['xz', '-d', '-c']),
+}
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def compression_of(path):
+    """Guess compression of an archive by its suffix."""
+    if path.endswith('.tgz'):
+        return 'gzip'
+    for compression, suffix in SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def _gzip_block(data, level):
+    # every block is a complete gzip member, members concatenate into a valid stream
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def _xz_block(data, level):
+    return lzma.compress(data, preset=level)
+
+
+def _zstd_block(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+BLOCK_COMPRESSORS = {
+    'gzip': _gzip_block,
+    'xz': _xz_block,
+    'zstd': _zstd_block,
+}
+
+
+def _in_process(compression):
+    """Whether compression is handled by a python module."""
+    return compression == 'gzip' or \
+        (compression == 'xz' and lzma is not None) or \
+        (compression == 'zstd' and zstandard is not None)
+
+
+def check_compression(compression):
+    """Raise ValueError when compression can not be used on this machine."""
+    if compression not in SUFFIXES:
+        raise ValueError("unknown compression: {}".format(compression))
+    if compression == 'none' or _in_process(compression):
+        return
+    program = EXTERNAL_COMPRESSORS[compression][0]
+    if not cmd_exists(program):
+        raise ValueError("{} compression needs the python module or the {} command".format(compression, program))
+
+
+class ParallelBlockWriter(object):
+    """Write-only file object compressing fixed size blocks on a thread pool.
+
+    Compressed blocks are independent gzip members, xz streams or zstd
+    frames written in order, so the output is one valid compressed file.
+    zlib, lzma and zstandard release the GIL while compressing.
+    """
+
+    def __init__(self, fileobj, compression, level, jobs, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.compress = BLOCK_COMPRESSORS[compression]
+        self.level = level
+        self.jobs = jobs
+        self.block_size = block_size
+        self.pool = ThreadPool(jobs)
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffered = 0
+        self.written = 0
+        # offsets of written blocks and number of submitted blocks
+        self.offsets = []
+        self.submitted = 0
+
+    def _submit(self):
+        block = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.pending.append(self.pool.apply_async(self.compress, (block, self.level)))
+        self.submitted += 1
+        # bound memory to a few blocks per worker
+        while len(self.pending) > self.jobs * 2:
+            self._drain_one()
+
+    def _drain_one(self):
+        data = self.pending.popleft().get()
+        self.offsets.append(self.written)
+        self.fileobj.write(data)
+        self.written += len(data)
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self._submit()
+
+    def cut(self):
+        """End the current block, return the index of the next one."""
+        if self.buffered:
+            self._submit()
+        return self.submitted
+
+    def offset_of(self, index):
+        """Compressed offset of a block, only valid after flush."""
+        return self.offsets[index] if index < len(self.offsets) else self.written
+
+    def flush(self):
+        self.cut()
+        while self.pending:
+            self._drain_one()
+
+    def close(self):
+        self.flush()
+        self.pool.close()
+        self.pool.join()
+
+
+class ArchiveWriter(object):
+    """Stream a tar archive straight to its final path.
+
+    Data goes to <path>.part next to the target and is renamed into place
+    when complete, so no second copy is made.
+    """
+
+    def __init__(self, path, compression='gzip', level=None, jobs=None):
+        check_compression(compression)
+        self.path = path
+        self.compression = compression
+        self.level = DEFAULT_LEVELS[compression] if level is None else level
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.partpath = "{}.part".format(path)
+        self._file = None
+        self._stream = None
+        self._proc = None
+        self._tar = None
+
+    def _open_stream(self):
+        if self.compression == 'none':
+            return self._file
+        if _in_process(self.compression):
+            return ParallelBlockWriter(self._file, self.compression, self.level, self.jobs)
+
+        cmd = EXTERNAL_COMPRESSORS[self.compression][1]
+        cmd = [arg.format(jobs=self.jobs, level=self.level) for arg in cmd]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=self._file)
+        return self._proc.stdin
+
+    def open(self):
+        self._file = open(self.partpath, 'wb')
+        self._stream = self._open_stream()
+        self._tar = tarfile.open(fileobj=self._stream, mode='w|', format=tarfile.GNU_FORMAT)
+        return self
+
+    def add(self, path, arcname, recursive=True):
+        self._tar.add(path, arcname=arcname, recursive=recursive)
+
+    def close(self):
+        self._tar.close()
+        if self._stream is not self._file:
+            self._stream.close()
+        if self._proc is not None and self._proc.wait() != 0:
+            raise ValueError("compressor failed with code {}".format(self._proc.returncode))
+        self._file.close()
+        os.rename(self.partpath, self.path)
+        logger.info("archive written: {} ({} bytes)".format(self.path, os.path.getsize(self.path)))
+
+    def abort(self):
+        for f in (self._stream, self._file):
+            try:
+                if f is not None:
+                    f.close()
+            except Exception:
+                pass
+        if self._proc is not None:
+            self._proc.kill()
+        if os.path.exists(self.partpath):
+            os.remove(self.partpath)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# table of contents of indexed bundles, stored as a member of the archive
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+# trailing empty gzip member, its extra field holds "<toc offset><toc length>" in hex
+FOOTER_ID = b'RB'
+FOOTER_SIZE = 58
+
+
+def _gzip_footer(offset, length):
+    payload = "{:016x}{:016x}".format(offset, length).encode('ascii')
+    extra = FOOTER_ID + struct.pack('<H', len(payload)) + payload
+    header = b'\x1f\x8b\x08\x04' + b'\x00' * 4 + b'\x00\xff' + struct.pack('<H', len(extra)) + extra
+    c = zlib.compressobj(9, zlib.DEFLATED, -15)
+    return header + c.compress(b'') + c.flush() + struct.pack('<II', 0, 0)
+
+
+def _parse_footer(data):
+    if len(data) != FOOTER_SIZE or data[:4] != b'\x1f\x8b\x08\x04' or data[12:14] != FOOTER_ID:
+        return None
+    try:
+        payload = data[16:48].decode('ascii')
+        return int(payload[:16], 16), int(payload[16:], 16)
+    except ValueError:
+        return None
+
+
+def _member_type(tarinfo):
+    if tarinfo.isdir():
+        return 'dir'
+    if tarinfo.issym():
+        return 'symlink'
+    return 'file'
+
+
+class _IndexSink(object):
+    """Uncompressed side of an indexed archive, starts a new compressed
+    block for every tar member and records where it begins.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.entries = []
+        self.position = 0
+
+    def begin(self, tarinfo):
+        self.entries.append({
+            'name': tarinfo.name,
+            'type': _member_type(tarinfo),
+            'size': tarinfo.size,
+            'mode': tarinfo.mode,
+            'mtime': int(tarinfo.mtime),
+            'linkname': tarinfo.linkname,
+            'block': self.writer.cut(),
+            'header': None,
+        })
+
+    def write(self, data):
+        # tarfile writes all headers of a member in one call
+        if self.entries and self.entries[-1]['header'] is None:
+            self.entries[-1]['header'] = len(data)
+        self.writer.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+
+class _IndexingTarFile(tarfile.TarFile):
+
+    def addfile(self, tarinfo, fileobj=None):
+        self.fileobj.begin(tarinfo)
+        tarfile.TarFile.addfile(self, tarinfo, fileobj)
+
+
+class IndexedArchiveWriter(ArchiveWriter):
+    """Gzip tar archive whose members can be read without decompressing
+    the whole file, similar to eStargz.
+
+    Every member starts a new gzip member, an index of compressed offsets
+    is stored as the last tar member and located by a small empty gzip
+    member at the end of the file. The result is still a valid .tar.gz.
+    """
+
+    def __init__(self, path, compression='gzip', level=None, jobs=None, index_name=INDEX_FILE):
+        if compression != 'gzip':
+            raise ValueError("indexed archive supports gzip only, not {}".format(compression))
+        super(IndexedArchiveWriter, self).__init__(path, compression, level=level, jobs=jobs)
+        self.index_name = index_name
+        self._sink = None
+
+    def open(self):
+        self._file = open(self.partpath, 'wb')
+        self._stream = ParallelBlockWriter(self._file, self.compression, self.level, self.jobs)
+        self._sink = _IndexSink(self._stream)
+        self._tar = _IndexingTarFile(fileobj=self._sink, mode='w', format=tarfile.GNU_FORMAT)
+        return self
+
+    def _write_index(self):
+        self._stream.flush()
+        members = self._sink.entries
+        for entry in members:
+            entry['offset'] = self._stream.offset_of(entry.pop('block'))
+        # compressed length runs up to the next member
+        for i, entry in enumerate(members):
+            end = members[i + 1]['offset'] if i + 1 < len(members) else self._stream.written
+            entry['length'] = end - entry['offset']
+
+        data = json.dumps({'version': INDEX_VERSION, 'members': members}, sort_keys=True).encode('utf-8')
+        info = tarfile.TarInfo(self.index_name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+        return self._sink.entries[-1]['block']
+
+    def close(self):
+        index_block = self._write_index()
+        self._tar.close()
+        self._stream.close()
+        offset = self._stream.offset_of(index_block)
+        self._file.write(_gzip_footer(offset, self._stream.written - offset))
+        self._file.close()
+        os.rename(self.partpath, self.path)
+        logger.info("indexed archive written: {} ({} bytes)".format(self.path, os.path.getsize(self.path)))
+
+
+class IndexedArchive(object):
+    """Reader of archives written by IndexedArchiveWriter."""
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            location = self._read_footer(f)
+            if location is None:
+                raise ValueError("archive has no index: {}".format(path))
+            offset, length = location
+            if offset + length > f.tell() - FOOTER_SIZE:
+                raise ValueError("index out of the archive, truncated? {}".format(path))
+            try:
+                data = self._read_range(f, offset, length)
+                with tarfile.open(fileobj=io.BytesIO(data), mode='r:') as tar:
+                    self.index = json.loads(tar.extractfile(tar.next()).read().decode('utf-8'))
+                self.members = self.index['members']
+            except (zlib.error, tarfile.TarError, AttributeError, KeyError, TypeError, ValueError) as e:
+                raise ValueError("corrupt archive index in {}: {}".format(path, e))
+
+    @staticmethod
+    def _read_footer(f):
+        f.seek(0, os.SEEK_END)
+        if f.tell() < FOOTER_SIZE:
+            return None
+        f.seek(-FOOTER_SIZE, os.SEEK_END)
+        return _parse_footer(f.read(FOOTER_SIZE))
+
+    @classmethod
+    def is_indexed(cls, path):
+        if compression_of(path) != 'gzip':
+            return False
+        with open(path, 'rb') as f:
+            return cls._read_footer(f) is not None
+
+    def _iter_range(self, f, offset, length):
+        """Decompressed chunks of a compressed byte range of gzip members."""
+        f.seek(offset)
+        d = zlib.decompressobj(31)
+        while length > 0:
+            chunk = f.read(min(self.CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            while chunk:
+                yield d.decompress(chunk)
+                # continue with the next gzip member
+                chunk = d.unused_data
+                if chunk:
+                    d = zlib.decompressobj(31)
+
+    def _read_range(self, f, offset, length):
+        return b''.join(self._iter_range(f, offset, length))
+
+    def extract(self, dest, members=None):
+        """Extract the given index entries, or all of them, into dest.
+        Return the bytes of regular files written.
+        """
+        if members is None:
+            members = self.members
+        with open(self.path, 'rb') as f:
+            for entry in members:
+                self._extract_one(f, entry, dest)
+        return sum(entry['size'] for entry in members if entry['type'] == 'file')
+
+    def _extract_one(self, f, entry, dest):
+        name = entry['name']
+        if name.startswith('/') or '..' in name.split('/'):
+            raise ValueError("unsafe member name: {}".format(name))
+        path = os.path.join(dest, name)
+        if entry['type'] == 'dir':
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            return
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        if os.path.lexists(path):
+            os.remove(path)
+        if entry['type'] == 'symlink':
+            os.symlink(entry['linkname'], path)
+            return
+
+        skip, remain = entry['header'], entry['size']
+        with open(path, 'wb') as out:
+            for chunk in self._iter_range(f, entry['offset'], entry['length']):
+                if skip:
+                    n = min(skip, len(chunk))
+                    chunk, skip = chunk[n:], skip - n
+                if chunk and remain:
+                    out.write(chunk[:remain])
+                    remain -= min(remain, len(chunk))
+                if not skip and not remain:
+                    break
+        if remain:
+            raise ValueError("truncated member in archive: {}".format(name))
+        os.chmod(path, entry['mode'])
+        os.utime(path, (entry['mtime'], entry['mtime']))
+
+
+def list_archive(path):
+    """Return (name, size) of archive members, read from the index when
+    the archive has one.
+    """
+    if IndexedArchive.is_indexed(path):
+        return [(m['name'], m['size']) for m in IndexedArchive(path).members]
+    stream = open_archive(path)
+    try:
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            return [(m.name, m.size) for m in tar]
+    finally:
+        stream.close()
+
+
+class _ProcessReader(object):
+    """Read end of an external decompressor."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    def read(self, size=-1):
+        return self.proc.stdout.read(size)
+
+    def close(self):
+        self.proc.stdout.close()
+        self.proc.kill()
+        self.proc.wait()
+
+
+def open_archive(path):
+    """Open a bundle archive as a decompressed binary stream."""
+    compression = compression_of(path) or 'gzip'
+    check_compression(compression)
+    if compression == 'none':
+        return open(path, 'rb')
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'xz' and lzma is not None:
+        return lzma.open(path, 'rb')
+    if compression == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+
+    cmd = EXTERNAL_COMPRESSORS[compression][2]
+    return _ProcessReader(subprocess.Popen(cmd + [path], stdout=subprocess.PIPE))
+
+
+def extract_archive(path, dest):
+    """Extract a bundle archive into dest in a single streaming pass.
+    Return the bytes of regular files written.
+    """
+    stream = open_archive(path)
+    try:
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(dest, filter='data')
+            else:
+                tar.extractall(dest)
+            return sum(member.size for member in tar.getmembers() if member.isfile())
+    finally:
+        stream.close()
@@ -10,6 +10,7 @@ NAME = 'maker'
 CONFIG_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJ_DIR = os.path.abspath(os.path.dirname(CONFIG_DIR))
 HOME_DIR = os.path.abspath(os.path.expanduser('~'))
+CACHE_DIR = os.path.join(HOME_DIR, '.cache', 'rpm-repo-maker')
 
 
 class TERMColors:
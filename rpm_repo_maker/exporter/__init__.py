@@ -1,7 +1,12 @@
+from .base import RPMRepoExporter
+from .cache import PackageCache, ResolveCache, RootTemplate, MetadataCache
+from .scheduler import DownloadError
+from .lockfile import Lockfile
 from .pm_yum import YumPackageFinder, YumRepoExporter
 from .pm_dnf import DnfPackageFinder, DnfRepoExporter
 from .pm_dnf_kylin import DnfKylinPackageFinder
 from .pm_zypper_nir import ZypperNIRPackageFinder, ZypperNIRRepoExporter
+from .pm_offline import OfflinePackageFinder, OfflineRepoExporter
 
 
 FINDER = {
@@ -9,6 +14,7 @@ FINDER = {
     'dnf': DnfPackageFinder,
     'dnf-kylin': DnfKylinPackageFinder,
     'zypper-nir': ZypperNIRPackageFinder,
+    'offline': OfflinePackageFinder,
 }
 
 EXPORTER = {
@@ -16,4 +22,5 @@ EXPORTER = {
     'dnf': DnfRepoExporter,
     'dnf-kylin': DnfRepoExporter,
     'zypper-nir': ZypperNIRRepoExporter,
+    'offline': OfflineRepoExporter,
 }
@@ -0,0 +1,445 @@
+# coding: utf-8
+
+import os
+import fcntl
+import shutil
+import platform
+import tempfile
+
+from .cache import MetadataCache
+from .fetcher import HttpFetcher
+from .finder import PackageSpec
+from .journal import RunJournal
+from .mirrors import MirrorStats, build_pools
+from .planner import plan_downloads
+from .scheduler import DownloadScheduler, DownloadError
+from ..config import ROOT_LOGGER
+from ..archive import ArchiveWriter, IndexedArchiveWriter, SUFFIXES, INDEX_FILE, check_compression
+from ..helper import cmd_exists, file_checksum
+from ..manifest import BundleManifest, MANIFEST_FILE
+from ..metrics import METRICS
+from ..repodata import RepodataGenerator
+from ..rpmheader import read_header
+from ..runner import run_command, check_command
+
+
+class RPMRepoExporter(object):
+    """RPMRepoExporter
+    Export rpm repository into an archive from an online machine.
+    """
+
+    TEMP_DIR_PREFIX = 'repomaker'
+    REQUIRED_CMDS = []
+    # commands needed to download exact packages of a lockfile
+    EXACT_REQUIRED_CMDS = []
+    # package manager plugin commands needed for lockfiles, checked with --help
+    EXACT_REQUIRED_PLUGIN_CMDS = []
+    # packages per package manager invocation, 0 means one by one
+    BATCH_SIZE = 50
+    # parallel package manager invocations
+    JOBS = 1
+    # metadata cache inside an install root, shared by all workers when set
+    METADATA_CACHEDIR = None
+
+    logger = ROOT_LOGGER.getChild("exporter")
+
+    def __init__(self, name, path=None, platform_suffix=None, batch_size=None, jobs=None, cache=None, base=None,
+                 repodata='auto', compression='gzip', compress_level=None, compress_jobs=None, indexed=False,
+                 exact=False, downloader='auto', mirrors=None, mirrorlists=None, mirror_stats=None,
+                 workdir=None, resume=False, pm_timeout=None, root_cache=None):
+        self.name = name
+        self.path = os.path.abspath(path)
+        self.platform_suffix = platform_suffix
+        self.batch_size = self.BATCH_SIZE if batch_size is None else batch_size
+        self.jobs = jobs or self.JOBS
+        self.cache = cache
+        self.base = base
+        self.base_manifest = None
+        # repodata generator: auto, builtin or createrepo
+        self.repodata = repodata
+        self.compression = compression
+        self.compress_level = compress_level
+        self.compress_jobs = compress_jobs
+        # write a member index so importers can extract selectively
+        self.indexed = indexed
+        # packages are a locked closure, download them as they are
+        self.exact = exact
+        # auto, native (HttpFetcher) or pm (package manager)
+        self.downloader = downloader
+        self.fetch_jobs = jobs or HttpFetcher.JOBS
+        # seconds a package manager invocation may take, None waits forever
+        self.pm_timeout = pm_timeout
+        # directory keeping prepared install roots between runs, None prepares them per run
+        self.root_cache = root_cache
+        self.metadata = None
+        # extra base urls and mirrorlists by repo id, for the native downloader
+        self.mirrors = mirrors or {}
+        self.mirrorlists = mirrorlists or {}
+        self.mirror_stats = mirror_stats
+        # a stable work directory keeps a run journal, a failed run can be resumed
+        self.journal = None
+        self._workdir_lock = None
+        if workdir is None:
+            self.tempdir = tempfile.mkdtemp(prefix="{}-".format(self.TEMP_DIR_PREFIX))
+        else:
+            self.tempdir = os.path.abspath(workdir)
+            self._lock_workdir()
+            if not resume:
+                shutil.rmtree(self.tempdir, ignore_errors=True)
+            if not os.path.isdir(self.tempdir):
+                os.makedirs(self.tempdir)
+            self.journal = RunJournal(self.tempdir)
+
+    def _lock_workdir(self):
+        """Hold an exclusive lock on the work directory until the run ends,
+        a second run of it fails instead of removing the files of the first.
+        The lock file sits next to the directory, which is removed and rebuilt.
+        """
+        parent = os.path.dirname(self.tempdir)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        fd = os.open(self.tempdir + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            raise ValueError("work directory {} is used by another run".format(self.tempdir))
+        self._workdir_lock = fd
+
+    def release(self):
+        """Release the lock of the work directory."""
+        if self._workdir_lock is not None:
+            fcntl.flock(self._workdir_lock, fcntl.LOCK_UN)
+            os.close(self._workdir_lock)
+            self._workdir_lock = None
+
+    def prepare(self):
+        # check
+        if not os.path.exists(self.path):
+            raise ValueError("path not exist: {}".format(self.path))
+        if not os.path.isdir(self.path):
+            raise ValueError("path is not a valid directory: {}".format(self.path))
+        if self.path is None:
+            self.path = os.path.abspath(os.getcwd())
+        for cmd in self.REQUIRED_CMDS + (self.EXACT_REQUIRED_CMDS if self.exact else []):
+            if not cmd_exists(cmd):
+                raise ValueError("command not found: {}".format(cmd))
+        for cmd in (self.EXACT_REQUIRED_PLUGIN_CMDS if self.exact else []):
+            if not run_command("{} --help".format(cmd)).ok:
+                raise ValueError("command not found: {}, is its plugin installed?".format(cmd))
+        check_compression(self.compression)
+        if self.indexed and self.compression != 'gzip':
+            raise ValueError("indexed bundle needs gzip compression, not {}".format(self.compression))
+        if self.base:
+            self.base_manifest = BundleManifest.load(self.base)
+            if self.base_manifest is None:
+                raise ValueError("base bundle has no manifest: {}".format(self.base))
+
+    def resolved(self):
+        """Package list recorded by an interrupted run, None if not resolved yet."""
+        event = self.journal.get('resolve') if self.journal is not None else None
+        if event is None:
+            return None
+        self.logger.info("Resuming with {} resolved packages".format(len(event['packages'])))
+        return [PackageSpec.from_dict(data) for data in event['packages']]
+
+    def record_resolved(self, pkg_list):
+        if self.journal is not None:
+            self.journal.mark('resolve', packages=[pkg.to_dict() for pkg in pkg_list])
+
+    def _done(self, phase):
+        return self.journal is not None and self.journal.done(phase)
+
+    def _mark(self, phase):
+        if self.journal is not None:
+            self.journal.mark(phase)
+
+    def get_releasever(self):
+        distro = platform.linux_distribution()
+        return distro[1].split('.')[0]
+
+    def metadata_cache(self):
+        """Metadata cache of this package manager and release, kept in the
+        root cache between runs or else in the temp directory for this run.
+        """
+        name = "{}-{}".format(os.path.basename(self.METADATA_CACHEDIR), self.get_releasever())
+        if self.root_cache is not None:
+            root = os.path.join(self.root_cache, 'metadata', name)
+        else:
+            root = os.path.join(self.tempdir, 'metadata')
+        return MetadataCache(root, self.METADATA_CACHEDIR, self.refresh_metadata)
+
+    def prepare_installroot(self, installroot):
+        if self.METADATA_CACHEDIR is None:
+            return
+        if self.metadata is None:
+            self.metadata = self.metadata_cache()
+        self.metadata.clone(installroot)
+
+    def refresh_metadata(self, installroot):
+        """Fetch repository metadata into the cache of installroot."""
+        check_command(self.makecache_cmd(installroot), timeout=self.pm_timeout)
+
+    def makecache_cmd(self, installroot):
+        """Command fetching repository metadata into the cache of installroot."""
+        raise NotImplementedError
+
+    def download_cmd(self, installroot, downloaddir, pkgs):
+        """Command downloading packages with dependencies into downloaddir."""
+        raise NotImplementedError
+
+    def exact_download_cmd(self, downloaddir, pkgs):
+        """Command downloading exactly the given packages, without dependencies."""
+        raise ValueError("{} does not support lockfiles".format(self.__class__.__name__))
+
+    def collect(self, installroot, workdir, downloaddir):
+        """Gather packages downloaded by one worker into downloaddir."""
+        if not os.path.isdir(workdir):
+            return
+        for fn in os.listdir(workdir):
+            os.rename(os.path.join(workdir, fn), os.path.join(downloaddir, fn))
+
+    def download_unit(self, installroot, workdir, pkgs):
+        """Download a unit of packages, a failed batch is retried one package
+        at a time. Return a list of (package, reason) failures.
+        """
+        self.logger.info("Downloading package {} ...".format(" ".join(str(pkg) for pkg in pkgs)))
+        if self.exact:
+            cmd = self.exact_download_cmd(workdir, pkgs)
+        else:
+            cmd = self.download_cmd(installroot, workdir, pkgs)
+        result = run_command(cmd, timeout=self.pm_timeout)
+        if result.ok:
+            return []
+        if len(pkgs) == 1:
+            return [(pkgs[0], result.reason)]
+
+        self.logger.warning("batch download failed, falling back to one by one")
+        failures = []
+        for pkg in pkgs:
+            failures.extend(self.download_unit(installroot, workdir, [pkg]))
+        return failures
+
+    def use_native(self, pkg_list):
+        """Whether packages are fetched over http instead of the package manager."""
+        if self.downloader == 'pm' or not self.exact:
+            return False
+        has_urls = all(pkg.url and pkg.url.startswith(('http://', 'https://', 'file://')) for pkg in pkg_list)
+        if self.downloader == 'native' and not has_urls:
+            raise ValueError("native downloader needs http urls of all packages")
+        return has_urls
+
+    def download(self, downloaddir, pkg_list):
+        """Download packages in as few package manager invocations as possible,
+        spread over a pool of workers with private install roots.
+        Packages found in the package cache are linked instead of downloaded.
+        Only a complete closure (exact mode) skips them, otherwise the package
+        manager still resolves every spec, as it pulls in the dependencies
+        the finder left out for being installed on this host.
+        """
+        wanted = list(pkg_list)
+        complete = self.exact
+        if not os.path.isdir(downloaddir):
+            os.makedirs(downloaddir)
+        if self.journal is not None:
+            kept = self.checkpoint(downloaddir, pkg_list, leftovers=True)
+            if complete:
+                pkg_list = [pkg for pkg in pkg_list if pkg.filename not in kept]
+            METRICS.count('packages_resumed', len(kept))
+        if self.cache is not None:
+            served = set(self.cache.fetch(pkg_list, downloaddir))
+            if complete:
+                pkg_list = [pkg for pkg in pkg_list if pkg not in served]
+            METRICS.count('packages_cached', len(served))
+        present = set(os.listdir(downloaddir))
+        total = len(pkg_list)
+        METRICS.progress(done=0, total=total)
+
+        if self.use_native(pkg_list):
+            self.logger.info("Fetching {} packages with {} connections ...".format(len(pkg_list), self.fetch_jobs))
+            stats = MirrorStats(self.mirror_stats)
+            pools = build_pools(pkg_list, stats, self.mirrors, self.mirrorlists)
+            fetcher = HttpFetcher(self.fetch_jobs, mirrors=pools, stats=stats)
+            failures = fetcher.fetch_all(pkg_list, downloaddir)
+            METRICS.count('bytes_downloaded', fetcher.downloaded)
+            if failures:
+                for pkg, reason in failures:
+                    self.logger.error("download {} failed: {}".format(pkg, reason))
+                raise DownloadError(failures)
+            if self.journal is not None:
+                self.checkpoint(downloaddir, wanted)
+            if self.cache is not None:
+                self.cache.store(downloaddir)
+            return
+
+        units = plan_downloads(pkg_list, self.batch_size)
+        scheduler = DownloadScheduler(self.jobs)
+        slots = scheduler.slots(units)
+        self.logger.info("Downloading {} packages in {} invocations with {} workers ...".format(
+            len(pkg_list), len(units), slots))
+
+        workers = []
+        for slot in range(slots):
+            installroot = os.path.join(self.tempdir, 'installroot-{}'.format(slot))
+            workdir = os.path.join(self.tempdir, 'download-{}'.format(slot))
+            if not self.exact:
+                self.prepare_installroot(installroot)
+            workers.append((installroot, workdir))
+
+        def work(slot, pkgs):
+            installroot, workdir = workers[slot]
+            failures = self.download_unit(installroot, workdir, pkgs)
+            METRICS.progress(done=METRICS.count('packages_downloaded', len(pkgs) - len(failures)), total=total)
+            return failures
+
+        failures = scheduler.run(units, work)
+        if failures:
+            for pkg, reason in failures:
+                self.logger.error("download {} failed: {}".format(pkg, reason))
+            raise DownloadError(failures)
+
+        # merge results before creating repository
+        for installroot, workdir in workers:
+            self.collect(installroot, workdir, downloaddir)
+        METRICS.count('bytes_downloaded', sum(
+            os.path.getsize(os.path.join(downloaddir, fn)) for fn in os.listdir(downloaddir) if fn not in present))
+        if self.journal is not None:
+            self.checkpoint(downloaddir, wanted)
+        if self.exact:
+            self.verify(downloaddir, wanted)
+        if self.cache is not None:
+            self.cache.store(downloaddir)
+
+    def checkpoint(self, downloaddir, pkg_list, leftovers=False):
+        """Journal intact package files of downloaddir, delete broken ones.
+        With leftovers, first collect what workers of an interrupted run
+        had downloaded. Return names of the kept files.
+        """
+        if leftovers:
+            for fn in sorted(os.listdir(self.tempdir)):
+                if fn.startswith('download-'):
+                    installroot = os.path.join(self.tempdir, 'installroot-{}'.format(fn[len('download-'):]))
+                    self.collect(installroot, os.path.join(self.tempdir, fn), downloaddir)
+
+        journaled = self.journal.downloads()
+        expected = dict((pkg.filename, pkg) for pkg in pkg_list if pkg.filename)
+        kept = set()
+        for fn in sorted(os.listdir(downloaddir)):
+            path = os.path.join(downloaddir, fn)
+            if not fn.endswith('.rpm') or not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            if fn in journaled and journaled[fn][0] == size:
+                kept.add(fn)
+                continue
+            pkg = expected.get(fn)
+            try:
+                read_header(path)
+                intact = not (pkg and pkg.checksum) or file_checksum(path, pkg.checksum_type) == pkg.checksum
+            except ValueError:
+                intact = False
+            if not intact:
+                self.logger.warning("dropping broken download {}".format(fn))
+                os.remove(path)
+                continue
+            self.journal.mark('download', file=fn, size=size, sha256=file_checksum(path))
+            kept.add(fn)
+        if leftovers and kept:
+            self.logger.info("Resuming with {} packages already downloaded".format(len(kept)))
+        return kept
+
+    def verify(self, downloaddir, pkg_list):
+        """Check downloaded packages against their locked checksums."""
+        for pkg in pkg_list:
+            path = os.path.join(downloaddir, pkg.filename)
+            if not os.path.isfile(path):
+                raise ValueError("locked package not downloaded: {}".format(pkg.nevra))
+            if file_checksum(path, pkg.checksum_type) != pkg.checksum:
+                raise ValueError("checksum mismatch of locked package: {}".format(pkg.nevra))
+
+    def createrepo(self, downloaddir):
+        self.logger.info("Creating repository ...")
+        repodata = self.repodata
+        if repodata == 'auto':
+            repodata = 'createrepo' if cmd_exists('createrepo') else 'builtin'
+        if repodata == 'builtin':
+            RepodataGenerator(meta_cache=self.cache).generate(downloaddir)
+        else:
+            check_command("createrepo --database {}".format(downloaddir))
+
+    def target_path(self, delta=False):
+        """Bundle path without archive suffix."""
+        target_tarfile = self.name
+        if self.platform_suffix:
+            target_tarfile = "{}.{}".format(target_tarfile, self.platform_suffix)
+        if delta:
+            target_tarfile = "{}.delta".format(target_tarfile)
+        return os.path.join(self.path, target_tarfile)
+
+    def archive(self, members, target_tarpath):
+        """Archive manifest, repodata and the given rpm files.
+        The manifest goes first so importers can read it cheaply.
+        """
+        self.logger.info("Making archive ...")
+        downloaddir = os.path.join(self.tempdir, self.name)
+        if self.indexed:
+            writer = IndexedArchiveWriter(target_tarpath, level=self.compress_level, jobs=self.compress_jobs,
+                                          index_name="{}/{}".format(self.name, INDEX_FILE))
+        else:
+            writer = ArchiveWriter(target_tarpath, self.compression, level=self.compress_level,
+                                   jobs=self.compress_jobs)
+        with writer:
+            writer.add(os.path.join(downloaddir, MANIFEST_FILE), "{}/{}".format(self.name, MANIFEST_FILE))
+            writer.add(os.path.join(downloaddir, 'repodata'), "{}/repodata".format(self.name))
+            for fn in members:
+                writer.add(os.path.join(downloaddir, fn), "{}/{}".format(self.name, fn))
+
+    def make(self, pkg_list):
+        downloaddir = os.path.join(self.tempdir, self.name)
+        if not self._done('downloaded'):
+            with METRICS.phase('download'):
+                self.download(downloaddir, pkg_list)
+            self._mark('downloaded')
+        if not self._done('createrepo'):
+            with METRICS.phase('createrepo'):
+                self.createrepo(downloaddir)
+            self._mark('createrepo')
+
+        manifest = BundleManifest.from_dir(self.name, downloaddir)
+        members = sorted(manifest.packages)
+        if self.base_manifest is not None:
+            # repodata stays complete, it describes the merged repository
+            manifest, members = manifest.delta(self.base_manifest)
+            self.logger.info("Delta bundle: {} of {} packages changed, {} removed".format(
+                len(members), len(manifest.packages), len(manifest.removed)))
+        manifest.save(os.path.join(downloaddir, MANIFEST_FILE))
+
+        target = self.target_path(delta=manifest.is_delta)
+        with METRICS.phase('archive'):
+            self.archive(members, target + SUFFIXES[self.compression])
+        manifest.save(target + '.manifest.json')
+        METRICS.count('packages_archived', len(members))
+        METRICS.count('bytes_written', os.path.getsize(target + SUFFIXES[self.compression]))
+        self._mark('archive')
+
+    def cleanup(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def __call__(self, pkg_list):
+        try:
+            self.prepare()
+
+            self.logger.info("Exporter's temp directory is {}".format(self.tempdir))
+            try:
+                self.make(pkg_list)
+            except Exception as e:
+                if self.journal is not None:
+                    self.logger.error("Work directory {} is kept, rerun with --resume to continue".format(
+                        self.tempdir))
+                else:
+                    self.cleanup()
+                raise e
+            else:
+                self.cleanup()
+        finally:
+            self.release()
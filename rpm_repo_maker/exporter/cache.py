@@ -0,0 +1,470 @@
+import os
+import json
+import time
+import errno
+import hashlib
+import fcntl
+import shutil
+import tempfile
+
+from ..config import ROOT_LOGGER
+from .. import fileops
+from ..fileops import link_or_copy
+from ..helper import file_checksum
+from ..metrics import METRICS
+from ..rpmheader import read_header
+
+
+class PackageCache(object):
+    """Persistent content addressed rpm cache shared by generate runs.
+
+    Packages are keyed by NEVRA plus sha256 and stored under objects/, the
+    index keeps size and last use time for LRU eviction. Every index change
+    and every link out of the cache happens under an exclusive flock, so
+    several processes can share one cache directory.
+    """
+
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = '.lock'
+
+    logger = ROOT_LOGGER.getChild("cache")
+
+    def __init__(self, root, max_size):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._served = set()
+        # file name -> cache object of packages fetched or stored by this run
+        self._objects = {}
+        for sub in ('objects', 'tmp'):
+            path = os.path.join(self.root, sub)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    @staticmethod
+    def make_key(nevra, checksum):
+        return "{}@{}".format(nevra, checksum)
+
+    def _object_path(self, nevra, checksum):
+        return os.path.join(self.root, 'objects', checksum[:2], "{}-{}.rpm".format(checksum, nevra))
+
+    def _lock(self):
+        fd = os.open(os.path.join(self.root, self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _unlock(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _load_index(self):
+        path = os.path.join(self.root, self.INDEX_FILE)
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            self.logger.warning("broken cache index, starting over: {}".format(path))
+            return {}
+
+    def _save_index(self, index):
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp, os.path.join(self.root, self.INDEX_FILE))
+
+    def _find(self, index, pkg):
+        """Return index key of a package spec, verifying non sha256 checksums."""
+        nevra = getattr(pkg, 'nevra', None)
+        checksum = getattr(pkg, 'checksum', None)
+        if not nevra or not checksum:
+            return None
+        if pkg.checksum_type == 'sha256':
+            key = self.make_key(nevra, checksum)
+            return key if key in index else None
+        for key, entry in index.items():
+            if entry['nevra'] != nevra:
+                continue
+            path = os.path.join(self.root, entry['file'])
+            if file_checksum(path, pkg.checksum_type) == checksum:
+                return key
+        return None
+
+    def _intact(self, path, entry):
+        """Whether the object of an entry is still there with its size,
+        a truncated object is removed.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            # removed behind our back
+            return False
+        if size == entry['size']:
+            return True
+        self.logger.warning("dropping corrupt cache object {}".format(path))
+        for fn in (path, path + '.json'):
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+        return False
+
+    def fetch(self, pkg_list, downloaddir):
+        """Link cached packages into downloaddir, return the packages served."""
+        served = []
+        fd = self._lock()
+        try:
+            index = self._load_index()
+            now = time.time()
+            for pkg in pkg_list:
+                key = self._find(index, pkg)
+                if key is None:
+                    self.misses += 1
+                    continue
+                entry = index[key]
+                src = os.path.join(self.root, entry['file'])
+                if not self._intact(src, entry):
+                    del index[key]
+                    self.misses += 1
+                    continue
+                dst = os.path.join(downloaddir, pkg.filename)
+                if not os.path.exists(dst):
+                    link_or_copy(src, dst)
+                self._objects[pkg.filename] = src
+                entry['atime'] = now
+                served.append(pkg)
+                self._served.add(pkg.filename)
+                self.hits += 1
+            self._save_index(index)
+        finally:
+            self._unlock(fd)
+        self.logger.info("package cache: {} hits, {} misses".format(self.hits, self.misses))
+        return served
+
+    def store(self, downloaddir):
+        """Add every rpm of downloaddir to the cache."""
+        added = 0
+        fd = self._lock()
+        try:
+            index = self._load_index()
+            now = time.time()
+            for fn in sorted(os.listdir(downloaddir)):
+                path = os.path.join(downloaddir, fn)
+                if not fn.endswith('.rpm') or fn in self._served or not os.path.isfile(path):
+                    continue
+                try:
+                    nevra = read_header(path).nevra
+                except ValueError as e:
+                    self.logger.warning("skip caching {}: {}".format(fn, e))
+                    continue
+                checksum = file_checksum(path)
+                key = self.make_key(nevra, checksum)
+                if key in index:
+                    index[key]['atime'] = now
+                    self._objects[fn] = os.path.join(self.root, index[key]['file'])
+                    continue
+                obj = self._object_path(nevra, checksum)
+                if not os.path.isdir(os.path.dirname(obj)):
+                    os.makedirs(os.path.dirname(obj))
+                # stage then rename, readers never see a partial object
+                tmp = os.path.join(self.root, 'tmp', "{}.{}".format(os.path.basename(obj), os.getpid()))
+                link_or_copy(path, tmp)
+                os.rename(tmp, obj)
+                self._objects[fn] = obj
+                index[key] = {
+                    'nevra': nevra,
+                    'file': os.path.relpath(obj, self.root),
+                    'size': os.path.getsize(obj),
+                    'atime': now,
+                }
+                added += 1
+            self._evict(index)
+            self._save_index(index)
+        finally:
+            self._unlock(fd)
+        self.logger.info("package cache: {} packages added".format(added))
+
+    def _evict(self, index):
+        """Drop least recently used packages until the cache fits max_size."""
+        total = sum(entry['size'] for entry in index.values())
+        if total <= self.max_size:
+            return
+        for key in sorted(index, key=lambda k: index[k]['atime']):
+            if total <= self.max_size:
+                break
+            entry = index.pop(key)
+            for path in (entry['file'], entry['file'] + '.json'):
+                try:
+                    os.remove(os.path.join(self.root, path))
+                except OSError:
+                    pass
+            total -= entry['size']
+            self.logger.debug("evicted {}".format(key))
+
+    def _object_of(self, path):
+        """Cache object holding the same content as path, if known."""
+        obj = self._objects.get(os.path.basename(path))
+        if obj is None:
+            return None
+        try:
+            st, obj_st = os.stat(path), os.stat(obj)
+        except OSError:
+            return None
+        if (st.st_size, int(st.st_mtime)) != (obj_st.st_size, int(obj_st.st_mtime)):
+            return None
+        return obj
+
+    def get(self, path):
+        """Cached repodata of a package file, see repodata.RepodataGenerator."""
+        obj = self._object_of(path)
+        if obj is None or not os.path.isfile(obj + '.json'):
+            return None
+        try:
+            with open(obj + '.json') as f:
+                pkg = json.load(f)
+        except ValueError:
+            return None
+        pkg['location'] = os.path.basename(path)
+        return pkg
+
+    def put(self, path, pkg):
+        """Store repodata of a package file next to its cache object."""
+        obj = self._object_of(path)
+        if obj is None:
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(pkg, f)
+        os.rename(tmp, obj + '.json')
+
+
+class ResolveCache(object):
+    """Persistent dependency resolution results.
+
+    One file per resolved transaction, the closure of the items planned
+    together by `_plan_transactions`; the zypper finder stores one per
+    request instead. The key covers the finder class, whether the closure
+    ignores the installed packages (lockfiles), the item specs of the
+    transaction or request and the repomd checksum of every enabled
+    repository, so a result is reused only while neither the items nor the
+    repository metadata changed. Entries unused for MAX_AGE seconds are
+    removed.
+    """
+
+    MAX_AGE = 30 * 24 * 3600
+
+    logger = ROOT_LOGGER.getChild("resolve-cache")
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self._prune()
+
+    def _prune(self):
+        deadline = time.time() - self.MAX_AGE
+        for fn in os.listdir(self.root):
+            path = os.path.join(self.root, fn)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def make_key(finder, item, revisions):
+        data = json.dumps([finder, item, revisions], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return cached packages as a list of dicts, None on miss."""
+        path = os.path.join(self.root, "{}.json".format(key))
+        try:
+            with open(path) as f:
+                packages = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        # keep recently used entries from being pruned
+        os.utime(path, None)
+        self.hits += 1
+        return packages
+
+    def put(self, key, packages):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(packages, f)
+        os.rename(tmp, os.path.join(self.root, "{}.json".format(key)))
+
+    def report(self):
+        self.logger.info("resolve cache: {} hits, {} misses".format(self.hits, self.misses))
+
+
+class RootTemplate(object):
+    """Install root prepared from host directories, shared by generate runs.
+
+    The template is copied once and kept with a fingerprint of the names,
+    sizes and modification times of the host files; it is rebuilt only
+    when one of them changed. Runs get clones of it: directories listed in
+    `shared` are hard linked and must not be written to, the others are
+    copied, which is a reflink on btrfs and xfs.
+    """
+
+    LOCK_FILE = '.lock'
+    FINGERPRINT_FILE = 'fingerprint'
+
+    logger = ROOT_LOGGER.getChild("root-template")
+
+    def __init__(self, root, sources, shared=()):
+        self.root = os.path.abspath(root)
+        # (path inside the install root, host path) pairs
+        self.sources = [(path, os.path.realpath(source)) for path, source in sources]
+        self.shared = set(shared)
+        self.tree = os.path.join(self.root, 'tree')
+        self._ready = False
+        fileops.makedirs(self.root)
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for path, source in self.sources:
+            digest.update("{}={}\n".format(path, source).encode('utf-8'))
+            if not os.path.isdir(source):
+                continue
+            for fn in sorted(fileops.walk_files(source)):
+                st = os.stat(fn)
+                digest.update("{} {} {!r}\n".format(fn, st.st_size, st.st_mtime).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _stored_fingerprint(self):
+        try:
+            with open(os.path.join(self.root, self.FINGERPRINT_FILE)) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _build(self, fingerprint):
+        self.logger.info("Building install root template {} ...".format(self.tree))
+        tmp = tempfile.mkdtemp(dir=self.root, prefix='.tmp-')
+        for path, source in self.sources:
+            target = os.path.join(tmp, path)
+            if os.path.isdir(source):
+                fileops.copy_tree(source, target)
+            else:
+                fileops.makedirs(target)
+        if os.path.isdir(self.tree):
+            old = tempfile.mkdtemp(dir=self.root, prefix='.old-')
+            os.rename(self.tree, os.path.join(old, 'tree'))
+            shutil.rmtree(old)
+        os.rename(tmp, self.tree)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(fingerprint)
+        os.rename(tmp, os.path.join(self.root, self.FINGERPRINT_FILE))
+        METRICS.count('root_templates_built')
+
+    def clone(self, installroot):
+        """Make installroot a clone of the template, rebuilding it first if
+        the host files changed since it was built.
+        """
+        fd = os.open(os.path.join(self.root, self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if not self._ready:
+                fingerprint = self.fingerprint()
+                if fingerprint != self._stored_fingerprint() or not os.path.isdir(self.tree):
+                    self._build(fingerprint)
+                self._ready = True
+            for path, _ in self.sources:
+                fileops.copy_tree(os.path.join(self.tree, path), os.path.join(installroot, path),
+                                  link=path in self.shared)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+class MetadataCache(object):
+    """Repository metadata shared by the download invocations of exporters.
+
+    A private install root keeps the package manager cache, refreshed by
+    `refresh(installroot)` when older than max_age seconds or when the
+    repository configuration in config_dirs changed. Workers get hard
+    linked clones of its cache directory, so N invocations cost one
+    metadata fetch; they must be told never to expire the metadata, or the
+    package manager would fetch it again into the clone.
+    """
+
+    LOCK_FILE = '.lock'
+    STAMP_FILE = 'refreshed'
+    MAX_AGE = 6 * 3600
+    CONFIG_DIRS = ('/etc/yum.repos.d', '/etc/zypp/repos.d')
+
+    logger = ROOT_LOGGER.getChild("metadata-cache")
+
+    def __init__(self, root, cachedir, refresh, max_age=None, config_dirs=None):
+        self.root = os.path.abspath(root)
+        # cache directory relative to an install root, e.g. var/cache/dnf
+        self.cachedir = cachedir
+        self.refresh = refresh
+        self.max_age = self.MAX_AGE if max_age is None else max_age
+        self.config_dirs = self.CONFIG_DIRS if config_dirs is None else config_dirs
+        self.tree = os.path.join(self.root, 'installroot')
+        self._ready = False
+        fileops.makedirs(self.tree)
+
+    def fingerprint(self):
+        """Hash of the names and contents of the repository configuration files."""
+        digest = hashlib.sha256()
+        for config_dir in self.config_dirs:
+            if not os.path.isdir(config_dir):
+                continue
+            for fn in sorted(fileops.walk_files(config_dir)):
+                digest.update("{}\n".format(fn).encode('utf-8'))
+                with open(fn, 'rb') as f:
+                    digest.update(f.read())
+        return digest.hexdigest()
+
+    def _stale(self, fingerprint):
+        stamp = os.path.join(self.root, self.STAMP_FILE)
+        try:
+            refreshed = os.path.getmtime(stamp)
+            with open(stamp) as f:
+                lines = f.read().split()
+        except (IOError, OSError):
+            return True
+        if lines[1:2] != [fingerprint]:
+            self.logger.info("Repository configuration changed since the last refresh")
+            return True
+        return time.time() - refreshed > self.max_age
+
+    def clone(self, installroot):
+        """Link the metadata into installroot, refreshing it first if expired."""
+        fd = os.open(os.path.join(self.root, self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if not self._ready:
+                fingerprint = self.fingerprint()
+                if self._stale(fingerprint):
+                    self.logger.info("Refreshing repository metadata in {} ...".format(self.tree))
+                    self.refresh(self.tree)
+                    with open(os.path.join(self.root, self.STAMP_FILE), 'w') as f:
+                        f.write("{}\n{}\n".format(time.time(), fingerprint))
+                    METRICS.count('metadata_refreshes')
+                self._ready = True
+            source = os.path.join(self.tree, self.cachedir)
+            fileops.makedirs(source)
+            fileops.copy_tree(source, os.path.join(installroot, self.cachedir), link=True)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
@@ -0,0 +1,342 @@
+import os
+import time
+import shutil
+import platform
+import tempfile
+
+from .repoindex import PackageIndex, RepoSource, compatible_arches
+from .solver import Solver
+from .versionindex import VersionIndex
+from ..config import CACHE_DIR, ROOT_LOGGER
+from ..helper import file_checksum
+
+
+class ResolveEngine(object):
+    """Dependency resolution engine.
+
+    The package sack is loaded once per engine, every package is then resolved
+    with a fresh goal (transaction) on that shared sack. With `empty_root`
+    the installed packages of this host are ignored, so the result is the
+    complete closure a bare install root needs.
+    """
+
+    logger = ROOT_LOGGER.getChild("engine")
+    # whether forked processes may use a sack loaded before the fork
+    FORK_SAFE = True
+
+    def __init__(self, empty_root=False):
+        self.empty_root = empty_root
+        self.loaded = False
+        self.sack_loads = 0
+        self.resolve_times = []
+        # kept loaded across resolutions by an EnginePool
+        self.persistent = False
+        # revisions the loaded sack was made of, kept by persistent engines
+        self.sack_revisions = None
+        # architectures of this host, best first
+        self.arches = compatible_arches(platform.machine())
+        # name -> VersionIndex of the loaded sack
+        self.indexes = {}
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _revisions(self):
+        raise NotImplementedError
+
+    def _query(self, name):
+        raise NotImplementedError
+
+    def _resolve(self, pkg_objs):
+        """Packages of one transaction installing pkg_objs, raise ValueError
+        if they cannot be installed (together).
+        """
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def package_info(self, pkg_obj):
+        """Return repoid, size, location and url of a package."""
+        raise NotImplementedError
+
+    def load(self):
+        """Load repositories and fill the sack, only once."""
+        if self.loaded:
+            return
+        start = time.time()
+        self._load()
+        self.loaded = True
+        self.sack_loads += 1
+        if self.persistent:
+            # what the loaded sack was made of, refreshes compare against it
+            self.sack_revisions = self._revisions()
+        self.logger.info("sack loaded in {:.2f}s".format(time.time() - start))
+
+    def revisions(self):
+        """Return {repo id: repomd.xml sha256} of enabled repositories.
+        Refreshes expired repomd files, but does not load the sack. A pooled
+        engine reports the revisions of its loaded sack instead.
+        """
+        if self.sack_revisions is not None:
+            return self.sack_revisions
+        return self._revisions()
+
+    def query(self, name):
+        """Return all available packages of a name."""
+        self.load()
+        return list(self._query(name))
+
+    def version_index(self, name):
+        """Return the VersionIndex of a name, built once per loaded sack."""
+        index = self.indexes.get(name)
+        if index is None:
+            index = self.indexes[name] = VersionIndex(self.query(name), self.arches)
+        return index
+
+    def resolve(self, pkg_objs):
+        """Return packages of one install transaction of the packages."""
+        self.load()
+        start = time.time()
+        pkgs = list(self._resolve(pkg_objs))
+        elapsed = time.time() - start
+        label = " ".join("{}-{}".format(pkg_obj.name, pkg_obj.version) for pkg_obj in pkg_objs)
+        self.resolve_times.append((label, elapsed))
+        self.logger.info("resolved {} in {:.2f}s, {} packages".format(label, elapsed, len(pkgs)))
+        return pkgs
+
+    def report(self):
+        total = sum(elapsed for _, elapsed in self.resolve_times)
+        self.logger.info("resolved {} transactions with {} sack load(s) in {:.2f}s".format(
+            len(self.resolve_times), self.sack_loads, total))
+
+    def close(self):
+        self._close()
+        self.loaded = False
+        self.indexes = {}
+        self.sack_revisions = None
+
+    def __enter__(self):
+        if self.persistent:
+            # statistics are per resolution, the sack is not
+            self.sack_loads = 0
+            self.resolve_times = []
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.persistent:
+            self.close()
+
+
+class EnginePool(object):
+    """Engines kept loaded between commands, used by the serve daemon.
+
+    Pooled engines are not closed after a resolution, the next one reuses
+    their sack. refresh() reloads the sacks whose repositories changed
+    since they were loaded, so they are warm again before the next command.
+    """
+
+    logger = ResolveEngine.logger.getChild("pool")
+
+    def __init__(self):
+        self.engines = {}
+
+    def get(self, key, factory):
+        engine = self.engines.get(key)
+        if engine is None:
+            engine = factory()
+            engine.persistent = True
+            self.engines[key] = engine
+        return engine
+
+    def refresh(self):
+        for key, engine in sorted(self.engines.items()):
+            try:
+                revisions = engine._revisions()
+                if engine.loaded and revisions == engine.sack_revisions:
+                    continue
+                start = time.time()
+                engine.close()
+                engine.load()
+            except Exception as e:
+                self.logger.warning("refreshing engine {} failed: {}".format(key, e))
+                continue
+            self.logger.info("engine {} reloaded in {:.2f}s".format(key, time.time() - start))
+
+    def close(self):
+        for engine in self.engines.values():
+            engine.close()
+        self.engines = {}
+
+
+class YumResolveEngine(ResolveEngine):
+    # the sack keeps sqlite connections open, sqlite does not support them across fork
+    FORK_SAFE = False
+
+    def __init__(self, empty_root=False):
+        super(YumResolveEngine, self).__init__(empty_root=empty_root)
+        self.yb = None
+        self.root = None
+
+    def _setup(self):
+        if self.yb is None:
+            import yum
+
+            self.yb = yum.YumBase()
+            if self.empty_root:
+                # an empty root has no release package, keep the host one
+                releasever = self.yb.conf.yumvar['releasever']
+                self.yb.close()
+                self.yb = yum.YumBase()
+                self.root = tempfile.mkdtemp(prefix='repomaker-root-')
+                self.yb.preconf.root = self.root
+                self.yb.preconf.releasever = releasever
+
+    def _load(self):
+        self._setup()
+        # populate the sack now instead of lazily on first search
+        self.yb.pkgSack
+
+    def _revisions(self):
+        self._setup()
+        revisions = {}
+        for repo in self.yb.repos.listEnabled():
+            # fetches repomd.xml when the cached one expired
+            repo.repoXML
+            revisions[repo.id] = file_checksum(os.path.join(repo.cachedir, 'repomd.xml'))
+        return revisions
+
+    def _query(self, name):
+        return self.yb.pkgSack.searchNames([name])
+
+    def _resolve(self, pkg_objs):
+        # drop the previous transaction, keep the loaded sack
+        del self.yb.tsInfo
+        for pkg_obj in pkg_objs:
+            self.yb.install(pkg_obj)
+        code, errors = self.yb.resolveDeps()
+        if code == 1:
+            raise ValueError("; ".join(str(error) for error in errors))
+        return [txmbr.po for txmbr in self.yb.tsInfo.getMembers()]
+
+    def package_info(self, pkg_obj):
+        return {
+            'repoid': pkg_obj.repoid,
+            'size': pkg_obj.size,
+            'location': pkg_obj.relativepath,
+            'url': pkg_obj.remote_url,
+        }
+
+    def _close(self):
+        if self.yb is not None:
+            self.yb.close()
+            self.yb = None
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+
+class DnfResolveEngine(ResolveEngine):
+
+    def __init__(self, empty_root=False):
+        super(DnfResolveEngine, self).__init__(empty_root=empty_root)
+        self.base = None
+
+    def _setup(self):
+        if self.base is None:
+            import dnf
+
+            self.base = dnf.Base()
+            self.base.read_all_repos()
+
+    def _load(self):
+        self._setup()
+        self.base.fill_sack(load_system_repo=not self.empty_root)
+
+    def _revisions(self):
+        self._setup()
+        revisions = {}
+        for repo in self.base.repos.iter_enabled():
+            # fetches repomd.xml when the cached one expired
+            repo.load()
+            path = os.path.join(repo._repo.getCachedir(), 'repodata', 'repomd.xml')
+            revisions[repo.id] = file_checksum(path)
+        return revisions
+
+    def _query(self, name):
+        return self.base.sack.query().filter(name=name)
+
+    def _resolve(self, pkg_objs):
+        # drop the previous goal and transaction, keep the loaded sack
+        self.base.reset(goal=True)
+        import dnf.exceptions
+
+        for pkg_obj in pkg_objs:
+            self.base.package_install(pkg_obj)
+        try:
+            self.base.resolve()
+        except dnf.exceptions.Error as e:
+            raise ValueError(str(e))
+        return self.base.transaction.install_set
+
+    def package_info(self, pkg_obj):
+        return {
+            'repoid': pkg_obj.repoid,
+            'size': pkg_obj.downloadsize,
+            'location': pkg_obj.location,
+            'url': pkg_obj.remote_location(),
+        }
+
+    def _close(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+
+
+class OfflineResolveEngine(ResolveEngine):
+    """Resolve against repository metadata, without yum or dnf.
+
+    Repositories are given as {repo id: [base url, ...]}, the target
+    architecture defaults to the one of this host. Nothing is installed
+    on the target, so every closure is complete whatever empty_root says.
+    """
+
+    def __init__(self, empty_root=False, repos=None, arch=None, cachedir=None):
+        super(OfflineResolveEngine, self).__init__(empty_root=True)
+        self.arch = arch or platform.machine()
+        self.arches = compatible_arches(self.arch)
+        cachedir = cachedir or os.path.join(CACHE_DIR, 'repodata')
+        self.sources = [RepoSource(repoid, urls, cachedir) for repoid, urls in sorted((repos or {}).items())]
+        self.index = None
+        self.solver = None
+
+    def _load(self):
+        packages = []
+        for source in self.sources:
+            packages.extend(source.packages(self.arches))
+        self.index = PackageIndex(packages)
+        self.solver = Solver(self.index, self.arches)
+
+    def _revisions(self):
+        # the target architecture changes closures as much as the metadata
+        for source in self.sources:
+            source.expire()
+        return dict((source.repoid, [source.revision(), self.arch]) for source in self.sources)
+
+    def _query(self, name):
+        return self.index.by_name.get(name, [])
+
+    def _resolve(self, pkg_objs):
+        return self.solver.closure(pkg_objs)
+
+    def package_info(self, pkg_obj):
+        return {
+            'repoid': pkg_obj.repoid,
+            'size': pkg_obj.size,
+            'location': pkg_obj.location,
+            'url': pkg_obj.url,
+        }
+
+    def _close(self):
+        self.index = None
+        self.solver = None
@@ -0,0 +1,357 @@
+import os
+import time
+import threading
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit, urljoin
+    from urllib.request import url2pathname
+except ImportError:
+    import httplib
+    from urlparse import urlsplit, urljoin
+    from urllib import url2pathname
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .scheduler import DownloadScheduler
+from .. import fileops
+from ..config import ROOT_LOGGER
+from ..helper import new_hash, file_checksum
+from ..metrics import METRICS
+
+
+class FetchError(Exception):
+
+    def __init__(self, message, permanent=False):
+        super(FetchError, self).__init__(message)
+        # retrying does not help, e.g. 404
+        self.permanent = permanent
+
+
+class ConnectionPool(object):
+    """Keep-alive connections to one server, at most `size` kept idle."""
+
+    def __init__(self, scheme, netloc, size=8, timeout=60):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(size)
+
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            cls = httplib.HTTPSConnection if self.scheme == 'https' else httplib.HTTPConnection
+            return cls(self.netloc, timeout=self.timeout)
+
+    def put(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class HttpFetcher(object):
+    """Download packages straight from their repository urls.
+
+    Connections are pooled per server and reused across packages, partial
+    files are resumed with Range requests and checksums are computed while
+    the data streams in, so a package is read from the network exactly once.
+
+    Repositories with a MirrorPool spread packages over their mirrors, move
+    a stalled or failed transfer to the next mirror and fetch large packages
+    in segments from several mirrors at once.
+    """
+
+    JOBS = 8
+    RETRIES = 3
+    MAX_REDIRECTS = 5
+    CHUNK_SIZE = 256 * 1024
+    # packages of at least two segments are split over mirrors
+    SEGMENT_SIZE = 8 * 1024 * 1024
+    # a transfer slower than MIN_RATE bytes/s after STALL_GRACE seconds moves on
+    MIN_RATE = 32 * 1024
+    STALL_GRACE = 15
+
+    logger = ROOT_LOGGER.getChild("fetcher")
+
+    def __init__(self, jobs=None, retries=None, timeout=60, mirrors=None, stats=None):
+        self.jobs = jobs or self.JOBS
+        self.retries = self.RETRIES if retries is None else retries
+        self.timeout = timeout
+        # repo id -> MirrorPool
+        self.mirrors = mirrors or {}
+        self.stats = stats
+        self.downloaded = 0
+        self.resumed = 0
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme, netloc):
+        with self._lock:
+            key = (scheme, netloc)
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(scheme, netloc, size=self.jobs, timeout=self.timeout)
+            return self._pools[key]
+
+    def _request(self, url, headers):
+        """GET url following redirects, return (pool, connection, response)."""
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise FetchError("unsupported url: {}".format(url))
+            pool = self._pool(parts.scheme, parts.netloc)
+            path = parts.path + ('?' + parts.query if parts.query else '')
+            conn = pool.get()
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+            except (httplib.HTTPException, IOError, OSError):
+                # stale keep-alive connection, retry once on a fresh one
+                conn.close()
+                conn = pool.get()
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+            if resp.status in (301, 302, 303, 307, 308):
+                location = resp.getheader('Location')
+                resp.read()
+                pool.put(conn)
+                url = urljoin(url, location)
+                continue
+            return pool, conn, resp
+        raise FetchError("too many redirects: {}".format(url))
+
+    def _stalled(self, start, received):
+        elapsed = time.time() - start
+        return elapsed > self.STALL_GRACE and received / elapsed < self.MIN_RATE
+
+    def _copy_local(self, url, dest, checksum_type, checksum):
+        """Copy a file:// url to dest, a local repository or mirror."""
+        partpath = dest + '.part'
+        try:
+            fileops.copy_file(url2pathname(urlsplit(url).path), partpath)
+        except (IOError, OSError) as e:
+            raise FetchError("{} for {}".format(e, url), permanent=True)
+        if checksum and file_checksum(partpath, checksum_type or 'sha256') != checksum:
+            os.remove(partpath)
+            raise FetchError("checksum mismatch of {}".format(url), permanent=True)
+        with self._lock:
+            self.downloaded += os.path.getsize(partpath)
+        os.rename(partpath, dest)
+
+    def _fetch_once(self, url, dest, checksum_type, checksum, mirror=None, stall_check=False):
+        """Download url to dest, record throughput of mirror if given."""
+        if url.startswith('file://'):
+            return self._copy_local(url, dest, checksum_type, checksum)
+        partpath = dest + '.part'
+        h = new_hash(checksum_type or 'sha256')
+        offset = os.path.getsize(partpath) if os.path.isfile(partpath) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+
+        pool, conn, resp = self._request(url, headers)
+        try:
+            if resp.status == 206 and offset:
+                # hash what is already on disk, then append
+                with open(partpath, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                        h.update(chunk)
+                mode = 'ab'
+                with self._lock:
+                    self.resumed += 1
+            elif resp.status == 200:
+                mode = 'wb'
+            elif resp.status == 416:
+                # stale partial file, start over on the next attempt
+                os.remove(partpath)
+                raise FetchError("{} {} for {}".format(resp.status, resp.reason, url))
+            else:
+                permanent = 400 <= resp.status < 500 and resp.status not in (408, 429)
+                raise FetchError("{} {} for {}".format(resp.status, resp.reason, url), permanent=permanent)
+
+            start, received = time.time(), 0
+            with open(partpath, mode) as f:
+                for chunk in iter(lambda: resp.read(self.CHUNK_SIZE), b''):
+                    h.update(chunk)
+                    f.write(chunk)
+                    received += len(chunk)
+                    with self._lock:
+                        self.downloaded += len(chunk)
+                    if stall_check and self._stalled(start, received):
+                        # keep the partial file, the next mirror resumes it
+                        raise FetchError("transfer stalled at {} bytes/s".format(
+                            int(received / (time.time() - start))))
+        except Exception:
+            conn.close()
+            raise
+        pool.put(conn)
+        if mirror is not None and self.stats is not None:
+            self.stats.record_transfer(mirror, received, time.time() - start)
+
+        if checksum and h.hexdigest() != checksum:
+            os.remove(partpath)
+            raise FetchError("checksum mismatch of {}".format(url))
+        os.rename(partpath, dest)
+
+    def fetch(self, url, dest, checksum_type=None, checksum=None):
+        """Download url to dest, resuming a previous partial download."""
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                self._fetch_once(url, dest, checksum_type, checksum)
+                return
+            except (FetchError, httplib.HTTPException, IOError, OSError) as e:
+                error = e
+                self.logger.warning("fetch {} failed ({}/{}): {}".format(url, attempt + 1, self.retries + 1, e))
+                if getattr(e, 'permanent', False):
+                    break
+        raise FetchError(str(error))
+
+    def fetch_mirrored(self, pool, location, dest, size, checksum_type=None, checksum=None):
+        """Download location of a repository from the best mirror of pool,
+        moving to the next mirror on failure.
+        """
+        size = size or 0
+        if size >= 2 * self.SEGMENT_SIZE and len(pool.urls) > 1:
+            return self._fetch_segmented(pool, location, dest, size, checksum_type, checksum)
+        tried = set()
+        error = None
+        while True:
+            mirror = pool.pick(size, exclude=tried)
+            if mirror is None:
+                raise FetchError("all mirrors of {} failed, last error: {}".format(pool.repoid, error))
+            try:
+                # give up on a stalled transfer only while another mirror is left
+                self._fetch_once(urljoin(mirror, location), dest, checksum_type, checksum, mirror=mirror,
+                                 stall_check=len(pool.urls) - len(tried) > 1)
+                return
+            except (FetchError, httplib.HTTPException, IOError, OSError) as e:
+                error = e
+                tried.add(mirror)
+                if self.stats is not None:
+                    self.stats.record_failure(mirror)
+                self.logger.warning("fetch {} from {} failed: {}".format(location, mirror, e))
+            finally:
+                pool.release(mirror, size)
+
+    def _fetch_range(self, url, path, start, end, mirror, stall_check=False):
+        """Write bytes start..end of url into path at their offset."""
+        _, conn, resp = self._request(url, {'Range': 'bytes={}-{}'.format(start, end)})
+        begin = time.time()
+        try:
+            if resp.status != 206:
+                raise FetchError("{} {} for range of {}".format(resp.status, resp.reason, url))
+            received, length = 0, end - start + 1
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                while received < length:
+                    chunk = resp.read(min(self.CHUNK_SIZE, length - received))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+                    with self._lock:
+                        self.downloaded += len(chunk)
+                    if stall_check and self._stalled(begin, received):
+                        raise FetchError("segment stalled")
+            if received != length:
+                raise FetchError("short segment of {}".format(url))
+        finally:
+            conn.close()
+        if self.stats is not None:
+            self.stats.record_transfer(mirror, received, time.time() - begin)
+
+    def _fetch_segmented(self, pool, location, dest, size, checksum_type, checksum):
+        """Fetch segments of one large package from several mirrors at once,
+        a failed segment is retried on another mirror.
+        """
+        partpath = dest + '.seg'
+        with open(partpath, 'wb') as f:
+            f.truncate(size)
+        segments = queue.Queue()
+        for start in range(0, size, self.SEGMENT_SIZE):
+            segments.put((start, min(start + self.SEGMENT_SIZE, size) - 1, frozenset()))
+        errors = []
+
+        def work():
+            while not errors:
+                try:
+                    start, end, tried = segments.get_nowait()
+                except queue.Empty:
+                    return
+                length = end - start + 1
+                mirror = pool.pick(length, exclude=tried)
+                if mirror is None:
+                    errors.append("no mirror left for bytes {}-{} of {}".format(start, end, location))
+                    return
+                try:
+                    self._fetch_range(urljoin(mirror, location), partpath, start, end, mirror,
+                                      stall_check=len(pool.urls) - len(tried) > 1)
+                except (FetchError, httplib.HTTPException, IOError, OSError) as e:
+                    self.logger.warning("segment {}-{} of {} from {} failed: {}".format(
+                        start, end, location, mirror, e))
+                    if self.stats is not None:
+                        self.stats.record_failure(mirror)
+                    segments.put((start, end, tried | {mirror}))
+                finally:
+                    pool.release(mirror, length)
+
+        threads = [threading.Thread(target=work) for _ in range(min(len(pool.urls), segments.qsize()))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            while t.is_alive():
+                t.join(1)
+        if errors or not segments.empty():
+            os.remove(partpath)
+            raise FetchError(errors[0] if errors else "segments left of {}".format(location))
+        if checksum and file_checksum(partpath, checksum_type or 'sha256') != checksum:
+            os.remove(partpath)
+            raise FetchError("checksum mismatch of {}".format(location))
+        os.rename(partpath, dest)
+
+    def fetch_package(self, pkg, downloaddir):
+        dest = os.path.join(downloaddir, pkg.filename)
+        pool = self.mirrors.get(pkg.repoid)
+        if pool is None or not pkg.location:
+            self.fetch(pkg.url, dest, pkg.checksum_type, pkg.checksum)
+        else:
+            self.fetch_mirrored(pool, pkg.location, dest, pkg.size, pkg.checksum_type, pkg.checksum)
+
+    def fetch_all(self, pkg_list, downloaddir):
+        """Download packages with known urls into downloaddir.
+        Return a list of (package, reason) failures.
+        """
+        def work(slot, unit):
+            failures = []
+            for pkg in unit:
+                try:
+                    self.fetch_package(pkg, downloaddir)
+                except FetchError as e:
+                    failures.append((pkg, str(e)))
+                else:
+                    METRICS.progress(done=METRICS.count('packages_downloaded'), total=len(pkg_list))
+            return failures
+
+        # largest first keeps workers busy until the end
+        units = [[pkg] for pkg in sorted(pkg_list, key=lambda pkg: -(pkg.size or 0))]
+        try:
+            failures = DownloadScheduler(self.jobs).run(units, work)
+        finally:
+            for pool in self._pools.values():
+                pool.close()
+            if self.stats is not None:
+                self.stats.save()
+        self.logger.info("fetched {} packages, {} bytes, {} resumed".format(
+            len(pkg_list) - len(failures), self.downloaded, self.resumed))
+        return failures
@@ -1,63 +1,178 @@
+import multiprocessing
+import multiprocessing.util
+
+from .planner import split_conflicts
 from ..config import ROOT_LOGGER
+from ..helper import STRING_TYPES
+from ..metrics import METRICS
+from ..rpmheader import format_nevra
+
+# finder, loaded engine (None if not fork safe), transactions and empty_root
+# of a parallel resolution, inherited by forked workers
+_RESOLVE_STATE = {}
+
+
+def _init_resolve_worker():
+    finder, engine, transactions, empty_root = _RESOLVE_STATE['job']
+    if engine is None:
+        # the sack of the parent cannot cross fork, every worker loads its own
+        engine = finder._engine(empty_root=empty_root)
+        multiprocessing.util.Finalize(engine, engine.close, exitpriority=10)
+        _RESOLVE_STATE['job'] = (finder, engine, transactions, empty_root)
+
+
+def _resolve_transaction_worker(index):
+    finder, engine, transactions, _ = _RESOLVE_STATE['job']
+    sack_loads = engine.sack_loads
+    engine.resolve_times = []
+    closure = finder._resolve_transaction(engine, transactions[index])
+    return [spec.to_dict() for spec in sorted(closure)], engine.resolve_times, engine.sack_loads - sack_loads
+
 
+def _fork_pool(processes, initializer=None):
+    """Pool of forked workers, they share a loaded sack copy-on-write."""
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork').Pool(processes, initializer)
+    return multiprocessing.Pool(processes, initializer)
 
-def rpm_packages_handler_latest(rpm_pkg_list):
-    # TODO: better latest
-    return rpm_pkg_list[-1]
+
+class PackageSpec(object):
+    """Package specification handed from finder to exporter.
+
+    Formatted as `name` or, when pinned, `name-version-release.arch` of the
+    resolved build, the way package managers accept it. The resolved package
+    is described by nevra, filename and checksum when the finder knows them,
+    specs are equal when they name the same build.
+    """
+
+    def __init__(self, name, version=None, nevra=None, filename=None, checksum_type=None, checksum=None,
+                 repoid=None, size=None, location=None, url=None):
+        self.name = name
+        self.version = version
+        self.nevra = nevra
+        self.filename = filename
+        self.checksum_type = checksum_type
+        self.checksum = checksum
+        # origin of the artifact, recorded in lockfiles
+        self.repoid = repoid
+        self.size = size
+        self.location = location
+        self.url = url
+
+    @classmethod
+    def from_package(cls, pkg_obj, pinned=False, **info):
+        """Build a spec from a yum/dnf package object, info is passed on
+        from ResolveEngine.package_info.
+        """
+        checksum_type, checksum = pkg_obj.returnIdSum()
+        return cls(
+            pkg_obj.name,
+            version=pkg_obj.version if pinned else None,
+            nevra=format_nevra(pkg_obj.name, pkg_obj.epoch, pkg_obj.version, pkg_obj.release, pkg_obj.arch),
+            filename="{}-{}-{}.{}.rpm".format(pkg_obj.name, pkg_obj.version, pkg_obj.release, pkg_obj.arch),
+            checksum_type=checksum_type,
+            checksum=checksum,
+            **info
+        )
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'nevra': self.nevra,
+            'filename': self.filename,
+            'checksum_type': self.checksum_type,
+            'checksum': self.checksum,
+            'repoid': self.repoid,
+            'size': self.size,
+            'location': self.location,
+            'url': self.url,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    @property
+    def nvra(self):
+        """`name-version-release.arch` of the resolved package, None if unknown."""
+        if self.filename and self.filename.endswith('.rpm'):
+            return self.filename[:-len('.rpm')]
+        return None
+
+    @property
+    def spec(self):
+        if self.version:
+            # the resolved build, not the newest release of the version
+            return self.nvra or "{}-{}".format(self.name, self.version)
+        return self.name
+
+    def _key(self):
+        return (self.nevra or self.spec, self.spec)
+
+    def __str__(self):
+        return self.spec
+
+    def __repr__(self):
+        return repr(self.spec)
+
+    def __eq__(self, other):
+        return isinstance(other, PackageSpec) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self._key() < other._key()
+
+    def __hash__(self):
+        return hash(self._key())
 
 
 class PackageFinderV2(object):
     SPECIAL_VERSION_META = "@"
     SPECIAL_VERSION_TAG_LATEST = "{}latest".format(SPECIAL_VERSION_META)
-    SPECIAL_VERSION_HANDLERS = {
-        SPECIAL_VERSION_TAG_LATEST: rpm_packages_handler_latest,
-    }
+    # dependency resolution engine, see engine.py
+    ENGINE = None
+    # EnginePool keeping engines loaded between commands, set by the serve daemon
+    ENGINE_POOL = None
+    # whether resolved specs carry the checksums a lockfile needs
+    LOCKABLE = True
 
     logger = ROOT_LOGGER.getChild("finder")
 
     @classmethod
-    def _select_packages(cls, pkg_item, rpm_pkg_list):
-        """Select multiple rpm packages by versions."""
+    def _select_packages(cls, pkg_item, index):
+        """Select multiple rpm packages by versions from a VersionIndex,
+        of the item's `arch` only when it has one.
+        """
         # merge version & versions
         ver = pkg_item.get('version', cls.SPECIAL_VERSION_TAG_LATEST)
         if not pkg_item.get('versions'):
             pkg_item['versions'] = [ver]
         cls.logger.debug("request package item is: {}".format(pkg_item))
-
-        # generate rpm package map
-        rpm_pkg_map = {}
-        for pkg in rpm_pkg_list:
-            rpm_pkg_map[pkg.version] = pkg
+        arch = pkg_item.get('arch')
 
         # select version
         selected_pkgs = []
         for version in pkg_item['versions']:
-            if version in cls.SPECIAL_VERSION_HANDLERS:
-                res = cls.SPECIAL_VERSION_HANDLERS[version](rpm_pkg_list)
-                if res is None:
-                    cls.logger.warning("package {}'s special version tag {} does not select any item!".format(
-                        pkg_item['name'], version))
-                elif isinstance(res, list):
-                    selected_pkgs.extend(res)
-                else:
-                    selected_pkgs.append(res)
-                continue
-            if version in rpm_pkg_map:
-                selected_pkgs.append(rpm_pkg_map[version])
-                continue
-            raise ValueError("unknown version of package {}: {}".format(pkg_item['name'], version))
+            pkg = index.select(version, arch=arch)
+            if pkg is None:
+                raise ValueError("unknown version of package {}: {}{}".format(
+                    pkg_item['name'], version, " ({})".format(arch) if arch else ""))
+            selected_pkgs.append(pkg)
 
         if not selected_pkgs:
             raise ValueError("package {} does not select any item!".format(pkg_item['name']))
         cls.logger.info("selected {} packages are {}".format(
-            pkg_item['name'], [pkg.version for pkg in selected_pkgs]))
+            pkg_item['name'], ["{}-{}.{}".format(pkg.version, pkg.release, pkg.arch) for pkg in selected_pkgs]))
         return selected_pkgs
 
     @classmethod
     def _parse_pkg_list(cls, pkg_list):
         pkg_item_list = []
         for pkg in pkg_list:
-            if isinstance(pkg, (str, unicode)):
+            if isinstance(pkg, STRING_TYPES):
                 pkg_item_list.append({'name': pkg})
             elif isinstance(pkg, dict):
                 pkg_item_list.append(pkg)
@@ -73,11 +188,179 @@ class PackageFinderV2(object):
         raise NotImplementedError
 
     @classmethod
-    def get_rpm_dependency(cls, pkg_list):
-        """Get latest full dependency package list from yum by a package list."""
-        pkg_item_list = cls._parse_pkg_list(pkg_list)
-        cls._ensure_repo_source()
-        return cls._get_rpm_dependency_version(pkg_item_list)
+    def _engine(cls, empty_root=False):
+        return cls.ENGINE(empty_root=empty_root)
+
+    @classmethod
+    def _engine_key(cls, empty_root=False):
+        """Key of the engine in the engine pool, what makes engines differ."""
+        return (cls.__name__, empty_root)
+
+    @classmethod
+    def _open_engine(cls, empty_root=False):
+        pool = PackageFinderV2.ENGINE_POOL
+        if pool is None:
+            return cls._engine(empty_root=empty_root)
+        return pool.get(cls._engine_key(empty_root), lambda: cls._engine(empty_root=empty_root))
+
+    @classmethod
+    def _get_pkg_deps(cls, engine, pkg_objs):
+        """Closure of packages installed in one transaction, the packages
+        themselves pinned to their versions.
+        """
+        names = set(pkg.name for pkg in pkg_objs)
+        # complete closures are downloaded as they are, keep every version apart
+        deps = {
+            PackageSpec.from_package(pkg, pinned=engine.empty_root, **engine.package_info(pkg))
+            for pkg in engine.resolve(pkg_objs) if pkg.name not in names
+        }
+        deps.update(PackageSpec.from_package(pkg, pinned=True, **engine.package_info(pkg)) for pkg in pkg_objs)
+        return deps
+
+    @classmethod
+    def _item_key(cls, pkg_item):
+        """Item spec as used in the resolve cache key, name plus versions."""
+        item = dict(pkg_item)
+        item['versions'] = pkg_item.get('versions') or [pkg_item.get('version', cls.SPECIAL_VERSION_TAG_LATEST)]
+        item.pop('version', None)
+        return item
+
+    @classmethod
+    def _plan_transactions(cls, pkg_item_list):
+        """Split the requested versions into the fewest solver transactions.
+
+        Every version of an item becomes an item of its own, versions of one
+        name are mutually exclusive, so they go to different transactions.
+        Everything else is resolved together in the first one.
+        """
+        entries = []
+        for pkg_item in pkg_item_list:
+            item = cls._item_key(pkg_item)
+            entries.extend(dict(item, versions=[version]) for version in item['versions'])
+        return split_conflicts(entries, lambda item: item['name'])
+
+    @classmethod
+    def _resolve_transaction(cls, engine, pkg_item_list):
+        """Return the closure of the versions selected by the items, installed together."""
+        selected = []
+        for pkg_item in pkg_item_list:
+            index = engine.version_index(pkg_item['name'])
+            if len(index) <= 0:
+                raise ValueError("package not found", pkg_item)
+            # select packages
+            selected.extend(cls._select_packages(pkg_item, index))
+
+        # a special version handler may select several versions of a name
+        closure = set()
+        for pkgs in split_conflicts(selected, lambda pkg: pkg.name):
+            closure.update(cls._resolve_together(engine, pkgs))
+        return closure
+
+    @classmethod
+    def _resolve_together(cls, engine, pkg_objs):
+        """Closure of packages installed in one transaction. Packages of
+        different names may still conflict, then both halves are resolved
+        apart, down to a single package whose failure is raised.
+        """
+        try:
+            return cls._get_pkg_deps(engine, pkg_objs)
+        except ValueError as e:
+            if len(pkg_objs) == 1:
+                raise
+            cls.logger.warning("{} packages cannot be installed together, splitting: {}".format(len(pkg_objs), e))
+        half = len(pkg_objs) // 2
+        return cls._resolve_together(engine, pkg_objs[:half]) | cls._resolve_together(engine, pkg_objs[half:])
+
+    @classmethod
+    def _resolve_transactions(cls, engine, transactions, jobs=None):
+        """Resolve transactions in their order, return their closures as spec lists.
+        With jobs > 1 transactions are resolved by forked workers, sharing the
+        sack loaded once in this process, or loading their own when the
+        engine is not fork safe. Closures do not depend on which process
+        resolved them, so the result is the same as resolving one after another.
+        """
+        jobs = min(jobs or 1, len(transactions))
+        if jobs <= 1:
+            return [sorted(cls._resolve_transaction(engine, items)) for items in transactions]
+
+        shared = engine if engine.FORK_SAFE else None
+        if shared is not None:
+            shared.load()
+        cls.logger.info("resolving {} transactions with {} processes ...".format(len(transactions), jobs))
+        _RESOLVE_STATE['job'] = (cls, shared, transactions, engine.empty_root)
+        pool = _fork_pool(jobs, _init_resolve_worker)
+        try:
+            results = pool.map(_resolve_transaction_worker, range(len(transactions)), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            _RESOLVE_STATE.pop('job', None)
+        closures = []
+        for specs, resolve_times, sack_loads in results:
+            engine.resolve_times.extend(resolve_times)
+            engine.sack_loads += sack_loads
+            closures.append([PackageSpec.from_dict(data) for data in specs])
+        return closures
+
+    @classmethod
+    def _get_rpm_dependency_version(cls, pkg_item_list, resolve_cache=None, empty_root=False, jobs=None):
+        """Get latest full dependency package list by a package item list.
+        Support multiple versions of same package.
+        Items are planned into the fewest transactions, see _plan_transactions,
+        all resolved against one sack loaded by the engine. The sack is not
+        loaded at all when every transaction is found in the resolve cache.
+        Missing transactions are resolved by up to `jobs` processes.
+        """
+        dep_pkgs = set()
+        finder_key = "{}{}".format(cls.__name__, "/empty-root" if empty_root else "")
+        transactions = cls._plan_transactions(pkg_item_list)
+        cls.logger.info("planned {} items into {} transactions".format(len(pkg_item_list), len(transactions)))
+        with cls._open_engine(empty_root=empty_root) as engine:
+            revisions = engine.revisions() if resolve_cache is not None else None
+            todo = []
+            keys = []
+            for items in transactions:
+                key = None
+                if resolve_cache is not None:
+                    key = resolve_cache.make_key(finder_key, items, revisions)
+                    cached = resolve_cache.get(key)
+                    if cached is not None:
+                        METRICS.count('resolve_cache_hits')
+                        dep_pkgs.update(PackageSpec.from_dict(data) for data in cached)
+                        continue
+                    METRICS.count('resolve_cache_misses')
+                todo.append(items)
+                keys.append(key)
+
+            for key, closure in zip(keys, cls._resolve_transactions(engine, todo, jobs=jobs)):
+                dep_pkgs.update(closure)
+                if key is not None:
+                    resolve_cache.put(key, [spec.to_dict() for spec in closure])
+            engine.report()
+            METRICS.count('sack_loads', engine.sack_loads)
+            METRICS.count('transactions', len(transactions))
+        if resolve_cache is not None:
+            resolve_cache.report()
+
+        results = list(dep_pkgs)
+        results.sort()
+        return results
+
+    @classmethod
+    def get_rpm_dependency(cls, pkg_list, resolve_cache=None, empty_root=False, jobs=None):
+        """Get latest full dependency package list from yum by a package list.
+        With empty_root the list is the complete closure, ignoring packages
+        installed on this host, as needed for lockfiles. jobs is the number
+        of resolving processes, one by default.
+        """
+        with METRICS.phase('resolve'):
+            pkg_item_list = cls._parse_pkg_list(pkg_list)
+            cls._ensure_repo_source()
+            results = cls._get_rpm_dependency_version(pkg_item_list, resolve_cache=resolve_cache,
+                                                      empty_root=empty_root, jobs=jobs)
+            METRICS.count('packages_requested', len(pkg_item_list))
+            METRICS.count('packages_resolved', len(results))
+        return results
 
 
 class PackageFinderV3(PackageFinderV2):
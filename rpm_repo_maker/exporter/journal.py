@@ -0,0 +1,55 @@
+import os
+import json
+import threading
+
+
+class RunJournal(object):
+    """Append-only record of finished phases of a generate run.
+
+    Every line is one JSON event: `resolve` carries the package list,
+    `download` one verified package file, the other phases (`downloaded`,
+    `createrepo`, `archive`) just mark completion. Events are flushed and
+    synced one by one, so a killed run loses at most the event in progress.
+    """
+
+    FILE = 'journal.jsonl'
+
+    def __init__(self, root):
+        self.path = os.path.join(root, self.FILE)
+        self.events = []
+        self._lock = threading.Lock()
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self.events.append(json.loads(line))
+                    except ValueError:
+                        # torn last line of a killed run
+                        break
+
+    def mark(self, phase, **data):
+        data['phase'] = phase
+        line = json.dumps(data, sort_keys=True)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.events.append(data)
+
+    def done(self, phase):
+        return any(event['phase'] == phase for event in self.events)
+
+    def get(self, phase):
+        """Last event of a phase, None if not reached."""
+        for event in reversed(self.events):
+            if event['phase'] == phase:
+                return event
+        return None
+
+    def downloads(self):
+        """File name -> (size, sha256) of verified downloads."""
+        return dict(
+            (event['file'], (event['size'], event['sha256']))
+            for event in self.events if event['phase'] == 'download'
+        )
@@ -0,0 +1,41 @@
+import json
+
+from .finder import PackageSpec
+
+
+class Lockfile(object):
+    """Exact, resolved package closure of a configuration.
+
+    Every package carries its full NEVRA, repo id, checksum, size and
+    location, so `generate --lock` can fetch exactly these artifacts
+    without resolving again.
+    """
+
+    VERSION = 1
+
+    def __init__(self, manager, packages):
+        self.manager = manager
+        self.packages = packages
+
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'manager': self.manager,
+            'packages': [pkg.to_dict() for pkg in sorted(self.packages, key=lambda pkg: pkg.nevra)],
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != cls.VERSION:
+            raise ValueError("unsupported lockfile version: {}".format(data.get('version')))
+        packages = [PackageSpec.from_dict(item) for item in data['packages']]
+        for pkg in packages:
+            if not pkg.nevra or not pkg.checksum:
+                raise ValueError("lockfile entry without nevra or checksum: {}".format(pkg))
+        return cls(data['manager'], packages)
@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import errno
+import tempfile
+import threading
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+from ..config import ROOT_LOGGER
+
+logger = ROOT_LOGGER.getChild("mirrors")
+
+
+def normalize_baseurl(url):
+    return url if url.endswith('/') else url + '/'
+
+
+class MirrorStats(object):
+    """Per mirror latency and throughput, kept between runs.
+
+    Values are exponential moving averages, so a mirror that got slow is
+    demoted after a few downloads.
+    """
+
+    ALPHA = 0.3
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.mirrors = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.mirrors = json.load(f)
+            except ValueError:
+                logger.warning("broken mirror stats, starting over: {}".format(path))
+
+    def _average(self, url, key, value):
+        with self._lock:
+            entry = self.mirrors.setdefault(url, {})
+            old = entry.get(key)
+            entry[key] = value if old is None else old + self.ALPHA * (value - old)
+            entry['updated'] = time.time()
+
+    def get(self, url, key, default=None):
+        return self.mirrors.get(url, {}).get(key, default)
+
+    def record_latency(self, url, seconds):
+        self._average(url, 'latency', seconds)
+
+    def record_transfer(self, url, nbytes, seconds):
+        if nbytes > 0 and seconds > 0:
+            self._average(url, 'throughput', nbytes / seconds)
+
+    def record_failure(self, url):
+        with self._lock:
+            entry = self.mirrors.setdefault(url, {})
+            entry['failures'] = entry.get('failures', 0) + 1
+
+    def save(self):
+        if not self.path:
+            return
+        root = os.path.dirname(self.path)
+        if not os.path.isdir(root):
+            try:
+                os.makedirs(root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=root, prefix='.mirrors-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.mirrors, f, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+
+
+class MirrorPool(object):
+    """Base urls of one repository.
+
+    Packages go to the mirror expected to finish them first, from its
+    throughput and the bytes already assigned to it, so fast mirrors take
+    more packages and slow ones still take a share.
+    """
+
+    # assumed throughput of mirrors never measured, bytes per second
+    DEFAULT_THROUGHPUT = 1024.0 * 1024
+
+    def __init__(self, repoid, urls, stats):
+        self.repoid = repoid
+        self.urls = []
+        for url in urls:
+            url = normalize_baseurl(url)
+            if url not in self.urls:
+                self.urls.append(url)
+        self.stats = stats
+        self._inflight = dict((url, 0) for url in self.urls)
+        self._lock = threading.Lock()
+
+    def _cost(self, url, size):
+        throughput = self.stats.get(url, 'throughput', self.DEFAULT_THROUGHPUT)
+        latency = self.stats.get(url, 'latency', 0)
+        return latency + (self._inflight[url] + size) / throughput
+
+    def ranked(self):
+        return sorted(self.urls, key=lambda url: self._cost(url, 0))
+
+    def pick(self, size, exclude=()):
+        """Reserve the best mirror for size bytes, None if all are excluded."""
+        with self._lock:
+            candidates = [url for url in self.urls if url not in exclude]
+            if not candidates:
+                return None
+            url = min(candidates, key=lambda url: self._cost(url, size))
+            self._inflight[url] += size
+            return url
+
+    def release(self, url, size):
+        with self._lock:
+            self._inflight[url] -= size
+
+
+def read_mirrorlist(url, timeout=30):
+    """Base urls of a yum mirrorlist or a metalink."""
+    data = urlopen(url, timeout=timeout).read().decode('utf-8', 'replace')
+    if '<metalink' in data:
+        urls = re.findall(r'<url[^>]*>\s*(https?://[^<\s]+)\s*</url>', data)
+        return [re.sub(r'repodata/repomd\.xml$', '', u) for u in urls]
+    return [line.strip() for line in data.splitlines()
+            if line.strip().startswith(('http://', 'https://'))]
+
+
+def probe(urls, stats, timeout=10):
+    """Measure latency of mirrors by fetching their repomd.xml concurrently.
+    Unreachable mirrors are recorded as failures. Return reachable urls.
+    """
+    reachable = []
+
+    def run(url):
+        start = time.time()
+        try:
+            resp = urlopen(normalize_baseurl(url) + 'repodata/repomd.xml', timeout=timeout)
+            first = time.time()
+            data = resp.read()
+        except Exception as e:
+            logger.warning("mirror {} unreachable: {}".format(url, e))
+            stats.record_failure(normalize_baseurl(url))
+            return
+        end = time.time()
+        stats.record_latency(normalize_baseurl(url), first - start)
+        stats.record_transfer(normalize_baseurl(url), len(data), end - start)
+        reachable.append(url)
+
+    threads = [threading.Thread(target=run, args=(url,)) for url in urls]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        while t.is_alive():
+            t.join(1)
+    return [url for url in urls if url in reachable]
+
+
+def build_pools(pkg_list, stats, mirrors=None, mirrorlists=None, probe_mirrors=True):
+    """Mirror pools by repo id from the package urls and extra mirrors.
+
+    `mirrors` and `mirrorlists` map a repo id to base urls and mirrorlist
+    urls. Repositories with a single mirror get no pool.
+    """
+    urls = {}
+    for pkg in pkg_list:
+        if pkg.repoid and pkg.url and pkg.location and pkg.url.endswith(pkg.location):
+            base = pkg.url[:-len(pkg.location)]
+            urls.setdefault(pkg.repoid, [])
+            if base not in urls[pkg.repoid]:
+                urls[pkg.repoid].append(base)
+    for repoid, extra in (mirrors or {}).items():
+        urls.setdefault(repoid, []).extend(extra)
+    for repoid, lists in (mirrorlists or {}).items():
+        for url in lists:
+            try:
+                urls.setdefault(repoid, []).extend(read_mirrorlist(url))
+            except Exception as e:
+                logger.warning("mirrorlist {} unreadable: {}".format(url, e))
+
+    pools = {}
+    for repoid, repo_urls in urls.items():
+        pool = MirrorPool(repoid, repo_urls, stats)
+        if len(pool.urls) < 2:
+            continue
+        if probe_mirrors:
+            # drop mirrors that failed the probe
+            pool = MirrorPool(repoid, probe(pool.urls, stats) or pool.urls, stats)
+        pools[repoid] = pool
+        logger.info("repo {} mirrors: {}".format(repoid, ", ".join(pools[repoid].ranked())))
+    return pools
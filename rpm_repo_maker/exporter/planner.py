@@ -0,0 +1,42 @@
+def split_conflicts(items, key):
+    """Split items into the fewest groups in which no key occurs twice.
+
+    Items sharing a key (e.g. several versions of one package) cannot be
+    installed in one transaction, the first group is always the largest.
+    """
+    groups = []
+    for item in items:
+        k = key(item)
+        for keys, group in groups:
+            if k not in keys:
+                keys.add(k)
+                group.append(item)
+                break
+        else:
+            groups.append(({k}, [item]))
+    return [group for _, group in groups]
+
+
+def chunked(items, size):
+    """Split items into chunks of at most size items."""
+    if size <= 0:
+        return [[item] for item in items]
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def plan_downloads(pkg_list, batch_size):
+    """Plan package manager invocations for a package list.
+
+    Non-conflicting packages are batched into chunks of batch_size, every
+    conflicting package gets an invocation of its own.
+    """
+    if batch_size <= 0:
+        return [[pkg] for pkg in pkg_list]
+
+    groups = split_conflicts(pkg_list, lambda pkg: pkg.name)
+    if not groups:
+        return []
+    units = chunked(groups[0], batch_size)
+    for group in groups[1:]:
+        units.extend([pkg] for pkg in group)
+    return units
@@ -1,7 +1,8 @@
 from .finder import PackageFinderV3
 from .pm_dnf import DnfPackageFinder
 
-from ..helper import run
+from .. import fileops
+from ..runner import check_command
 
 
 class DnfKylinPackageFinder(DnfPackageFinder):
@@ -10,7 +11,7 @@ class DnfKylinPackageFinder(DnfPackageFinder):
     @classmethod
     def _ensure_repo_source(cls):
         # ensure docker-runc is removed because of we want to install containerd.io instead
-        run("dnf remove -y docker-runc podman")
+        check_command("dnf remove -y docker-runc podman")
 
         cls.logger.info("Adding Kylin online repositories ...")
         repo_str = """[kcnos]
@@ -26,55 +27,8 @@ gpgcheck=0
 """
         # ensure repo
         if not cls._is_repo_enabled("kcnos"):
-            run("mv /etc/yum.repos.d /etc/yum.repos.d.bak")
-            run("mkdir -p /etc/yum.repos.d")
+            fileops.move('/etc/yum.repos.d', '/etc/yum.repos.d.bak')
+            fileops.makedirs('/etc/yum.repos.d')
             with open('/etc/yum.repos.d/kcnos.repo', 'w') as f:
                 f.write(repo_str)
-            run("dnf makecache")
-
-    @classmethod
-    def _get_pkg_deps(cls, pkg_obj):
-        import dnf
-
-        with dnf.Base() as db:
-            db.read_all_repos()
-            db.fill_sack()
-
-            db.package_install(pkg_obj)
-            db.resolve()
-            # import ipdb; ipdb.set_trace()
-            deps = {pkg.name for pkg in db.transaction.install_set}
-            if pkg_obj.name in deps:
-                deps.remove(pkg_obj.name)
-            deps.add("{}-{}".format(pkg_obj.name, pkg_obj.version))
-        return deps
-
-    @classmethod
-    def _get_rpm_dependency_version(cls, pkg_item_list):
-        """Get latest full dependency package list from yum by a package item list.
-        Support multiple versions of same package.
-        """
-        import dnf
-
-        dep_pkgs = set()
-        with dnf.Base() as db:
-            db.read_all_repos()
-            db.fill_sack()
-            # import ipdb; ipdb.set_trace()
-
-            # package item
-            for pkg_item in pkg_item_list:
-                q = db.sack.query().filter(name=pkg_item['name'])
-                avai_pkg_list = list(q)
-                if len(avai_pkg_list) <= 0:
-                    raise ValueError("package not found", pkg_item)
-
-                # select packages
-                pkgs = cls._select_packages(pkg_item, avai_pkg_list)
-                for pkg in pkgs:
-                    deps = cls._get_pkg_deps(pkg)
-                    dep_pkgs.update(deps)
-
-        results = list(dep_pkgs)
-        results.sort()
-        return results
+            check_command("dnf makecache")
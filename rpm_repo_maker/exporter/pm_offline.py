@@ -0,0 +1,52 @@
+from .base import RPMRepoExporter
+from .engine import OfflineResolveEngine
+from .finder import PackageFinderV2
+
+
+class OfflinePackageFinder(PackageFinderV2):
+    """Resolve against repositories given on the command line.
+
+    No package manager and no machine of the target distribution is
+    needed, repository metadata is read straight from the repositories,
+    see OfflineResolveEngine. Call configure() before resolving.
+    """
+
+    ENGINE = OfflineResolveEngine
+    # repo id -> [base url, ...]
+    REPOS = {}
+    # target architecture, None is the one of this host
+    ARCH = None
+
+    logger = PackageFinderV2.logger.getChild("offline")
+
+    @classmethod
+    def configure(cls, repos, arch=None):
+        cls.REPOS = repos
+        cls.ARCH = arch
+
+    @classmethod
+    def _engine(cls, empty_root=False):
+        return cls.ENGINE(empty_root=empty_root, repos=cls.REPOS, arch=cls.ARCH)
+
+    @classmethod
+    def _engine_key(cls, empty_root=False):
+        repos = tuple((repoid, tuple(urls)) for repoid, urls in sorted(cls.REPOS.items()))
+        return (cls.__name__, repos, cls.ARCH)
+
+    @classmethod
+    def _ensure_repo_source(cls):
+        if not cls.REPOS:
+            raise ValueError("offline resolution needs repositories, see --repo")
+
+
+class OfflineRepoExporter(RPMRepoExporter):
+    """Export closures of the offline finder.
+
+    Packages carry their repository urls, they are fetched as they are
+    by the native downloader, no package manager is involved.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs['exact'] = True
+        kwargs['downloader'] = 'native'
+        super(OfflineRepoExporter, self).__init__(*args, **kwargs)
@@ -1,13 +1,78 @@
 import os
-import shutil
-import tempfile
+from xml.etree import ElementTree
 
-from .finder import PackageFinderV2
-from ..config import ROOT_LOGGER
-from ..helper import run, lcd, cmd_exists
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from .base import RPMRepoExporter
+from .cache import RootTemplate
+from .finder import PackageFinderV2, PackageSpec
+from .. import fileops
+from ..helper import file_checksum
+from ..metrics import METRICS
+from ..repodata import split_evr
+from ..rpmheader import format_nevra
+from ..runner import check_command, run_command
+
+# zypper exit codes above 100 are informational, except this one
+ZYPPER_EXIT_INF_CAP_NOT_FOUND = 104
+
+
+class ZypperSolution(object):
+    """Target of a streaming XML parser over `zypper --xmlout install` output.
+
+    Collects the packages of the install summary and the error messages.
+    The raw output is fed while zypper prints it, so a large closure is
+    never held as text.
+    """
+
+    # summary sections whose packages have to be downloaded
+    SECTIONS = ('to-install', 'to-upgrade', 'to-downgrade', 'to-reinstall')
+
+    def __init__(self):
+        self.solvables = []
+        self.errors = []
+        self._section = None
+        self._message = None
+
+    def start(self, tag, attrib):
+        if tag in self.SECTIONS:
+            self._section = tag
+        elif tag == 'solvable' and self._section is not None and attrib.get('type', 'package') == 'package':
+            self.solvables.append(dict(attrib))
+        elif tag == 'message' and attrib.get('type') == 'error':
+            self._message = []
+
+    def end(self, tag):
+        if tag == self._section:
+            self._section = None
+        elif tag == 'message' and self._message is not None:
+            self.errors.append("".join(self._message).strip())
+            self._message = None
+
+    def data(self, data):
+        if self._message is not None:
+            self._message.append(data)
+
+    def close(self):
+        return self
 
 
 class ZypperNIRPackageFinder(PackageFinderV2):
+    """Resolve all items in one zypper solver pass.
+
+    Repositories are refreshed once, then a single `install --dry-run`
+    with every requested item yields the exact closure. Items asking for
+    several versions of a package take one more pass per extra version,
+    as zypper installs only one version of a name at a time, see
+    _plan_transactions.
+    """
+
+    # the install summary has no checksums, sizes or urls
+    LOCKABLE = False
+
     logger = PackageFinderV2.logger.getChild("zypper")
 
     @classmethod
@@ -15,121 +80,201 @@ class ZypperNIRPackageFinder(PackageFinderV2):
         """Install repository related tools, add extra online yum repository."""
         cls.logger.info("Extra zypper repository should be add manually ...")
 
-        run("zypper install -y createrepo")
+        check_command("zypper install -y createrepo")
+
+    @classmethod
+    def _zypper(cls, args):
+        return "zypper --non-interactive {}".format(args)
+
+    @classmethod
+    def _revisions(cls):
+        """Return {repo alias: repomd.xml sha256} of the refreshed repositories."""
+        raw = os.path.join('/', 'var', 'cache', 'zypp', 'raw')
+        revisions = {}
+        if os.path.isdir(raw):
+            for alias in sorted(os.listdir(raw)):
+                path = os.path.join(raw, alias, 'repodata', 'repomd.xml')
+                if os.path.isfile(path):
+                    revisions[alias] = file_checksum(path)
+        return revisions
+
+    @classmethod
+    def _item_specs(cls, pkg_item):
+        """zypper capabilities of the versions requested by an item."""
+        versions = pkg_item.get('versions') or [pkg_item.get('version', cls.SPECIAL_VERSION_TAG_LATEST)]
+        name = pkg_item['name']
+        if pkg_item.get('arch'):
+            name = "{}.{}".format(name, pkg_item['arch'])
+        specs = []
+        for version in versions:
+            if version == cls.SPECIAL_VERSION_TAG_LATEST:
+                specs.append(name)
+            elif version.startswith(cls.SPECIAL_VERSION_META) or version.startswith('~=') or ',' in version:
+                raise ValueError("version selector of package {} not supported by zypper: {}".format(
+                    pkg_item['name'], version))
+            elif version[:1] in ('<', '>', '='):
+                # zypper takes single ranges as capabilities, e.g. docker>=20.10
+                specs.append("{}{}".format(name, version.replace('==', '=')))
+            else:
+                specs.append("{}={}".format(name, version))
+        return specs
+
+    @classmethod
+    def _solve(cls, specs):
+        """Run one solver pass, return the solvables to download."""
+        solution = ZypperSolution()
+        parser = ElementTree.XMLParser(target=solution)
+        cmd = cls._zypper("--xmlout --no-refresh install --dry-run --auto-agree-with-licenses {}".format(
+            " ".join(quote(spec) for spec in specs)))
+        result = run_command(cmd, on_stdout_bytes=parser.feed)
+        try:
+            parser.close()
+        except ElementTree.ParseError as e:
+            if result.ok:
+                raise ValueError("unreadable zypper output: {}".format(e))
+        if not result.ok and (result.returncode < 100 or result.returncode == ZYPPER_EXIT_INF_CAP_NOT_FOUND):
+            raise ValueError("zypper could not resolve {}: {}".format(
+                " ".join(specs), "; ".join(solution.errors) or result.reason))
+        return solution.solvables
 
     @classmethod
-    def _get_rpm_dependency_version(cls, pkg_item_list):
-        """Get latest full dependency package list from yum by a package item list.
+    def _get_rpm_dependency_version(cls, pkg_item_list, resolve_cache=None, empty_root=False, jobs=None):
+        """Get full dependency package list from zypper by a package item list.
         Support multiple versions of same package.
+        The whole request is one resolve cache entry, keyed by the items and
+        the repomd checksums of the refreshed repositories. jobs is ignored,
+        all items are resolved in one pass anyway. empty_root is ignored as
+        well, zypper cannot resolve lockfiles, see LOCKABLE.
         """
-        results = []
-        # package item
-        for pkg_item in pkg_item_list:
-            results.append(pkg_item['name'])
+        check_command(cls._zypper("refresh"))
+
+        key = None
+        if resolve_cache is not None:
+            items = [cls._item_key(pkg_item) for pkg_item in pkg_item_list]
+            key = resolve_cache.make_key(cls.__name__, items, cls._revisions())
+            cached = resolve_cache.get(key)
+            if cached is not None:
+                METRICS.count('resolve_cache_hits')
+                resolve_cache.report()
+                return sorted(PackageSpec.from_dict(data) for data in cached)
+            METRICS.count('resolve_cache_misses')
+
+        # one pass per transaction, versions of a name need one each
+        transactions = cls._plan_transactions(pkg_item_list)
+        requested = set(pkg_item['name'] for pkg_item in pkg_item_list)
+        dep_pkgs = set()
+        for items in transactions:
+            specs = [spec for item in items for spec in cls._item_specs(item)]
+            solvables = cls._solve(specs)
+            cls.logger.info("resolved {} items in one pass, {} packages".format(len(specs), len(solvables)))
+            for solvable in solvables:
+                name, arch = solvable['name'], solvable.get('arch', 'noarch')
+                epoch, version, release = split_evr(solvable['edition'])
+                pinned = name in requested
+                dep_pkgs.add(PackageSpec(
+                    name,
+                    version=version if pinned else None,
+                    nevra=format_nevra(name, epoch, version, release, arch),
+                    filename="{}-{}-{}.{}.rpm".format(name, version, release, arch),
+                    repoid=solvable.get('repository'),
+                ))
+        METRICS.count('sack_loads', len(transactions))
+        METRICS.count('transactions', len(transactions))
+        if key is not None:
+            resolve_cache.put(key, [spec.to_dict() for spec in sorted(dep_pkgs)])
+            resolve_cache.report()
 
+        results = list(dep_pkgs)
         results.sort()
         return results
 
 
-
-class ZypperNIRRepoExporter:
+class ZypperNIRRepoExporter(RPMRepoExporter):
     """Zypper repo exporter when --installroot option is not available.
+
+    # fake a install root
+    mkdir -p /opt/rootfs/etc
+    mkdir -p /opt/rootfs/var/lib/rpm
+    cp -a /etc/zypp /opt/rootfs/etc/
+    cp -a /var/lib/rpm /opt/rootfs/var/lib/
+
+    # chroot
+    zypper -R /opt/rootfs --no-cd --gpg-auto-import-keys install --auto-agree-with-licenses -y -d docker
+
+    # create repo
+    zypper install createrepo
+    createrepo --database /tmp/$PKG
+    rm -rf /tmp/$PKG-installroot
     """
 
-    TEMP_DIR_PREFIX = 'repomaker'
-
-    logger = ROOT_LOGGER.getChild('exporter')
-
-    def __init__(self, name, path=None, platform_suffix=None):
-        self.name = name
-        self.path = os.path.abspath(path)
-        self.platform_suffix = platform_suffix
-        self.tempdir = tempfile.mkdtemp(prefix="{}-".format(self.TEMP_DIR_PREFIX))
-
-    def prepare(self):
-        # check
-        if not os.path.exists(self.path):
-            raise ValueError("path not exist: {}".format(self.path))
-        if not os.path.isdir(self.path):
-            raise ValueError("path is not a valid directory: {}".format(self.path))
-        if self.path is None:
-            self.path = os.path.abspath(os.getcwd())
-        cmds = ['tar']
-        for cmd in cmds:
-            if not cmd_exists(cmd):
-                raise ValueError("command not found: {}".format(cmd))
-
-    def make(self, pkg_list):
-        """
-        # fake a install root
-        mkdir -p /opt/rootfs/etc
-        mkdir -p /opt/rootfs/var/lib/rpm
-        cp -a /etc/zypp /opt/rootfs/etc/
-        cp -a /var/lib/rpm /opt/rootfs/var/lib/
-
-        # chroot
-        zypper -R /opt/rootfs --no-cd --gpg-auto-import-keys install --auto-agree-with-licenses -y -d docker
-
-        # create repo
-        zypper install createrepo
-        createrepo --database /tmp/$PKG
-        rm -rf /tmp/$PKG-installroot
-        """
+    # host directories making up the fake root file system
+    ROOT_SOURCES = (
+        ('etc/zypp', '/etc/zypp'),
+        ('var/lib/rpm', '/var/lib/rpm'),
+    )
+    # zypper only reads its configuration, clones may hard link it
+    ROOT_SHARED = ('etc/zypp',)
+    METADATA_CACHEDIR = 'var/cache/zypp'
+    # refreshed by the finder, seeds the shared metadata so refreshing it is cheap
+    HOST_CACHEDIR = '/var/cache/zypp'
+
+    def __init__(self, *args, **kwargs):
+        super(ZypperNIRRepoExporter, self).__init__(*args, **kwargs)
+        self.template = None
+        if self.root_cache is not None:
+            self.template = RootTemplate(os.path.join(self.root_cache, 'zypper'), self.ROOT_SOURCES,
+                                         shared=self.ROOT_SHARED)
+
+    def fake_root(self, installroot):
         # fake a rootfs
         self.logger.info("Faking root file system ...")
-        installroot = os.path.join(self.tempdir, 'installroot')
-        etc_path = os.path.join(installroot, 'etc')
-        rpm_lib_path = os.path.join(installroot, 'var', 'lib', 'rpm')
-        run("mkdir -p {}".format(etc_path))
-        run("mkdir -p {}".format(rpm_lib_path))
-        run("cp -a /etc/zypp {}".format(etc_path))
-        run("cp -a /var/lib/rpm {}".format(etc_path))
-
-        # download
-        for pkg in pkg_list:
-            self.logger.info("Downloading package {} ...".format(pkg))
-            run("zypper -R {} --no-cd --gpg-auto-import-keys install --auto-agree-with-licenses -y -d {}".format(
-                installroot, pkg))
-
-        # collect downloaded
+        if self.template is not None:
+            self.template.clone(installroot)
+            return
+        for path, source in self.ROOT_SOURCES:
+            fileops.copy_tree(os.path.realpath(source), os.path.join(installroot, path))
+
+    def prepare_installroot(self, installroot):
+        self.fake_root(installroot)
+        super(ZypperNIRRepoExporter, self).prepare_installroot(installroot)
+
+    def refresh_metadata(self, installroot):
+        # zypper reads its repositories from the root
+        self.fake_root(installroot)
+        for sub in ('raw', 'solv'):
+            source = os.path.join(self.HOST_CACHEDIR, sub)
+            if os.path.isdir(source):
+                fileops.copy_tree(source, os.path.join(installroot, self.METADATA_CACHEDIR, sub))
+        super(ZypperNIRRepoExporter, self).refresh_metadata(installroot)
+
+    def makecache_cmd(self, installroot):
+        return "zypper -R {} --non-interactive refresh".format(installroot)
+
+    @staticmethod
+    def capability(pkg):
+        """zypper capability of a spec, `name.arch=version-release` when pinned."""
+        if not pkg.version:
+            return pkg.name
+        if pkg.nvra is None:
+            return "{}={}".format(pkg.name, pkg.version)
+        version_release, arch = pkg.nvra[len(pkg.name) + 1:].rsplit('.', 1)
+        return "{}.{}={}".format(pkg.name, arch, version_release)
+
+    def download_cmd(self, installroot, downloaddir, pkgs):
+        # metadata comes linked from the shared cache, never refresh it again
+        specs = [self.capability(pkg) for pkg in pkgs]
+        return ("zypper -R {} --no-refresh --no-cd --gpg-auto-import-keys install --auto-agree-with-licenses "
+                "-y -d {}").format(installroot, " ".join(specs))
+
+    def collect(self, installroot, workdir, downloaddir):
+        # collect downloaded, zypper keeps them in <repo>/<arch>/ of its cache
         cachedir = os.path.join(installroot, 'var', 'cache', 'zypp', 'packages')
-        downloaddir = os.path.join(self.tempdir, self.name)
-        run("mkdir -p {}".format(downloaddir))
-        run("cp -a {}/*/* {}".format(cachedir, downloaddir))
-
-        # createrepo
-        self.logger.info("Creating repository ...")
-        run("createrepo --database {}".format(downloaddir))
-
-        # archive it
-        self.logger.info("Making archive ...")
-        with lcd(self.tempdir):
-            run("tar -zcf {name}.tar.gz {name}".format(name=self.name))
-        tarfile = "{}.tar.gz".format(self.name)
-        tarpath = os.path.join(self.tempdir, "{}".format(tarfile))
-
-        # generate target tar file
-        target_tarfile = "{}.tar.gz".format(self.name)
-        if self.platform_suffix:
-            target_tarfile = "{}.{}.tar.gz".format(self.name, self.platform_suffix)
-        target_tarpath = os.path.join(self.path, target_tarfile)
-
-        # delete old and move new
-        if os.path.isfile(target_tarpath):
-            os.remove(target_tarpath)
-        shutil.move(tarpath, target_tarpath)
-
-    def cleanup(self):
-        shutil.rmtree(self.tempdir, ignore_errors=True)
-
-    def __call__(self, pkg_list):
-        self.prepare()
-
-        self.logger.info("Exporter's temp directory is {}".format(self.tempdir))
-        try:
-            self.make(pkg_list)
-        except Exception as e:
-            self.cleanup()
-            raise e
-        else:
-            self.cleanup()
+        if not os.path.isdir(cachedir):
+            return
+        fileops.makedirs(downloaddir)
+        for path in fileops.walk_files(cachedir):
+            if path.endswith('.rpm'):
+                target = os.path.join(downloaddir, os.path.basename(path))
+                if os.path.lexists(target):
+                    os.remove(target)
+                fileops.link_or_copy(path, target)
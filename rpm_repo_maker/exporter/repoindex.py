@@ -0,0 +1,387 @@
+# coding: utf-8
+
+import os
+import bz2
+import gzip
+import pickle
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+from xml.etree import ElementTree
+
+try:
+    from urllib.request import urlopen, pathname2url, url2pathname
+    from urllib.parse import urlsplit, urljoin
+except ImportError:
+    from urllib import pathname2url, url2pathname
+    from urllib2 import urlopen
+    from urlparse import urlsplit, urljoin
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .. import fileops
+from ..config import ROOT_LOGGER
+from ..helper import file_checksum
+from ..metrics import METRICS
+from ..repodata import NS_COMMON, NS_REPO, NS_RPM
+from ..rpmver import evr_key, ranges_overlap
+
+logger = ROOT_LOGGER.getChild("repoindex")
+
+# installable architectures of a target, best first
+ARCH_COMPAT = {
+    'x86_64': ('x86_64', 'noarch'),
+    'i686': ('i686', 'i586', 'i486', 'i386', 'noarch'),
+    'aarch64': ('aarch64', 'noarch'),
+    'ppc64le': ('ppc64le', 'noarch'),
+    's390x': ('s390x', 'noarch'),
+    'loongarch64': ('loongarch64', 'noarch'),
+    'riscv64': ('riscv64', 'noarch'),
+}
+
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+_COMMON = '{%s}' % NS_COMMON
+_RPM = '{%s}' % NS_RPM
+_REPO = '{%s}' % NS_REPO
+_XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
+
+
+def compatible_arches(arch):
+    return ARCH_COMPAT.get(arch, (arch, 'noarch'))
+
+
+class Package(object):
+    """Package of repository metadata, in the shape the finders expect
+    from yum and dnf package objects.
+
+    Dependencies are tuples of (name, flags, (epoch, version, release)),
+    the evr is None for unversioned entries.
+    """
+
+    __slots__ = ('name', 'epoch', 'version', 'release', 'arch', 'checksum_type', 'checksum', 'size',
+                 'location', 'baseurl', 'repoid', 'provides', 'requires', 'obsoletes', 'files')
+
+    def __init__(self, name, epoch, version, release, arch, checksum_type, checksum, size, location, baseurl,
+                 repoid, provides=(), requires=(), obsoletes=(), files=()):
+        self.name = name
+        self.epoch = epoch or '0'
+        self.version = version
+        self.release = release
+        self.arch = arch
+        self.checksum_type = checksum_type
+        self.checksum = checksum
+        self.size = size
+        self.location = location
+        self.baseurl = baseurl
+        self.repoid = repoid
+        self.provides = provides
+        self.requires = requires
+        self.obsoletes = obsoletes
+        self.files = files
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    @property
+    def evr(self):
+        return self.epoch, self.version, self.release
+
+    @property
+    def url(self):
+        return urljoin(self.baseurl, self.location)
+
+    def returnIdSum(self):
+        return self.checksum_type, self.checksum
+
+    def __repr__(self):
+        return "<{}-{}:{}-{}.{}>".format(self.name, self.epoch, self.version, self.release, self.arch)
+
+
+class _Interner(object):
+    """Share equal strings and dependency tuples between packages."""
+
+    def __init__(self):
+        self._values = {}
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        return self._values.setdefault(value, value)
+
+    def dep(self, name, flags, epoch, version, release):
+        if not flags:
+            return self((self(name), None, None))
+        return self((self(name), self(flags), self((self(epoch), self(version), self(release)))))
+
+
+class RepoSource(object):
+    """Metadata of one repository, read from a local directory or an
+    http(s) or file url.
+
+    repomd.xml is read on every run, the primary metadata only when its
+    checksum changed. Parsed packages are kept as a pickle next to the
+    downloaded metadata, so a repository is parsed once per revision.
+    Primary sqlite databases are preferred over xml, reading rows is
+    cheaper than parsing xml.
+    """
+
+    TIMEOUT = 60
+
+    def __init__(self, repoid, urls, cachedir):
+        self.repoid = repoid
+        self.urls = [self._baseurl(url) for url in urls]
+        self.baseurl = self.urls[0]
+        self.cachedir = os.path.join(cachedir, hashlib.sha256(self.baseurl.encode('utf-8')).hexdigest()[:16])
+        self._repomd = None
+
+    @staticmethod
+    def _baseurl(url):
+        if not urlsplit(url).scheme:
+            url = 'file://' + pathname2url(os.path.abspath(url))
+        return url if url.endswith('/') else url + '/'
+
+    def _open(self, baseurl, href):
+        url = urljoin(baseurl, href)
+        parts = urlsplit(url)
+        if parts.scheme == 'file':
+            return open(url2pathname(parts.path), 'rb')
+        return urlopen(url, timeout=self.TIMEOUT)
+
+    def _read(self, href):
+        """Read a repository file from the first url that has it."""
+        error = None
+        for baseurl in self.urls:
+            try:
+                f = self._open(baseurl, href)
+                try:
+                    data = f.read()
+                finally:
+                    f.close()
+                if baseurl != self.baseurl:
+                    logger.info("{} read from {}".format(href, baseurl))
+                return data
+            except (IOError, OSError) as e:
+                error = e
+                logger.warning("reading {} from {} failed: {}".format(href, baseurl, e))
+        raise ValueError("repository {} unreachable: {}".format(self.repoid, error))
+
+    def repomd(self):
+        if self._repomd is None:
+            self._repomd = self._read('repodata/repomd.xml')
+        return self._repomd
+
+    def expire(self):
+        """Read repomd.xml again next time."""
+        self._repomd = None
+
+    def revision(self):
+        return hashlib.sha256(self.repomd()).hexdigest()
+
+    def _records(self):
+        """Return {type: (href, checksum type, checksum)} of repomd.xml."""
+        records = {}
+        root = ElementTree.fromstring(self.repomd())
+        for data in root.findall(_REPO + 'data'):
+            location = data.find(_REPO + 'location')
+            checksum = data.find(_REPO + 'checksum')
+            if location is None or checksum is None:
+                continue
+            records[data.get('type')] = (location.get('href'), checksum.get('type'), checksum.text.strip())
+        return records
+
+    def _fetch(self, href, checksum_type, checksum):
+        """Path of a local copy of a repository file, verified by checksum."""
+        path = os.path.join(self.cachedir, "{}-{}".format(checksum[:16], os.path.basename(href)))
+        if os.path.isfile(path):
+            return path
+        fileops.makedirs(self.cachedir)
+        fd, tmp = tempfile.mkstemp(dir=self.cachedir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self._read(href))
+        if file_checksum(tmp, checksum_type) != checksum:
+            os.remove(tmp)
+            raise ValueError("checksum mismatch of {} in repository {}".format(href, self.repoid))
+        os.rename(tmp, path)
+        METRICS.count('metadata_files_fetched')
+        return path
+
+    @staticmethod
+    def _decompressed(path):
+        """File object of the uncompressed content of a metadata file."""
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rb')
+        if path.endswith('.bz2'):
+            return bz2.BZ2File(path, 'rb')
+        if path.endswith('.xz'):
+            if lzma is None:
+                raise ValueError("xz compressed metadata needs the lzma module: {}".format(path))
+            return lzma.open(path, 'rb')
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise ValueError("zstd compressed metadata needs the zstandard module: {}".format(path))
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        return open(path, 'rb')
+
+    def packages(self, arches):
+        """Packages of the given architectures."""
+        records = self._records()
+        kind = 'primary_db' if 'primary_db' in records else 'primary'
+        if kind not in records:
+            raise ValueError("repository {} has no primary metadata".format(self.repoid))
+        href, checksum_type, checksum = records[kind]
+        index_path = os.path.join(self.cachedir, "{}-{}.pickle".format(
+            checksum[:16], hashlib.sha256(" ".join(arches).encode('utf-8')).hexdigest()[:8]))
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, 'rb') as f:
+                    packages = pickle.load(f)
+            except Exception as e:
+                logger.warning("broken package index, parsing again: {}".format(e))
+            else:
+                return packages
+
+        path = self._fetch(href, checksum_type, checksum)
+        if kind == 'primary_db':
+            packages = self._read_sqlite(path, arches)
+        else:
+            with self._decompressed(path) as f:
+                packages = self._read_xml(f, arches)
+        logger.info("repository {}: {} packages".format(self.repoid, len(packages)))
+        fd, tmp = tempfile.mkstemp(dir=self.cachedir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(packages, f, 2)
+        os.rename(tmp, index_path)
+        return packages
+
+    def _read_xml(self, f, arches):
+        intern = _Interner()
+        packages = []
+        context = iter(ElementTree.iterparse(f, events=('start', 'end')))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag != _COMMON + 'package':
+                continue
+            arch = elem.findtext(_COMMON + 'arch')
+            if arch in arches:
+                packages.append(self._xml_package(elem, arch, intern))
+            # drop parsed packages, memory stays flat on large repositories
+            root.clear()
+        return packages
+
+    def _xml_package(self, elem, arch, intern):
+        version = elem.find(_COMMON + 'version')
+        checksum = elem.find(_COMMON + 'checksum')
+        location = elem.find(_COMMON + 'location')
+        size = elem.find(_COMMON + 'size')
+        fmt = elem.find(_COMMON + 'format')
+        deps = {}
+        for kind in ('provides', 'requires', 'obsoletes'):
+            entries = fmt.find(_RPM + kind) if fmt is not None else None
+            deps[kind] = tuple(
+                intern.dep(e.get('name'), e.get('flags'), e.get('epoch'), e.get('ver'), e.get('rel'))
+                for e in (entries if entries is not None else ()))
+        files = tuple(intern(f.text) for f in fmt.findall(_COMMON + 'file')) if fmt is not None else ()
+        return Package(
+            intern(elem.findtext(_COMMON + 'name')), intern(version.get('epoch')), intern(version.get('ver')),
+            intern(version.get('rel')), intern(arch), intern(checksum.get('type')), checksum.text,
+            int(size.get('package')) if size is not None else None, location.get('href'),
+            location.get(_XML_BASE) or self.baseurl, self.repoid, files=files, **deps)
+
+    def _read_sqlite(self, path, arches):
+        intern = _Interner()
+        db_path = path
+        if path.endswith(COMPRESSED_SUFFIXES):
+            db_path = os.path.splitext(path)[0]
+            if not os.path.isfile(db_path):
+                fd, tmp = tempfile.mkstemp(dir=self.cachedir, prefix='.tmp-')
+                with os.fdopen(fd, 'wb') as out:
+                    with self._decompressed(path) as f:
+                        shutil.copyfileobj(f, out, 1024 * 1024)
+                os.rename(tmp, db_path)
+
+        conn = sqlite3.connect(db_path)
+        try:
+            rows = {}
+            marks = ",".join("?" * len(arches))
+            for row in conn.execute(
+                    "SELECT pkgKey, name, epoch, version, release, arch, checksum_type, pkgId, size_package,"
+                    " location_href, location_base FROM packages WHERE arch IN ({})".format(marks), tuple(arches)):
+                rows[row[0]] = row
+            deps = dict((key, {'provides': [], 'requires': [], 'obsoletes': [], 'files': []}) for key in rows)
+            for kind in ('provides', 'requires', 'obsoletes'):
+                for key, name, flags, epoch, version, release in conn.execute(
+                        "SELECT pkgKey, name, flags, epoch, version, release FROM {}".format(kind)):
+                    if key in deps:
+                        deps[key][kind].append(intern.dep(name, flags, epoch, version, release))
+            for key, name in conn.execute("SELECT pkgKey, name FROM files"):
+                if key in deps:
+                    deps[key]['files'].append(intern(name))
+        finally:
+            conn.close()
+
+        packages = []
+        for key, name, epoch, version, release, arch, checksum_type, checksum, size, href, base in rows.values():
+            pkg_deps = deps[key]
+            packages.append(Package(
+                intern(name), intern(epoch), intern(version), intern(release), intern(arch), intern(checksum_type),
+                checksum, size, href, base or self.baseurl, self.repoid,
+                provides=tuple(pkg_deps['provides']), requires=tuple(pkg_deps['requires']),
+                obsoletes=tuple(pkg_deps['obsoletes']), files=tuple(pkg_deps['files'])))
+        return packages
+
+
+class PackageIndex(object):
+    """Provides, file provides and obsoletes of a set of packages.
+
+    Names map to lists of (package, flags, evr), so a requirement is
+    answered with one dict lookup plus a range check per candidate.
+    """
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.by_name = {}
+        self.provides = {}
+        self.files = {}
+        for pkg in packages:
+            self.by_name.setdefault(pkg.name, []).append(pkg)
+            self_provided = False
+            for name, flags, evr in pkg.provides:
+                self.provides.setdefault(name, []).append((pkg, flags, evr))
+                self_provided = self_provided or name == pkg.name
+            if not self_provided:
+                self.provides.setdefault(pkg.name, []).append((pkg, 'EQ', pkg.evr))
+            for path in pkg.files:
+                self.files.setdefault(path, []).append(pkg)
+        for pkgs in self.by_name.values():
+            pkgs.sort(key=lambda pkg: evr_key(pkg.evr))
+
+        # packages replaced by another package of the set
+        self.obsoleted = set()
+        for pkg in packages:
+            for name, flags, evr in pkg.obsoletes:
+                for other in self.by_name.get(name, ()):
+                    if other.name != pkg.name and ranges_overlap('EQ', other.evr, flags, evr):
+                        self.obsoleted.add(other)
+        logger.info("indexed {} packages, {} provides, {} files".format(
+            len(packages), len(self.provides), len(self.files)))
+
+    def whatprovides(self, name, flags=None, evr=None):
+        """Packages providing a capability or file."""
+        result = [pkg for pkg, pflags, pevr in self.provides.get(name, ()) if ranges_overlap(pflags, pevr, flags, evr)]
+        if name.startswith('/'):
+            result.extend(pkg for pkg in self.files.get(name, ()) if pkg not in result)
+        return result
@@ -0,0 +1,75 @@
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ..config import ROOT_LOGGER
+
+
+class DownloadError(Exception):
+    """Some packages could not be downloaded."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(DownloadError, self).__init__("{} package(s) failed to download: {}".format(
+            len(failures), ", ".join(str(item) for item, _ in failures)))
+
+
+class DownloadScheduler(object):
+    """Run download units on a bounded pool of workers.
+
+    Every worker owns a slot number for its whole life, so it can keep a
+    private install root and cache. Failures are collected per package
+    instead of stopping the other workers. A unit is more than one command,
+    it clones the root, runs the package manager and collects the packages,
+    so workers are threads of their own rather than runner.run_commands,
+    which suits independent commands.
+    """
+
+    logger = ROOT_LOGGER.getChild("scheduler")
+
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs)
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def slots(self, units):
+        """Number of workers needed for units."""
+        return min(self.jobs, len(units))
+
+    def _work(self, slot, units, func):
+        while True:
+            try:
+                unit = units.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                failures = func(slot, unit)
+            except Exception as e:
+                self.logger.exception("worker {} crashed".format(slot))
+                failures = [(item, str(e)) for item in unit]
+            if failures:
+                with self._lock:
+                    self.failures.extend(failures)
+
+    def run(self, units, func):
+        """Call func(slot, unit) for every unit, func returns a list of
+        (item, reason) failures. Return all failures.
+        """
+        pending = queue.Queue()
+        for unit in units:
+            pending.put(unit)
+
+        threads = []
+        for slot in range(self.slots(units)):
+            t = threading.Thread(target=self._work, args=(slot, pending, func))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            # join with timeout keeps the main thread interruptible on python2
+            while t.is_alive():
+                t.join(1)
+        return self.failures
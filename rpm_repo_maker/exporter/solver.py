@@ -0,0 +1,204 @@
+# coding: utf-8
+
+import re
+
+from ..config import ROOT_LOGGER
+from ..rpmver import evr_key
+from ..repodata import split_evr
+
+logger = ROOT_LOGGER.getChild("solver")
+
+# operators of rich (boolean) dependencies
+RICH_OPERATORS = ('and', 'or', 'if', 'else', 'unless', 'with', 'without')
+
+_RICH_TOKEN_RE = re.compile(r'\(|\)|[^\s()]+')
+_COMPARISONS = {'<': 'LT', '<=': 'LE', '=': 'EQ', '==': 'EQ', '>=': 'GE', '>': 'GT'}
+
+
+def parse_rich(text):
+    """Parse a rich dependency like "(a >= 1.0 or (b if c))" into
+    ('op', [operands]) and ('dep', (name, flags, evr)) tuples.
+    """
+    tokens = _RICH_TOKEN_RE.findall(text)
+    pos = [0]
+
+    def take():
+        token = tokens[pos[0]]
+        pos[0] += 1
+        return token
+
+    def operand():
+        if tokens[pos[0]] == '(':
+            return expression()
+        name = take()
+        if pos[0] < len(tokens) and tokens[pos[0]] in _COMPARISONS:
+            flags = _COMPARISONS[take()]
+            return ('dep', (name, flags, split_evr(take())))
+        return ('dep', (name, None, None))
+
+    def expression():
+        if take() != '(':
+            raise ValueError("rich dependency must start with '(': {}".format(text))
+        operands = [operand()]
+        op = None
+        while tokens[pos[0]] != ')':
+            token = take()
+            if token not in RICH_OPERATORS:
+                raise ValueError("unknown operator {} in {}".format(token, text))
+            if op is None or (op == 'if' and token == 'else') or (op == 'unless' and token == 'else'):
+                op = op or token
+            elif token != op:
+                raise ValueError("mixed operators in {}".format(text))
+            operands.append(operand())
+        take()
+        if op is None:
+            return operands[0]
+        return (op, operands)
+
+    try:
+        return expression()
+    except IndexError:
+        raise ValueError("unbalanced rich dependency: {}".format(text))
+
+
+class Solver(object):
+    """Install closures over a PackageIndex for an empty target root.
+
+    Every requirement is satisfied by a package already in the closure
+    or else by the best provider: not obsoleted, named like the
+    requirement, newest version, best architecture, shortest name.
+    Requirements nobody provides raise ValueError. Weak dependencies and
+    conflicts are not considered, file requirements are answered from
+    the file lists of primary metadata only.
+    """
+
+    def __init__(self, index, arches):
+        self.index = index
+        # architecture preference, best first
+        self.arch_rank = dict((arch, i) for i, arch in enumerate(arches))
+
+    def _preference(self, pkg, name):
+        return (pkg in self.index.obsoleted, pkg.name != name, len(pkg.name), pkg.name)
+
+    def _installed_provider(self, installed, candidates):
+        for pkg in candidates:
+            if installed.get(pkg.name) is pkg:
+                return pkg
+        return None
+
+    def _best(self, installed, name, candidates):
+        """Best provider to add, None if every candidate clashes with an
+        installed package of the same name.
+        """
+        newest = {}
+        for pkg in candidates:
+            if pkg.name in installed:
+                continue
+            best = newest.get(pkg.name)
+            if best is None or (evr_key(pkg.evr), -self.arch_rank.get(pkg.arch, 99)) > \
+                    (evr_key(best.evr), -self.arch_rank.get(best.arch, 99)):
+                newest[pkg.name] = pkg
+        if not newest:
+            return None
+        return min(newest.values(), key=lambda pkg: self._preference(pkg, name))
+
+    def _satisfy(self, installed, dep):
+        """Return a package to add for a simple dependency, None if an
+        installed package satisfies it. Raise ValueError if unsatisfiable.
+        """
+        name, flags, evr = dep
+        candidates = self.index.whatprovides(name, flags, evr)
+        if self._installed_provider(installed, candidates) is not None:
+            return None
+        pkg = self._best(installed, name, candidates)
+        if pkg is None:
+            raise ValueError("nothing provides {}".format(self._format(dep)))
+        return pkg
+
+    def _holds(self, installed, expr):
+        """Whether a rich dependency is already true for the closure."""
+        op, args = expr
+        if op == 'dep':
+            name, flags, evr = args
+            return self._installed_provider(installed, self.index.whatprovides(name, flags, evr)) is not None
+        if op == 'or':
+            return any(self._holds(installed, arg) for arg in args)
+        if op in ('and', 'with'):
+            return all(self._holds(installed, arg) for arg in args)
+        if op == 'without':
+            return self._holds(installed, args[0])
+        condition = self._holds(installed, args[1])
+        if op == 'unless':
+            condition = not condition
+        if condition:
+            return self._holds(installed, args[0])
+        return self._holds(installed, args[2]) if len(args) > 2 else True
+
+    def _satisfy_rich(self, installed, expr):
+        """Return packages to add for a rich dependency."""
+        op, args = expr
+        if op == 'dep':
+            pkg = self._satisfy(installed, args)
+            return [pkg] if pkg is not None else []
+        if op in ('and', 'with'):
+            pkgs = []
+            for arg in args:
+                pkgs.extend(self._satisfy_rich(installed, arg))
+            return pkgs
+        if op == 'without':
+            return self._satisfy_rich(installed, args[0])
+        if op == 'or':
+            if any(self._holds(installed, arg) for arg in args):
+                return []
+            error = None
+            for arg in args:
+                try:
+                    return self._satisfy_rich(installed, arg)
+                except ValueError as e:
+                    error = e
+            raise error
+        # (a if b else c) and (a unless b else c), decided by the closure so far
+        condition = self._holds(installed, args[1])
+        if op == 'unless':
+            condition = not condition
+        if condition:
+            return self._satisfy_rich(installed, args[0])
+        if len(args) > 2:
+            return self._satisfy_rich(installed, args[2])
+        return []
+
+    @staticmethod
+    def _format(dep):
+        name, flags, evr = dep
+        if not flags:
+            return name
+        epoch, version, release = evr
+        return "{} {} {}{}{}".format(name, flags, "{}:".format(epoch) if epoch and epoch != '0' else '',
+                                     version, "-{}".format(release) if release else '')
+
+    def closure(self, pkgs):
+        """Packages needed to install pkgs into an empty root."""
+        installed = {}
+        todo = []
+        for pkg in pkgs:
+            installed[pkg.name] = pkg
+            todo.append(pkg)
+        while todo:
+            pkg = todo.pop()
+            for dep in pkg.requires:
+                name = dep[0]
+                if name.startswith('rpmlib('):
+                    continue
+                try:
+                    if name.startswith('('):
+                        added = self._satisfy_rich(installed, parse_rich(name))
+                    else:
+                        added = self._satisfy(installed, dep)
+                        added = [added] if added is not None else []
+                except ValueError as e:
+                    raise ValueError("{}, needed by {}".format(e, pkg))
+                for new in added:
+                    if new.name not in installed:
+                        installed[new.name] = new
+                        todo.append(new)
+        return sorted(installed.values(), key=lambda pkg: pkg.name)
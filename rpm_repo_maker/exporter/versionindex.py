@@ -0,0 +1,118 @@
+# coding: utf-8
+
+import re
+import bisect
+
+from ..repodata import split_evr
+from ..rpmver import evr_key
+
+_LATEST_RE = re.compile(r'^@latest(?:-(\d+))?$')
+_RANGE_RE = re.compile(r'^\s*(>=|<=|==|~=|>|<|=)\s*(\S+)\s*$')
+
+
+def package_evr(pkg):
+    return pkg.epoch, pkg.version, pkg.release
+
+
+class VersionIndex(object):
+    """Packages of one name sorted by EVR with rpm version comparison.
+
+    Sorted once, selections are then bisect lookups. Among packages of an
+    equal EVR the best architecture of `arches` sorts last, so the last
+    package of a range is what a package manager would pick. Selectors are
+
+        @latest, @latest-N    newest EVR, N EVRs before the newest
+        >=V, >V, <=V, <V, =V  newest in the range, joined by "," e.g. ">=19,<20"
+        ~=V                   newest compatible release, ~=19.03 is >=19.03,<20
+        V                     newest of version V, or of [epoch:]version-release
+
+    A missing epoch is 0 and a missing release matches every release.
+    """
+
+    def __init__(self, packages, arches=()):
+        rank = dict((arch, i) for i, arch in enumerate(arches))
+        worst = len(rank)
+        self.packages = sorted(packages, key=lambda pkg: (evr_key(package_evr(pkg)),
+                                                          -rank.get(pkg.arch, worst)))
+        self.keys = [evr_key(package_evr(pkg)) for pkg in self.packages]
+        # [start, end) offsets of every distinct EVR, oldest first
+        self.groups = []
+        for i, key in enumerate(self.keys):
+            if self.groups and not (self.keys[self.groups[-1][0]] < key):
+                self.groups[-1][1] = i + 1
+            else:
+                self.groups.append([i, i + 1])
+        self.by_version = {}
+        for i, pkg in enumerate(self.packages):
+            self.by_version.setdefault(pkg.version, []).append(i)
+
+    def __len__(self):
+        return len(self.packages)
+
+    def _newest(self, lo, hi, arch=None):
+        """Last package in [lo, hi) of the architecture, None if there is none."""
+        for i in range(hi - 1, lo - 1, -1):
+            if arch is None or self.packages[i].arch == arch:
+                return self.packages[i]
+        return None
+
+    def _latest(self, back, arch=None):
+        for lo, hi in reversed(self.groups):
+            pkg = self._newest(lo, hi, arch)
+            if pkg is None:
+                continue
+            if back == 0:
+                return pkg
+            back -= 1
+        return None
+
+    @staticmethod
+    def _upper_compatible(epoch, version):
+        """Exclusive upper bound of ~=version, the next release series."""
+        parts = version.split('.')
+        if len(parts) < 2 or not parts[-2].isdigit():
+            raise ValueError("~= needs a version like 1.2 or 1.2.3: {}".format(version))
+        parts = parts[:-2] + [str(int(parts[-2]) + 1)]
+        return evr_key((epoch, '.'.join(parts), None))
+
+    def _range(self, selector):
+        lo, hi = 0, len(self.keys)
+        for part in selector.split(','):
+            match = _RANGE_RE.match(part)
+            if match is None:
+                raise ValueError("unknown version selector: {}".format(selector))
+            op, text = match.groups()
+            epoch, version, release = split_evr(text)
+            key = evr_key((epoch, version, release))
+            if op in ('>=', '~='):
+                lo = max(lo, bisect.bisect_left(self.keys, key))
+            elif op == '>':
+                lo = max(lo, bisect.bisect_right(self.keys, key))
+            elif op == '<=':
+                hi = min(hi, bisect.bisect_right(self.keys, key))
+            elif op == '<':
+                hi = min(hi, bisect.bisect_left(self.keys, key))
+            else:
+                lo = max(lo, bisect.bisect_left(self.keys, key))
+                hi = min(hi, bisect.bisect_right(self.keys, key))
+            if op == '~=':
+                hi = min(hi, bisect.bisect_left(self.keys, self._upper_compatible(epoch, version)))
+        return lo, hi
+
+    def _exact(self, text, arch=None):
+        if ':' in text or '-' in text:
+            return self._newest(*self._range('=' + text), arch=arch)
+        # a bare version matches whatever the epoch
+        for i in reversed(self.by_version.get(text, [])):
+            if arch is None or self.packages[i].arch == arch:
+                return self.packages[i]
+        return None
+
+    def select(self, selector, arch=None):
+        """Package picked by a selector, None if nothing matches."""
+        match = _LATEST_RE.match(selector)
+        if match is not None:
+            return self._latest(int(match.group(1) or 0), arch)
+        if selector and selector[0] in '<>=~':
+            return self._newest(*self._range(selector), arch=arch)
+        return self._exact(selector, arch)
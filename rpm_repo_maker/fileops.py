@@ -0,0 +1,177 @@
+# coding: utf-8
+
+import os
+import stat
+import errno
+import fcntl
+import shutil
+
+from .config import ROOT_LOGGER
+from .metrics import METRICS
+
+logger = ROOT_LOGGER.getChild("fileops")
+
+# ioctl sharing the extents of a file, btrfs and xfs (reflink=1) support it
+FICLONE = 0x40049409
+
+# errors meaning "not on this file system", the next method is tried
+_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL, errno.ENOTTY, errno.ENOSYS,
+                errno.EOPNOTSUPP, errno.EBADF, errno.ETXTBSY)
+
+
+def makedirs(path):
+    """mkdir -p"""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def scandir(path):
+    """Yield (name, path, is_dir, is_symlink) of directory entries,
+    with os.scandir when available so most entries need no stat.
+    """
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(path):
+            yield entry.name, entry.path, entry.is_dir(follow_symlinks=False), entry.is_symlink()
+        return
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        mode = os.lstat(full).st_mode
+        yield name, full, stat.S_ISDIR(mode), stat.S_ISLNK(mode)
+
+
+def walk_files(path):
+    """Yield paths of regular files under path, symlinks are not followed."""
+    for _, full, is_dir, is_symlink in scandir(path):
+        if is_dir:
+            for sub in walk_files(full):
+                yield sub
+        elif not is_symlink:
+            yield full
+
+
+def _reflink(fsrc, fdst):
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError) as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        return False
+    return True
+
+
+def _copy_range(fsrc, fdst):
+    """In kernel copy, may still share extents on nfs and xfs."""
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    size = os.fstat(fsrc.fileno()).st_size
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        # start over in user space
+        fdst.seek(0)
+        fdst.truncate()
+        fsrc.seek(0)
+        return False
+    return copied == size
+
+
+def copy_file(src, dst):
+    """Copy content, mode and times of src to dst. Uses a reflink, then
+    copy_file_range and a plain copy as the file system allows.
+    """
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            if _reflink(fsrc, fdst):
+                METRICS.count('files_reflinked')
+            elif _copy_range(fsrc, fdst):
+                METRICS.count('bytes_copied', os.fstat(fsrc.fileno()).st_size)
+            else:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+                METRICS.count('bytes_copied', os.fstat(fsrc.fileno()).st_size)
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src, dst):
+    """Hard link src to dst, copy if the file system does not allow it."""
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        copy_file(src, dst)
+    else:
+        METRICS.count('files_linked')
+
+
+def _copy_owner(src, dst):
+    st = os.lstat(src)
+    try:
+        os.lchown(dst, st.st_uid, st.st_gid)
+    except OSError as e:
+        # only root may give files away
+        if e.errno != errno.EPERM:
+            raise
+
+
+def copy_tree(src, dst, link=False):
+    """cp -a src dst: directories, symlinks, modes, times and, when
+    permitted, owners are kept. With link, files are hard linked into dst
+    when possible, so dst must then be treated as read-only.
+    """
+    makedirs(dst)
+    for name, path, is_dir, is_symlink in scandir(src):
+        target = os.path.join(dst, name)
+        if is_symlink:
+            if os.path.lexists(target):
+                os.remove(target)
+            os.symlink(os.readlink(path), target)
+        elif is_dir:
+            copy_tree(path, target, link=link)
+        else:
+            if os.path.lexists(target):
+                os.remove(target)
+            if link:
+                link_or_copy(path, target)
+            else:
+                copy_file(path, target)
+        _copy_owner(path, target)
+    shutil.copystat(src, dst)
+    _copy_owner(src, dst)
+
+
+def move(src, dst):
+    """mv src dst, copying across file systems."""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        if os.path.isdir(src) and not os.path.islink(src):
+            copy_tree(src, dst)
+            shutil.rmtree(src)
+        else:
+            copy_file(src, dst)
+            os.remove(src)
+
+
+def chmod_tree(path, mode):
+    """chmod -R mode path, symlinks are left alone."""
+    os.chmod(path, mode)
+    if os.path.isdir(path) and not os.path.islink(path):
+        for _, full, is_dir, is_symlink in scandir(path):
+            if is_symlink:
+                continue
+            if is_dir:
+                chmod_tree(full, mode)
+            else:
+                os.chmod(full, mode)
@@ -1,43 +1,51 @@
 # coding: utf-8
 
 import os
-import sys
-import subprocess
+import hashlib
 
-from .config import ENV, PROJ_DIR, ROOT_LOGGER
+from . import fileops
+from .config import PROJ_DIR, ROOT_LOGGER
 
 logger = ROOT_LOGGER.getChild("helper")
 
-
-def run(cmd, suppress=False):
-    """shell=True is dangerous, but it's fine to use here.
-    """
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    if p.returncode != 0:
-        if suppress:
-            return out, err
-        else:
-            logger.info("stdout: {}".format(out))
-            logger.error("stderr: {}".format(err))
-            sys.exit(3)
-    else:
-        if out and ENV == 'dev':
-            logger.debug("stdout: {}".format(out))
-        return out
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
 
 
 def move(src, dst, mode=None):
-    """copy move"""
+    """copy move, mode is octal like 755"""
     suffix = src.split("/")[-1]
+    if isinstance(mode, str):
+        mode = int(mode, 8)
     if os.path.isdir(src):
-        run("cp -rp {} {}".format(src, dst))
+        target = os.path.join(dst, suffix) if os.path.isdir(dst) else dst
+        fileops.copy_tree(src, target)
         if mode:
-            run("chmod -R {} {}".format(mode, dst + "/" + suffix))
+            fileops.chmod_tree(target, mode)
     else:
-        run("cp {} {}".format(src, dst))
+        target = os.path.join(dst, suffix) if os.path.isdir(dst) else dst
+        fileops.copy_file(src, target)
         if mode:
-            run("chmod {} {}".format(mode, dst))
+            os.chmod(target, mode)
+
+
+def new_hash(checksum_type='sha256'):
+    """hashlib object of a repodata checksum type, old repos call sha1 sha"""
+    return hashlib.new('sha1' if checksum_type == 'sha' else checksum_type)
+
+
+def file_checksum(path, checksum_type='sha256'):
+    """hex digest of a file"""
+    h = new_hash(checksum_type)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
 
 
 def cmd_exists(cmd, path=None):
@@ -1,9 +1,13 @@
 # coding: utf-8
 
 import os
+import shutil
 
+from ..archive import IndexedArchive, compression_of, check_compression, extract_archive
 from ..config import ROOT_LOGGER
-from ..helper import run, cmd_exists, FileEditor
+from ..helper import cmd_exists, FileEditor
+from ..manifest import BundleManifest, MANIFEST_FILE
+from ..metrics import METRICS
 
 
 class RPMRepoImporter(object):
@@ -17,12 +21,15 @@ class RPMRepoImporter(object):
 
     logger = ROOT_LOGGER.getChild("importer")
 
-    def __init__(self, name, path, desc_name=None, file_name=None):
+    def __init__(self, name, path, desc_name=None, file_name=None, repodata_only=False, packages=None):
         self.name = name
         self.path = os.path.abspath(path)
         self.repo = None
         self.desc_name = desc_name
         self.file_name = file_name
+        # selective import, needs an indexed bundle
+        self.repodata_only = repodata_only
+        self.packages = packages or []
 
     def prepare(self):
         # check
@@ -30,10 +37,14 @@ class RPMRepoImporter(object):
             raise ValueError("path is not a valid directory: {}".format(self.repo))
         if not os.path.isfile(self.path):
             raise ValueError("path is not a valid file: {}".format(self.path))
-        if not self.path.endswith('.tar.gz'):
+        compression = compression_of(self.path)
+        if compression is None:
             raise ValueError("path is not a valid archive: {}".format(self.path))
+        check_compression(compression)
+        if self.selective and not IndexedArchive.is_indexed(self.path):
+            raise ValueError("selective import needs an indexed bundle: {}".format(self.path))
 
-        cmds = ['rpm', 'tar']
+        cmds = ['rpm']
         for cmd in cmds:
             if not cmd_exists(cmd):
                 raise ValueError("command not found: {}".format(cmd))
@@ -49,8 +60,65 @@ class RPMRepoImporter(object):
             name_list.remove('offline')
         return ''.join(name_list).upper()
 
+    @property
+    def selective(self):
+        return self.repodata_only or bool(self.packages)
+
+    def select_members(self, archive, manifest):
+        """Index entries of manifest, repodata and the requested packages."""
+        wanted = set(self.packages)
+        selected = []
+        for entry in archive.members:
+            parts = entry['name'].split('/', 1)
+            fn = parts[-1]
+            if len(parts) == 1 or fn == MANIFEST_FILE or fn == 'repodata' or fn.startswith('repodata/'):
+                selected.append(entry)
+                continue
+            info = manifest.packages.get(fn) if manifest is not None else None
+            name = info['nevra'].rsplit('-', 2)[0] if info else None
+            if fn in wanted or name in wanted:
+                selected.append(entry)
+        return selected
+
+    def extract(self, manifest):
+        METRICS.count('bytes_read', os.path.getsize(self.path))
+        if not self.selective:
+            METRICS.count('bytes_written', extract_archive(self.path, self.repo))
+            return
+        archive = IndexedArchive(self.path)
+        members = self.select_members(archive, manifest)
+        METRICS.count('bytes_written', archive.extract(self.repo, members))
+        self.logger.info("Extracted {} of {} bundle members".format(len(members), len(archive.members)))
+
+    def apply_delta(self, manifest):
+        """Apply a delta bundle on top of an already imported repository."""
+        target = os.path.join(self.repo, manifest.name)
+        current_path = os.path.join(target, MANIFEST_FILE)
+        if not os.path.isfile(current_path):
+            raise ValueError("no imported repository to apply delta on: {}".format(target))
+        current = BundleManifest.load(current_path)
+        if current.id != manifest.base:
+            raise ValueError("delta base {} does not match imported repository {}".format(
+                manifest.base, current.id))
+
+        # delta carries the complete repodata of the merged repository
+        shutil.rmtree(os.path.join(target, 'repodata'), ignore_errors=True)
+        self.extract(manifest)
+        for fn in manifest.removed:
+            path = os.path.join(target, fn)
+            if os.path.isfile(path):
+                os.remove(path)
+        self.logger.info("Applied delta bundle, {} packages removed".format(len(manifest.removed)))
+
     def make(self):
-        run("tar -C {} -zxf {}".format(self.repo, self.path))
+        manifest = BundleManifest.load_bundle(self.path)
+        if manifest is not None:
+            METRICS.count('packages_imported', len(manifest.packages))
+        with METRICS.phase('extract'):
+            if manifest is not None and manifest.is_delta:
+                self.apply_delta(manifest)
+            else:
+                self.extract(manifest)
         cmd = """[{name}]
 name={desc_name}
 baseurl=file://{path}/{name}
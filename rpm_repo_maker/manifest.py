@@ -0,0 +1,103 @@
+# coding: utf-8
+
+import os
+import json
+import hashlib
+import tarfile
+
+from .archive import open_archive, compression_of
+from .helper import file_checksum
+from .rpmheader import read_header
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class BundleManifest(object):
+    """Content list of a repository bundle.
+
+    `packages` maps rpm file name to its nevra, sha256 and size, it always
+    describes the full repository, also for delta bundles. A delta bundle
+    records the id of the manifest it applies to as `base`, its archive
+    carries only new or changed rpms, and lists the dropped ones in `removed`.
+    """
+
+    def __init__(self, name, packages=None, base=None, removed=None):
+        self.name = name
+        self.packages = packages or {}
+        self.base = base
+        self.removed = removed or []
+
+    @property
+    def id(self):
+        h = hashlib.sha256()
+        for fn in sorted(self.packages):
+            h.update("{} {}\n".format(fn, self.packages[fn]['sha256']).encode('utf-8'))
+        return h.hexdigest()
+
+    @property
+    def is_delta(self):
+        return self.base is not None
+
+    @classmethod
+    def from_dir(cls, name, path):
+        """Build manifest of rpm files in a repository directory."""
+        packages = {}
+        for fn in sorted(os.listdir(path)):
+            fp = os.path.join(path, fn)
+            if not fn.endswith('.rpm') or not os.path.isfile(fp):
+                continue
+            packages[fn] = {
+                'nevra': read_header(fp).nevra,
+                'sha256': file_checksum(fp),
+                'size': os.path.getsize(fp),
+            }
+        return cls(name, packages)
+
+    def delta(self, base):
+        """Return (delta manifest, changed file names) against a base manifest."""
+        changed = [
+            fn for fn, info in sorted(self.packages.items())
+            if base.packages.get(fn, {}).get('sha256') != info['sha256']
+        ]
+        removed = sorted(fn for fn in base.packages if fn not in self.packages)
+        return BundleManifest(self.name, self.packages, base=base.id, removed=removed), changed
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'id': self.id,
+            'base': self.base,
+            'removed': self.removed,
+            'packages': self.packages,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['packages'], base=data.get('base'), removed=data.get('removed'))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """Load manifest from a manifest file or a bundle archive."""
+        if compression_of(path) is not None:
+            return cls.load_bundle(path)
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def load_bundle(cls, path):
+        """Load manifest of a bundle archive, None for bundles without one.
+        The manifest is the first member, so only the head is decompressed.
+        """
+        stream = open_archive(path)
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                member = tar.next()
+                if member is None or os.path.basename(member.name) != MANIFEST_FILE:
+                    return None
+                return cls.from_dict(json.loads(tar.extractfile(member).read().decode('utf-8')))
+        finally:
+            stream.close()
@@ -0,0 +1,151 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import errno
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .config import ROOT_LOGGER
+
+logger = ROOT_LOGGER.getChild("metrics")
+
+
+def cpu_time():
+    """User and system time of this process and its waited-for children."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+class Metrics(object):
+    """Phase timings and counters of one command run.
+
+    Phases nest, their names are joined with `/`, e.g. `generate/download`.
+    Counters are plain sums such as bytes downloaded or packages served by
+    the cache. Commands run through runner.run_command and check_command are timed
+    as subprocesses. With a progress file, phase starts, ends and progress
+    steps are appended as JSON lines, a poller only reads the last line.
+    """
+
+    # slowest subprocesses listed in the metrics file
+    SLOWEST = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, command=None, metrics_file=None, progress_file=None):
+        self.command = command
+        self.metrics_file = metrics_file
+        self.progress_file = progress_file
+        self.started = time.time()
+        self._cpu_started = cpu_time()
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self.subprocesses = []
+        self._stack = []
+        if progress_file:
+            # a new run starts a new stream
+            _ensure_parent(progress_file)
+            open(progress_file, 'w').close()
+
+    def _emit(self, event, **data):
+        if not self.progress_file:
+            return
+        now = time.time()
+        data['event'] = event
+        data['time'] = round(now, 3)
+        data['elapsed'] = round(now - self.started, 3)
+        line = json.dumps(data, sort_keys=True)
+        with self._lock:
+            with open(self.progress_file, 'a') as f:
+                f.write(line + '\n')
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase, wall and cpu seconds add up over repeated entries."""
+        path = '/'.join(self._stack + [name])
+        self._stack.append(name)
+        self._emit('start', phase=path)
+        start, cpu_start = time.time(), cpu_time()
+        status = 'failed'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            wall, cpu = time.time() - start, cpu_time() - cpu_start
+            self._stack.pop()
+            with self._lock:
+                entry = self.phases.setdefault(path, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+                entry['calls'] += 1
+                entry['wall'] += wall
+                entry['cpu'] += cpu
+                entry['status'] = status
+            self._emit('end', phase=path, status=status, wall=round(wall, 3), cpu=round(cpu, 3))
+
+    def count(self, name, n=1):
+        """Add n to a counter, return the new value. Thread safe."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            return self.counters[name]
+
+    def progress(self, **data):
+        """Report a progress step of the current phase, e.g. done=3, total=10."""
+        self._emit('progress', phase='/'.join(self._stack), **data)
+
+    def record_subprocess(self, cmd, seconds, returncode):
+        with self._lock:
+            self.subprocesses.append((seconds, cmd, returncode))
+
+    def to_dict(self, status=None):
+        with self._lock:
+            durations = [seconds for seconds, _, _ in self.subprocesses]
+            slowest = sorted(self.subprocesses, key=lambda item: -item[0])[:self.SLOWEST]
+            return OrderedDict([
+                ('command', self.command),
+                ('status', status),
+                ('started', self.started),
+                ('wall', time.time() - self.started),
+                ('cpu', cpu_time() - self._cpu_started),
+                ('phases', OrderedDict((path, dict(entry)) for path, entry in self.phases.items())),
+                ('counters', OrderedDict(self.counters)),
+                ('subprocesses', OrderedDict([
+                    ('count', len(durations)),
+                    ('failed', sum(1 for _, _, code in self.subprocesses if code != 0)),
+                    ('total', sum(durations)),
+                    ('max', max(durations) if durations else 0.0),
+                    ('slowest', [{'cmd': cmd, 'seconds': seconds, 'returncode': code}
+                                 for seconds, cmd, code in slowest]),
+                ])),
+            ])
+
+    def finish(self, status):
+        """Write the metrics file and the final progress event."""
+        data = self.to_dict(status)
+        self._emit('finish', status=status, wall=round(data['wall'], 3), cpu=round(data['cpu'], 3))
+        if not self.metrics_file:
+            return
+        _ensure_parent(self.metrics_file)
+        root = os.path.dirname(os.path.abspath(self.metrics_file))
+        fd, tmp = tempfile.mkstemp(dir=root, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.rename(tmp, self.metrics_file)
+        logger.info("metrics written to {}".format(self.metrics_file))
+
+
+def _ensure_parent(path):
+    root = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(root):
+        try:
+            os.makedirs(root)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+# metrics of the running command
+METRICS = Metrics()
@@ -0,0 +1,465 @@
+# coding: utf-8
+
+import os
+import re
+import bz2
+import gzip
+import stat
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import multiprocessing
+from xml.sax.saxutils import escape, quoteattr
+
+from . import rpmheader as rh
+from .config import ROOT_LOGGER
+from .helper import file_checksum
+
+logger = ROOT_LOGGER.getChild("repodata")
+
+NS_COMMON = 'http://linux.duke.edu/metadata/common'
+NS_FILELISTS = 'http://linux.duke.edu/metadata/filelists'
+NS_OTHER = 'http://linux.duke.edu/metadata/other'
+NS_REPO = 'http://linux.duke.edu/metadata/repo'
+NS_RPM = 'http://linux.duke.edu/metadata/rpm'
+
+DB_VERSION = 10
+CHANGELOG_LIMIT = 10
+
+# files listed in primary metadata, same rule as createrepo
+PRIMARY_FILE_RE = re.compile(r'^(.*bin/.*|/etc/.*|/usr/lib/sendmail)$')
+
+DEPENDENCY_TAGS = (
+    ('provides', rh.RPMTAG_PROVIDENAME, rh.RPMTAG_PROVIDEFLAGS, rh.RPMTAG_PROVIDEVERSION),
+    ('requires', rh.RPMTAG_REQUIRENAME, rh.RPMTAG_REQUIREFLAGS, rh.RPMTAG_REQUIREVERSION),
+    ('conflicts', rh.RPMTAG_CONFLICTNAME, rh.RPMTAG_CONFLICTFLAGS, rh.RPMTAG_CONFLICTVERSION),
+    ('obsoletes', rh.RPMTAG_OBSOLETENAME, rh.RPMTAG_OBSOLETEFLAGS, rh.RPMTAG_OBSOLETEVERSION),
+    ('recommends', rh.RPMTAG_RECOMMENDNAME, rh.RPMTAG_RECOMMENDFLAGS, rh.RPMTAG_RECOMMENDVERSION),
+    ('suggests', rh.RPMTAG_SUGGESTNAME, rh.RPMTAG_SUGGESTFLAGS, rh.RPMTAG_SUGGESTVERSION),
+    ('supplements', rh.RPMTAG_SUPPLEMENTNAME, rh.RPMTAG_SUPPLEMENTFLAGS, rh.RPMTAG_SUPPLEMENTVERSION),
+    ('enhances', rh.RPMTAG_ENHANCENAME, rh.RPMTAG_ENHANCEFLAGS, rh.RPMTAG_ENHANCEVERSION),
+)
+
+PRIMARY_SCHEMA = """
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT, arch TEXT, version TEXT,
+    epoch TEXT, release TEXT, summary TEXT, description TEXT, url TEXT, time_file INTEGER,
+    time_build INTEGER, rpm_license TEXT, rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT,
+    rpm_sourcerpm TEXT, rpm_header_start INTEGER, rpm_header_end INTEGER, rpm_packager TEXT,
+    size_package INTEGER, size_installed INTEGER, size_archive INTEGER, location_href TEXT,
+    location_base TEXT, checksum_type TEXT);
+CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER);
+CREATE TABLE requires (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER,
+    pre BOOLEAN DEFAULT FALSE);
+CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE TABLE conflicts (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE TABLE obsoletes (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE TABLE recommends (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE TABLE suggests (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE TABLE supplements (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE TABLE enhances (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER);
+CREATE INDEX packagename ON packages (name);
+CREATE INDEX packageId ON packages (pkgId);
+CREATE INDEX filenames ON files (name);
+CREATE INDEX pkgfiles ON files (pkgKey);
+CREATE INDEX pkgprovides ON provides (pkgKey);
+CREATE INDEX providesname ON provides (name);
+CREATE INDEX pkgrequires ON requires (pkgKey);
+CREATE INDEX requiresname ON requires (name);
+CREATE INDEX pkgconflicts ON conflicts (pkgKey);
+CREATE INDEX pkgobsoletes ON obsoletes (pkgKey);
+"""
+
+FILELISTS_SCHEMA = """
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT);
+CREATE TABLE filelist (pkgKey INTEGER, dirname TEXT, filenames TEXT, filetypes TEXT);
+CREATE INDEX keyfile ON filelist (pkgKey);
+CREATE INDEX pkgId ON packages (pkgId);
+CREATE INDEX dirnames ON filelist (dirname);
+"""
+
+OTHER_SCHEMA = """
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT);
+CREATE TABLE changelog (pkgKey INTEGER, author TEXT, date INTEGER, changelog TEXT);
+CREATE INDEX keychange ON changelog (pkgKey);
+CREATE INDEX pkgId ON packages (pkgId);
+"""
+
+
+def split_evr(evr):
+    """Split "[epoch:]version[-release]" into (epoch, version, release)."""
+    if not evr:
+        return None, None, None
+    epoch = '0'
+    if ':' in evr:
+        epoch, evr = evr.split(':', 1)
+    release = None
+    if '-' in evr:
+        evr, release = evr.rsplit('-', 1)
+    return epoch, evr, release
+
+
+def sense_flags(flags):
+    flags &= rh.RPMSENSE_LESS | rh.RPMSENSE_GREATER | rh.RPMSENSE_EQUAL
+    return {
+        rh.RPMSENSE_LESS: 'LT',
+        rh.RPMSENSE_GREATER: 'GT',
+        rh.RPMSENSE_EQUAL: 'EQ',
+        rh.RPMSENSE_LESS | rh.RPMSENSE_EQUAL: 'LE',
+        rh.RPMSENSE_GREATER | rh.RPMSENSE_EQUAL: 'GE',
+    }.get(flags)
+
+
+def _file_type(mode, flags):
+    if flags & rh.RPMFILE_GHOST:
+        return 'ghost'
+    if stat.S_ISDIR(mode):
+        return 'dir'
+    return 'file'
+
+
+def read_package(path, href=None):
+    """Read everything repodata needs of a rpm file into a plain dict."""
+    hdr = rh.read_header(path)
+    st = os.stat(path)
+    pkg = {
+        'pkgid': file_checksum(path),
+        'name': hdr.name,
+        'arch': hdr.arch,
+        'epoch': str(hdr.epoch),
+        'version': hdr.version,
+        'release': hdr.release,
+        'summary': hdr.get_one(rh.RPMTAG_SUMMARY, ''),
+        'description': hdr.get_one(rh.RPMTAG_DESCRIPTION, ''),
+        'packager': hdr.get_one(rh.RPMTAG_PACKAGER, ''),
+        'url': hdr.get_one(rh.RPMTAG_URL, ''),
+        'time_file': int(st.st_mtime),
+        'time_build': hdr.get_one(rh.RPMTAG_BUILDTIME, 0),
+        'size_package': st.st_size,
+        'size_installed': hdr.get_one(rh.RPMTAG_LONGSIZE) or hdr.get_one(rh.RPMTAG_SIZE, 0),
+        'size_archive': hdr.get_one(rh.RPMTAG_ARCHIVESIZE, 0),
+        'location': href or os.path.basename(path),
+        'license': hdr.get_one(rh.RPMTAG_LICENSE, ''),
+        'vendor': hdr.get_one(rh.RPMTAG_VENDOR, ''),
+        'group': hdr.get_one(rh.RPMTAG_GROUP, ''),
+        'buildhost': hdr.get_one(rh.RPMTAG_BUILDHOST, ''),
+        'sourcerpm': hdr.get_one(rh.RPMTAG_SOURCERPM, ''),
+        'header_start': hdr.start,
+        'header_end': hdr.end,
+        'files': [[fn, _file_type(mode, flags)] for fn, mode, flags in hdr.files()],
+    }
+
+    for key, name_tag, flags_tag, version_tag in DEPENDENCY_TAGS:
+        entries = []
+        seen = set()
+        for name, flags, evr in hdr.dependencies(name_tag, flags_tag, version_tag):
+            if key == 'requires' and name.startswith('rpmlib('):
+                continue
+            pre = key == 'requires' and bool(
+                flags & (rh.RPMSENSE_PREREQ | rh.RPMSENSE_SCRIPT_PRE | rh.RPMSENSE_SCRIPT_POST))
+            epoch, ver, rel = split_evr(evr)
+            entry = [name, sense_flags(flags), epoch, ver, rel, pre]
+            if tuple(entry) in seen:
+                continue
+            seen.add(tuple(entry))
+            entries.append(entry)
+        pkg[key] = entries
+
+    times = hdr.get_list(rh.RPMTAG_CHANGELOGTIME)
+    names = hdr.get_list(rh.RPMTAG_CHANGELOGNAME)
+    texts = hdr.get_list(rh.RPMTAG_CHANGELOGTEXT)
+    pkg['changelogs'] = [list(entry) for entry in zip(names, times, texts)][:CHANGELOG_LIMIT]
+    return pkg
+
+
+def _read_package_worker(args):
+    path, href = args
+    return read_package(path, href)
+
+
+def _attr(name, value):
+    if value is None:
+        return ''
+    return u' {}={}'.format(name, quoteattr(u'{}'.format(value)))
+
+
+def _version_xml(pkg):
+    return u'  <version epoch="{}" ver={} rel={}/>\n'.format(
+        pkg['epoch'], quoteattr(pkg['version']), quoteattr(pkg['release']))
+
+
+def _primary_xml(pkg):
+    out = [
+        u'<package type="rpm">\n',
+        u'  <name>{}</name>\n'.format(escape(pkg['name'])),
+        u'  <arch>{}</arch>\n'.format(escape(pkg['arch'])),
+        _version_xml(pkg),
+        u'  <checksum type="sha256" pkgid="YES">{}</checksum>\n'.format(pkg['pkgid']),
+        u'  <summary>{}</summary>\n'.format(escape(pkg['summary'])),
+        u'  <description>{}</description>\n'.format(escape(pkg['description'])),
+        u'  <packager>{}</packager>\n'.format(escape(pkg['packager'])),
+        u'  <url>{}</url>\n'.format(escape(pkg['url'])),
+        u'  <time file="{}" build="{}"/>\n'.format(pkg['time_file'], pkg['time_build']),
+        u'  <size package="{}" installed="{}" archive="{}"/>\n'.format(
+            pkg['size_package'], pkg['size_installed'], pkg['size_archive']),
+        u'  <location href={}/>\n'.format(quoteattr(pkg['location'])),
+        u'  <format>\n',
+        u'    <rpm:license>{}</rpm:license>\n'.format(escape(pkg['license'])),
+        u'    <rpm:vendor>{}</rpm:vendor>\n'.format(escape(pkg['vendor'])),
+        u'    <rpm:group>{}</rpm:group>\n'.format(escape(pkg['group'])),
+        u'    <rpm:buildhost>{}</rpm:buildhost>\n'.format(escape(pkg['buildhost'])),
+        u'    <rpm:sourcerpm>{}</rpm:sourcerpm>\n'.format(escape(pkg['sourcerpm'])),
+        u'    <rpm:header-range start="{}" end="{}"/>\n'.format(pkg['header_start'], pkg['header_end']),
+    ]
+    for key, _, _, _ in DEPENDENCY_TAGS:
+        if not pkg[key]:
+            continue
+        out.append(u'    <rpm:{}>\n'.format(key))
+        for name, flags, epoch, ver, rel, pre in pkg[key]:
+            out.append(u'      <rpm:entry{}{}{}{}{}{}/>\n'.format(
+                _attr('name', name), _attr('flags', flags), _attr('epoch', epoch),
+                _attr('ver', ver), _attr('rel', rel), u' pre="1"' if pre else u''))
+        out.append(u'    </rpm:{}>\n'.format(key))
+    for fn, typ in pkg['files']:
+        if PRIMARY_FILE_RE.match(fn):
+            out.append(u'    <file{}>{}</file>\n'.format(u'' if typ == 'file' else _attr('type', typ), escape(fn)))
+    out.append(u'  </format>\n</package>\n')
+    return u''.join(out)
+
+
+def _filelists_xml(pkg):
+    out = [
+        u'<package pkgid="{}" name={} arch={}>\n'.format(pkg['pkgid'], quoteattr(pkg['name']), quoteattr(pkg['arch'])),
+        _version_xml(pkg),
+    ]
+    for fn, typ in pkg['files']:
+        out.append(u'  <file{}>{}</file>\n'.format(u'' if typ == 'file' else _attr('type', typ), escape(fn)))
+    out.append(u'</package>\n')
+    return u''.join(out)
+
+
+def _other_xml(pkg):
+    out = [
+        u'<package pkgid="{}" name={} arch={}>\n'.format(pkg['pkgid'], quoteattr(pkg['name']), quoteattr(pkg['arch'])),
+        _version_xml(pkg),
+    ]
+    for author, date, text in pkg['changelogs']:
+        out.append(u'  <changelog author={} date="{}">{}</changelog>\n'.format(
+            quoteattr(author), date, escape(text)))
+    out.append(u'</package>\n')
+    return u''.join(out)
+
+
+class _Output(object):
+    """Gzipped xml file, tracks checksums of compressed and open data."""
+
+    def __init__(self, path):
+        self.path = path
+        self.open_checksum = hashlib.sha256()
+        self.open_size = 0
+        self._f = gzip.open(path, 'wb')
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.open_checksum.update(data)
+        self.open_size += len(data)
+        self._f.write(data)
+
+    def close(self):
+        self._f.close()
+
+
+class RepodataGenerator(object):
+    """In process replacement of `createrepo --database`.
+
+    RPM headers are read and checksummed in parallel worker processes, then
+    primary/filelists/other xml and sqlite databases plus repomd.xml are
+    written into <directory>/repodata. Parsed package data can be reused
+    through a meta cache providing get(path) and put(path, pkg).
+    """
+
+    def __init__(self, jobs=None, meta_cache=None):
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.meta_cache = meta_cache
+
+    def read_packages(self, directory):
+        files = sorted(fn for fn in os.listdir(directory) if fn.endswith('.rpm'))
+        packages = {}
+        todo = []
+        for fn in files:
+            path = os.path.join(directory, fn)
+            pkg = self.meta_cache.get(path) if self.meta_cache is not None else None
+            if pkg is not None:
+                packages[fn] = pkg
+            else:
+                todo.append((path, fn))
+
+        if len(todo) > 1 and self.jobs > 1:
+            pool = multiprocessing.Pool(min(self.jobs, len(todo)))
+            try:
+                results = pool.map(_read_package_worker, todo, chunksize=max(1, len(todo) // (self.jobs * 4)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_read_package_worker(args) for args in todo]
+
+        for (path, fn), pkg in zip(todo, results):
+            packages[fn] = pkg
+            if self.meta_cache is not None:
+                self.meta_cache.put(path, pkg)
+        logger.info("read {} rpm headers, {} from cache".format(len(files), len(files) - len(todo)))
+        return [packages[fn] for fn in files]
+
+    def _write_xml(self, workdir, packages):
+        count = len(packages)
+        outputs = {
+            'primary': _Output(os.path.join(workdir, 'primary.xml.gz')),
+            'filelists': _Output(os.path.join(workdir, 'filelists.xml.gz')),
+            'other': _Output(os.path.join(workdir, 'other.xml.gz')),
+        }
+        head = u'<?xml version="1.0" encoding="UTF-8"?>\n'
+        outputs['primary'].write(head + u'<metadata xmlns="{}" xmlns:rpm="{}" packages="{}">\n'.format(
+            NS_COMMON, NS_RPM, count))
+        outputs['filelists'].write(head + u'<filelists xmlns="{}" packages="{}">\n'.format(NS_FILELISTS, count))
+        outputs['other'].write(head + u'<otherdata xmlns="{}" packages="{}">\n'.format(NS_OTHER, count))
+        for pkg in packages:
+            outputs['primary'].write(_primary_xml(pkg))
+            outputs['filelists'].write(_filelists_xml(pkg))
+            outputs['other'].write(_other_xml(pkg))
+        outputs['primary'].write(u'</metadata>\n')
+        outputs['filelists'].write(u'</filelists>\n')
+        outputs['other'].write(u'</otherdata>\n')
+        for output in outputs.values():
+            output.close()
+        return outputs
+
+    def _write_db(self, path, schema, checksum, fill):
+        conn = sqlite3.connect(path)
+        try:
+            conn.executescript(schema)
+            conn.execute("INSERT INTO db_info (dbversion, checksum) VALUES (?, ?)", (DB_VERSION, checksum))
+            fill(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _fill_primary(self, packages):
+        def fill(conn):
+            for key, pkg in enumerate(packages, 1):
+                conn.execute(
+                    "INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,"
+                    " ?, ?, ?, ?)",
+                    (key, pkg['pkgid'], pkg['name'], pkg['arch'], pkg['version'], pkg['epoch'], pkg['release'],
+                     pkg['summary'], pkg['description'], pkg['url'], pkg['time_file'], pkg['time_build'],
+                     pkg['license'], pkg['vendor'], pkg['group'], pkg['buildhost'], pkg['sourcerpm'],
+                     pkg['header_start'], pkg['header_end'], pkg['packager'], pkg['size_package'],
+                     pkg['size_installed'], pkg['size_archive'], pkg['location'], None, 'sha256'))
+                for dep_key, _, _, _ in DEPENDENCY_TAGS:
+                    for name, flags, epoch, ver, rel, pre in pkg[dep_key]:
+                        if dep_key == 'requires':
+                            conn.execute("INSERT INTO requires VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         (name, flags, epoch, ver, rel, key, 'TRUE' if pre else 'FALSE'))
+                        else:
+                            conn.execute("INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?)".format(dep_key),
+                                         (name, flags, epoch, ver, rel, key))
+                conn.executemany("INSERT INTO files VALUES (?, ?, ?)", [
+                    (fn, typ, key) for fn, typ in pkg['files'] if PRIMARY_FILE_RE.match(fn)])
+        return fill
+
+    def _fill_filelists(self, packages):
+        def fill(conn):
+            for key, pkg in enumerate(packages, 1):
+                conn.execute("INSERT INTO packages VALUES (?, ?)", (key, pkg['pkgid']))
+                dirs = {}
+                for fn, typ in pkg['files']:
+                    dirname, basename = os.path.split(fn)
+                    dirs.setdefault(dirname, []).append((basename, typ[0]))
+                for dirname in sorted(dirs):
+                    entries = dirs[dirname]
+                    conn.execute("INSERT INTO filelist VALUES (?, ?, ?, ?)", (
+                        key, dirname, '/'.join(e[0] for e in entries), ''.join(e[1] for e in entries)))
+        return fill
+
+    def _fill_other(self, packages):
+        def fill(conn):
+            for key, pkg in enumerate(packages, 1):
+                conn.execute("INSERT INTO packages VALUES (?, ?)", (key, pkg['pkgid']))
+                conn.executemany("INSERT INTO changelog VALUES (?, ?, ?, ?)", [
+                    (key, author, date, text) for author, date, text in pkg['changelogs']])
+        return fill
+
+    @staticmethod
+    def _compress_bz2(src, dst):
+        with open(src, 'rb') as fin:
+            out = bz2.BZ2File(dst, 'wb')
+            try:
+                shutil.copyfileobj(fin, out, 1024 * 1024)
+            finally:
+                out.close()
+        os.remove(src)
+
+    def generate(self, directory):
+        start = time.time()
+        packages = self.read_packages(directory)
+
+        workdir = tempfile.mkdtemp(prefix='.repodata-', dir=directory)
+        try:
+            outputs = self._write_xml(workdir, packages)
+            records = []
+            for typ, output in sorted(outputs.items()):
+                records.append((typ, output.path, output.open_checksum.hexdigest(), output.open_size, None))
+
+            fills = {
+                'primary': (PRIMARY_SCHEMA, self._fill_primary(packages)),
+                'filelists': (FILELISTS_SCHEMA, self._fill_filelists(packages)),
+                'other': (OTHER_SCHEMA, self._fill_other(packages)),
+            }
+            for typ, output in sorted(outputs.items()):
+                schema, fill = fills[typ]
+                db_path = os.path.join(workdir, '{}.sqlite'.format(typ))
+                self._write_db(db_path, schema, file_checksum(output.path), fill)
+                db_checksum = file_checksum(db_path)
+                db_size = os.path.getsize(db_path)
+                self._compress_bz2(db_path, db_path + '.bz2')
+                records.append(('{}_db'.format(typ), db_path + '.bz2', db_checksum, db_size, DB_VERSION))
+
+            self._write_repomd(workdir, records)
+            target = os.path.join(directory, 'repodata')
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            os.rename(workdir, target)
+        except Exception:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        logger.info("repodata of {} packages generated in {:.2f}s".format(len(packages), time.time() - start))
+
+    def _write_repomd(self, workdir, records):
+        now = int(time.time())
+        out = [
+            u'<?xml version="1.0" encoding="UTF-8"?>\n',
+            u'<repomd xmlns="{}" xmlns:rpm="{}">\n'.format(NS_REPO, NS_RPM),
+            u'  <revision>{}</revision>\n'.format(now),
+        ]
+        for typ, path, open_checksum, open_size, db_version in records:
+            checksum = file_checksum(path)
+            # unique file names, like createrepo_c does by default
+            fn = '{}-{}'.format(checksum, os.path.basename(path))
+            os.rename(path, os.path.join(workdir, fn))
+            out.append(u'  <data type="{}">\n'.format(typ))
+            out.append(u'    <checksum type="sha256">{}</checksum>\n'.format(checksum))
+            out.append(u'    <open-checksum type="sha256">{}</open-checksum>\n'.format(open_checksum))
+            out.append(u'    <location href="repodata/{}"/>\n'.format(fn))
+            out.append(u'    <timestamp>{}</timestamp>\n'.format(now))
+            out.append(u'    <size>{}</size>\n'.format(os.path.getsize(os.path.join(workdir, fn))))
+            out.append(u'    <open-size>{}</open-size>\n'.format(open_size))
+            if db_version is not None:
+                out.append(u'    <database_version>{}</database_version>\n'.format(db_version))
+            out.append(u'  </data>\n')
+        out.append(u'</repomd>\n')
+        with open(os.path.join(workdir, 'repomd.xml'), 'wb') as f:
+            f.write(u''.join(out).encode('utf-8'))
@@ -0,0 +1,223 @@
+import struct
+
+LEAD_SIZE = 96
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+
+# header tag types
+RPM_NULL_TYPE = 0
+RPM_CHAR_TYPE = 1
+RPM_INT8_TYPE = 2
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+# header tags
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_SUMMARY = 1004
+RPMTAG_DESCRIPTION = 1005
+RPMTAG_BUILDTIME = 1006
+RPMTAG_BUILDHOST = 1007
+RPMTAG_SIZE = 1009
+RPMTAG_VENDOR = 1011
+RPMTAG_LICENSE = 1014
+RPMTAG_PACKAGER = 1015
+RPMTAG_GROUP = 1016
+RPMTAG_URL = 1020
+RPMTAG_ARCH = 1022
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_SOURCERPM = 1044
+RPMTAG_ARCHIVESIZE = 1046
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIREFLAGS = 1048
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_REQUIREVERSION = 1050
+RPMTAG_CONFLICTFLAGS = 1053
+RPMTAG_CONFLICTNAME = 1054
+RPMTAG_CONFLICTVERSION = 1055
+RPMTAG_CHANGELOGTIME = 1080
+RPMTAG_CHANGELOGNAME = 1081
+RPMTAG_CHANGELOGTEXT = 1082
+RPMTAG_OBSOLETENAME = 1090
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMTAG_OBSOLETEFLAGS = 1114
+RPMTAG_OBSOLETEVERSION = 1115
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_LONGSIZE = 5009
+RPMTAG_RECOMMENDNAME = 5046
+RPMTAG_RECOMMENDVERSION = 5047
+RPMTAG_RECOMMENDFLAGS = 5048
+RPMTAG_SUGGESTNAME = 5049
+RPMTAG_SUGGESTVERSION = 5050
+RPMTAG_SUGGESTFLAGS = 5051
+RPMTAG_SUPPLEMENTNAME = 5052
+RPMTAG_SUPPLEMENTVERSION = 5053
+RPMTAG_SUPPLEMENTFLAGS = 5054
+RPMTAG_ENHANCENAME = 5055
+RPMTAG_ENHANCEVERSION = 5056
+RPMTAG_ENHANCEFLAGS = 5057
+
+# dependency sense flags
+RPMSENSE_LESS = 1 << 1
+RPMSENSE_GREATER = 1 << 2
+RPMSENSE_EQUAL = 1 << 3
+RPMSENSE_PREREQ = 1 << 6
+RPMSENSE_SCRIPT_PRE = 1 << 9
+RPMSENSE_SCRIPT_POST = 1 << 10
+
+# file flags
+RPMFILE_GHOST = 1 << 6
+
+_INT_FORMATS = {
+    RPM_CHAR_TYPE: ('B', 1),
+    RPM_INT8_TYPE: ('B', 1),
+    RPM_INT16_TYPE: ('H', 2),
+    RPM_INT32_TYPE: ('I', 4),
+    RPM_INT64_TYPE: ('Q', 8),
+}
+
+
+class RPMHeader(object):
+    """Main header of a rpm file.
+
+    `start` and `end` are the byte range of the header in the file.
+    """
+
+    def __init__(self, tags, start, end):
+        self.tags = tags
+        self.start = start
+        self.end = end
+
+    def get(self, tag, default=None):
+        return self.tags.get(tag, default)
+
+    def get_one(self, tag, default=None):
+        value = self.tags.get(tag)
+        if isinstance(value, list):
+            return value[0] if value else default
+        return default if value is None else value
+
+    @property
+    def name(self):
+        return self.get_one(RPMTAG_NAME)
+
+    @property
+    def epoch(self):
+        return self.get_one(RPMTAG_EPOCH, 0)
+
+    @property
+    def version(self):
+        return self.get_one(RPMTAG_VERSION)
+
+    @property
+    def release(self):
+        return self.get_one(RPMTAG_RELEASE)
+
+    @property
+    def arch(self):
+        # source packages carry the build arch, but have no source rpm
+        if RPMTAG_SOURCERPM not in self.tags:
+            return 'src'
+        return self.get_one(RPMTAG_ARCH)
+
+    @property
+    def nevra(self):
+        return format_nevra(self.name, self.epoch, self.version, self.release, self.arch)
+
+    def get_list(self, tag):
+        value = self.tags.get(tag)
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return value
+        return [value]
+
+    def dependencies(self, name_tag, flags_tag, version_tag):
+        """Return (name, flags, evr) tuples of a dependency tag set."""
+        names = self.get_list(name_tag)
+        flags = self.get_list(flags_tag) or [0] * len(names)
+        versions = self.get_list(version_tag) or [''] * len(names)
+        return list(zip(names, flags, versions))
+
+    def files(self):
+        """Return (path, mode, flags) tuples of packaged files."""
+        basenames = self.get_list(RPMTAG_BASENAMES)
+        dirnames = self.get_list(RPMTAG_DIRNAMES)
+        dirindexes = self.get_list(RPMTAG_DIRINDEXES)
+        modes = self.get_list(RPMTAG_FILEMODES) or [0] * len(basenames)
+        flags = self.get_list(RPMTAG_FILEFLAGS) or [0] * len(basenames)
+        return [
+            (dirnames[dirindexes[i]] + basenames[i], modes[i], flags[i])
+            for i in range(len(basenames))
+        ]
+
+
+def format_nevra(name, epoch, version, release, arch):
+    return "{}-{}:{}-{}.{}".format(name, epoch or 0, version, release, arch)
+
+
+def _decode(data):
+    return data.decode('utf-8', 'replace')
+
+
+def _read_value(store, typ, offset, count):
+    if typ in _INT_FORMATS:
+        fmt, size = _INT_FORMATS[typ]
+        return list(struct.unpack('>{}{}'.format(count, fmt), store[offset:offset + size * count]))
+    if typ == RPM_BIN_TYPE:
+        return store[offset:offset + count]
+    if typ == RPM_STRING_TYPE:
+        return _decode(store[offset:store.index(b'\x00', offset)])
+    if typ in (RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE):
+        values = []
+        for _ in range(count):
+            end = store.index(b'\x00', offset)
+            values.append(_decode(store[offset:end]))
+            offset = end + 1
+        return values
+    return None
+
+
+def _read_section(f, offset, tags=None):
+    """Read a header section at offset, return (tag dict, end offset)."""
+    f.seek(offset)
+    intro = f.read(16)
+    if len(intro) != 16 or intro[:4] != HEADER_MAGIC:
+        raise ValueError("bad rpm header magic at offset {}".format(offset))
+    nindex, hsize = struct.unpack('>II', intro[8:16])
+    index = f.read(nindex * 16)
+    store = f.read(hsize)
+    if len(index) != nindex * 16 or len(store) != hsize:
+        raise ValueError("truncated rpm header at offset {}".format(offset))
+
+    values = {}
+    for i in range(nindex):
+        tag, typ, off, count = struct.unpack('>iiii', index[i * 16:i * 16 + 16])
+        if tags is not None and tag not in tags:
+            continue
+        values[tag] = _read_value(store, typ, off, count)
+    return values, offset + 16 + nindex * 16 + hsize
+
+
+def read_header(path, tags=None):
+    """Read the main header of a rpm file, optionally only some tags."""
+    with open(path, 'rb') as f:
+        lead = f.read(LEAD_SIZE)
+        if len(lead) != LEAD_SIZE or lead[:4] != LEAD_MAGIC:
+            raise ValueError("not a rpm file: {}".format(path))
+        # signature header is padded to 8 bytes
+        _, sig_end = _read_section(f, LEAD_SIZE, tags=())
+        start = sig_end + (8 - sig_end % 8) % 8
+        values, end = _read_section(f, start, tags)
+    return RPMHeader(values, start, end)
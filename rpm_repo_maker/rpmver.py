@@ -0,0 +1,113 @@
+# coding: utf-8
+"""Pure python rpm version comparison, following rpmvercmp of librpm."""
+
+import re
+import functools
+
+_DIGITS_RE = re.compile(r'[0-9]+')
+_ALPHA_RE = re.compile(r'[a-zA-Z]+')
+_ALNUM = frozenset('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# dependency flags of repodata, as sets of senses
+_LESS = frozenset(['LT', 'LE'])
+_GREATER = frozenset(['GT', 'GE'])
+_EQUAL = frozenset(['EQ', 'LE', 'GE'])
+
+
+def rpmvercmp(a, b):
+    """Compare two version or release strings, return -1, 0 or 1.
+
+    Strings are split into digit and letter segments, anything else only
+    separates segments. Digits sort numerically and above letters, `~`
+    sorts before everything, even the end of the string, and `^` sorts
+    after the end of the string but before anything else.
+    """
+    if a == b:
+        return 0
+    i, j = 0, 0
+    la, lb = len(a), len(b)
+    while i < la or j < lb:
+        while i < la and a[i] not in _ALNUM and a[i] not in '~^':
+            i += 1
+        while j < lb and b[j] not in _ALNUM and b[j] not in '~^':
+            j += 1
+
+        if (i < la and a[i] == '~') or (j < lb and b[j] == '~'):
+            if i >= la or a[i] != '~':
+                return 1
+            if j >= lb or b[j] != '~':
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        if (i < la and a[i] == '^') or (j < lb and b[j] == '^'):
+            if i >= la:
+                return -1
+            if j >= lb:
+                return 1
+            if a[i] != '^':
+                return 1
+            if b[j] != '^':
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        if i >= la or j >= lb:
+            break
+
+        isnum = a[i].isdigit()
+        segment_re = _DIGITS_RE if isnum else _ALPHA_RE
+        m1 = segment_re.match(a, i)
+        m2 = segment_re.match(b, j)
+        if m2 is None:
+            # segments of different types, numbers are newer
+            return 1 if isnum else -1
+        seg1, seg2 = m1.group(), m2.group()
+        i, j = m1.end(), m2.end()
+        if isnum:
+            seg1 = seg1.lstrip('0')
+            seg2 = seg2.lstrip('0')
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+
+    if i >= la and j >= lb:
+        return 0
+    return -1 if i >= la else 1
+
+
+def compare_evr(a, b):
+    """Compare (epoch, version, release) tuples, return -1, 0 or 1.
+    A missing epoch is 0, a missing release matches any release.
+    """
+    e1, e2 = int(a[0] or 0), int(b[0] or 0)
+    if e1 != e2:
+        return 1 if e1 > e2 else -1
+    result = rpmvercmp(a[1] or '', b[1] or '')
+    if result or not a[2] or not b[2]:
+        return result
+    return rpmvercmp(a[2], b[2])
+
+
+# sort key of (epoch, version, release) tuples
+evr_key = functools.cmp_to_key(compare_evr)
+
+
+def ranges_overlap(flags1, evr1, flags2, evr2):
+    """Whether two dependency ranges overlap, e.g. whether a provide
+    (flags1, evr1) satisfies a require (flags2, evr2). Flags are repodata
+    senses (EQ, LT, LE, GT, GE), an unversioned side matches everything.
+    """
+    if not flags1 or not flags2:
+        return True
+    sense = compare_evr(evr1, evr2)
+    if sense < 0:
+        return flags1 in _GREATER or flags2 in _LESS
+    if sense > 0:
+        return flags1 in _LESS or flags2 in _GREATER
+    return (flags1 in _EQUAL and flags2 in _EQUAL) or \
+        (flags1 in _LESS and flags2 in _LESS) or \
+        (flags1 in _GREATER and flags2 in _GREATER)
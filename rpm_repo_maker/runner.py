@@ -0,0 +1,239 @@
+# coding: utf-8
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+from collections import deque
+
+from .config import ENV, ROOT_LOGGER
+from .metrics import METRICS
+
+logger = ROOT_LOGGER.getChild("runner")
+
+# own process group, preexec_fn is not safe with threads on python 3
+if sys.version_info[0] >= 3:
+    NEW_SESSION = {'start_new_session': True}
+else:
+    NEW_SESSION = {'preexec_fn': os.setsid}
+
+# commands started and not waited for yet, see cancel_all
+_LIVE = set()
+_LIVE_LOCK = threading.Lock()
+
+
+class CommandResult(object):
+    """Exit status and the kept output lines of a finished command."""
+
+    def __init__(self, cmd, returncode, stdout, stderr, elapsed, timed_out=False, cancelled=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    @property
+    def reason(self):
+        if self.timed_out:
+            return "timed out after {:.0f}s".format(self.elapsed)
+        if self.cancelled:
+            return "cancelled"
+        return "exit status {}: {}".format(self.returncode, self.stderr)
+
+
+class CommandError(Exception):
+
+    def __init__(self, result):
+        super(CommandError, self).__init__("command failed, {}\n{}".format(result.reason, result.cmd))
+        self.result = result
+
+
+class Command(object):
+    """A shell command whose output is streamed line by line.
+
+    Lines go to the optional handlers as they arrive and only the last
+    `tail` lines of each stream are kept, so chatty package managers do not
+    pile up output in memory. Lines longer than MAX_LINE reach on_stdout in
+    pieces; on_stdout_bytes gets the undecoded output unchanged, for
+    parsers that need it byte exact. The command gets its own process group, a
+    timeout or cancel() stops everything the shell started.
+    """
+
+    TAIL = 200
+    # longer lines are handed over in pieces
+    MAX_LINE = 64 * 1024
+    # seconds between SIGTERM and SIGKILL
+    KILL_GRACE = 5
+
+    def __init__(self, cmd, timeout=None, on_stdout=None, on_stderr=None, tail=None, on_stdout_bytes=None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.on_stdout = on_stdout
+        self.on_stdout_bytes = on_stdout_bytes
+        self.on_stderr = on_stderr
+        self.stdout = deque(maxlen=tail or self.TAIL)
+        self.stderr = deque(maxlen=tail or self.TAIL)
+        self.timed_out = False
+        self.cancelled = False
+        self.started = None
+        self._proc = None
+        self._readers = []
+        self._timers = []
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = time.time()
+        self._proc = subprocess.Popen(self.cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      close_fds=True, **NEW_SESSION)
+        with _LIVE_LOCK:
+            _LIVE.add(self)
+        self._readers = [
+            threading.Thread(target=self._read,
+                             args=(self._proc.stdout, self.stdout, self.on_stdout, self.on_stdout_bytes)),
+            threading.Thread(target=self._read, args=(self._proc.stderr, self.stderr, self.on_stderr)),
+        ]
+        for t in self._readers:
+            t.daemon = True
+            t.start()
+        if self.timeout:
+            self._later(self.timeout, self._expire)
+        return self
+
+    def _later(self, seconds, func):
+        with self._lock:
+            if self._finished:
+                return
+            timer = threading.Timer(seconds, func)
+            timer.daemon = True
+            timer.start()
+            self._timers.append(timer)
+
+    def _read(self, pipe, lines, handler, raw_handler=None):
+        for raw in iter(lambda: pipe.readline(self.MAX_LINE), b''):
+            if raw_handler is not None:
+                try:
+                    raw_handler(raw)
+                except Exception:
+                    logger.exception("output handler of {} failed".format(self.cmd))
+            line = raw.decode('utf-8', 'replace').rstrip('\n')
+            lines.append(line)
+            if ENV == 'dev':
+                logger.debug(line)
+            if handler is not None:
+                try:
+                    handler(line)
+                except Exception:
+                    logger.exception("output handler of {} failed".format(self.cmd))
+        pipe.close()
+
+    def _signal(self, sig):
+        with self._lock:
+            if self._proc.returncode is not None:
+                return
+            try:
+                os.killpg(self._proc.pid, sig)
+            except OSError:
+                pass
+
+    def _terminate(self):
+        self._later(self.KILL_GRACE, lambda: self._signal(signal.SIGKILL))
+        self._signal(signal.SIGTERM)
+
+    def _expire(self):
+        self.timed_out = True
+        logger.warning("command timed out after {}s: {}".format(self.timeout, self.cmd))
+        self._terminate()
+
+    def cancel(self):
+        """Stop the command, wait() still has to be called."""
+        self.cancelled = True
+        self._terminate()
+
+    def done(self):
+        with self._lock:
+            return self._proc.poll() is not None
+
+    def wait(self):
+        returncode = self._proc.wait()
+        for t in self._readers:
+            t.join()
+        with self._lock:
+            self._finished = True
+            for timer in self._timers:
+                timer.cancel()
+        for timer in self._timers:
+            timer.join()
+        with _LIVE_LOCK:
+            _LIVE.discard(self)
+        elapsed = time.time() - self.started
+        METRICS.record_subprocess(self.cmd, elapsed, returncode)
+        return CommandResult(self.cmd, returncode, '\n'.join(self.stdout), '\n'.join(self.stderr), elapsed,
+                             timed_out=self.timed_out, cancelled=self.cancelled)
+
+    def run(self):
+        return self.start().wait()
+
+
+def run_command(cmd, **kwargs):
+    """Run a command to its end, return its CommandResult.
+    Keyword arguments are those of Command.
+    """
+    result = Command(cmd, **kwargs).run()
+    if not result.ok:
+        logger.warning("command failed, {}\n{}".format(result.reason, cmd))
+    return result
+
+
+def check_command(cmd, **kwargs):
+    """Run a command to its end, raise CommandError if it failed."""
+    result = Command(cmd, **kwargs).run()
+    if not result.ok:
+        raise CommandError(result)
+    return result
+
+
+def run_commands(cmds, jobs=4, **kwargs):
+    """Run commands with up to `jobs` at a time, return their results in order.
+    Items are command strings or Command objects. If this is interrupted
+    the running commands are cancelled.
+    """
+    commands = [cmd if isinstance(cmd, Command) else Command(cmd, **kwargs) for cmd in cmds]
+    results = [None] * len(commands)
+    pending = list(enumerate(commands))
+    running = []
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                i, command = pending.pop(0)
+                running.append((i, command.start()))
+            finished = [(i, command) for i, command in running if command.done()]
+            if not finished:
+                time.sleep(0.05)
+                continue
+            for i, command in finished:
+                results[i] = command.wait()
+                running.remove((i, command))
+    except BaseException:
+        for _, command in running:
+            command.cancel()
+        for _, command in running:
+            command.wait()
+        raise
+    return results
+
+
+def cancel_all():
+    """Cancel every command still running, e.g. when the tool is interrupted."""
+    with _LIVE_LOCK:
+        commands = list(_LIVE)
+    for command in commands:
+        command.cancel()
@@ -0,0 +1,216 @@
+# coding: utf-8
+"""Daemon running commands with resolution engines kept loaded.
+
+`rpm-repo-maker serve` listens on a unix socket in the cache directory.
+While it runs, `generate` and `lock` send their arguments to it instead of
+starting cold: the daemon runs them one at a time in its own process and
+streams their output back. Between commands it reloads the sacks whose
+repositories changed, so the next command finds them warm.
+"""
+
+import os
+import sys
+import json
+import errno
+import socket
+import logging
+import threading
+import traceback
+
+from .config import CACHE_DIR, ROOT_LOGGER
+from .exporter.engine import EnginePool
+from .exporter.finder import PackageFinderV2
+from .helper import STRING_TYPES
+
+logger = ROOT_LOGGER.getChild("serve")
+
+SOCKET_PATH = os.path.join(CACHE_DIR, 'serve.sock')
+# commands a running daemon takes over
+COMMANDS = ('generate', 'lock')
+
+
+def _send(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _connect(path):
+    """Connected socket of a serving daemon, None when there is none."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        sock.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+    return sock
+
+
+class _Stream(object):
+    """File-like object forwarding what a command writes to its client."""
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+        self.closed = False
+
+    def write(self, data):
+        if not data or self.closed:
+            return
+        try:
+            _send(self.sock, {'stream': self.name, 'data': data})
+        except socket.error:
+            # client went away, let the command finish anyway
+            self.closed = True
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class Server(object):
+    """Serve commands on a unix socket, one at a time.
+
+    execute(argv) runs a command line in this process. The engine pool is
+    installed for the finders, engines loaded by one command stay loaded
+    for the next, and a background thread refreshes them every
+    refresh_interval seconds while no command runs.
+    """
+
+    def __init__(self, execute, path=SOCKET_PATH, refresh_interval=300):
+        self.execute = execute
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.pool = EnginePool()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def _bind(self):
+        if os.path.exists(self.path):
+            sock = _connect(self.path)
+            if sock is not None:
+                sock.close()
+                raise ValueError("already serving on {}".format(self.path))
+            # left over by a daemon that was killed
+            os.remove(self.path)
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        sock.listen(16)
+        return sock
+
+    def _refresh_loop(self):
+        while not self.stopped.wait(self.refresh_interval):
+            with self.lock:
+                self.pool.refresh()
+
+    def _run(self, request, sock):
+        """Run a command with its output sent to the client, return its exit status."""
+        stdout, stderr = _Stream(sock, 'stdout'), _Stream(sock, 'stderr')
+        handlers = [handler for handler in ROOT_LOGGER.handlers if isinstance(handler, logging.StreamHandler)]
+        saved = (sys.stdout, sys.stderr, [handler.stream for handler in handlers], os.getcwd())
+        sys.stdout, sys.stderr = stdout, stderr
+        for handler in handlers:
+            handler.stream = stderr
+        try:
+            os.chdir(request['cwd'])
+            self.execute(request['argv'])
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            stderr.write('{}\n'.format(e.code))
+            return 1
+        except Exception:
+            traceback.print_exc(file=stderr)
+            return 1
+        finally:
+            sys.stdout, sys.stderr = saved[0], saved[1]
+            for handler, stream in zip(handlers, saved[2]):
+                handler.stream = stream
+            os.chdir(saved[3])
+
+    @staticmethod
+    def _read_request(sock):
+        line = sock.makefile('rb').readline()
+        if not line:
+            return None
+        request = json.loads(line.decode('utf-8'))
+        if not isinstance(request, dict) or not isinstance(request.get('argv'), list) \
+                or not isinstance(request.get('cwd'), STRING_TYPES):
+            raise ValueError("expect {\"argv\": [...], \"cwd\": \"...\"}")
+        return request
+
+    def _handle(self, sock):
+        request = self._read_request(sock)
+        if request is None:
+            return
+        logger.info("running {}".format(" ".join(request['argv'])))
+        with self.lock:
+            status = self._run(request, sock)
+        logger.info("finished with status {}".format(status))
+        try:
+            _send(sock, {'status': status})
+        except socket.error:
+            pass
+
+    def serve(self):
+        listener = self._bind()
+        PackageFinderV2.ENGINE_POOL = self.pool
+        refresher = threading.Thread(target=self._refresh_loop, name='refresh')
+        refresher.daemon = True
+        refresher.start()
+        logger.info("serving on {}".format(self.path))
+        try:
+            while True:
+                sock, _ = listener.accept()
+                try:
+                    self._handle(sock)
+                except Exception as e:
+                    # a bad request or a broken client must not stop the daemon
+                    logger.warning("bad request: {}".format(e))
+                    try:
+                        _send(sock, {'status': 1, 'error': str(e)})
+                    except socket.error:
+                        pass
+                finally:
+                    sock.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            listener.close()
+            os.remove(self.path)
+            PackageFinderV2.ENGINE_POOL = None
+            self.pool.close()
+
+
+def submit(argv, cwd, path=SOCKET_PATH):
+    """Run a command line in a serving daemon and return its exit status,
+    None when no daemon is serving.
+    """
+    if not os.path.exists(path):
+        return None
+    sock = _connect(path)
+    if sock is None:
+        return None
+    try:
+        _send(sock, {'argv': argv, 'cwd': cwd})
+        for line in sock.makefile('rb'):
+            message = json.loads(line.decode('utf-8'))
+            if 'error' in message:
+                sys.stderr.write('serve daemon: {}\n'.format(message['error']))
+            if 'status' in message:
+                return message['status']
+            stream = sys.stdout if message['stream'] == 'stdout' else sys.stderr
+            stream.write(message['data'])
+            stream.flush()
+    finally:
+        sock.close()
+    sys.stderr.write('serve daemon closed the connection\n')
+    return 1
@@ -0,0 +1,125 @@
+# coding: utf-8
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from rpm_repo_maker.archive import (
+    IndexedArchive, IndexedArchiveWriter, FOOTER_SIZE, INDEX_FILE, extract_archive, list_archive,
+)
+
+MEMBERS = {
+    'repo/Packages/a-1.0-1.x86_64.rpm': os.urandom(70 * 1024),
+    'repo/Packages/b-2.0-1.noarch.rpm': b'b' * 300000,
+    'repo/repodata/repomd.xml': b'<repomd/>\n',
+    'repo/empty': b'',
+}
+
+
+class IndexedArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        source = os.path.join(self.tempdir, 'source')
+        for name, data in MEMBERS.items():
+            path = os.path.join(source, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+        os.symlink('repodata/repomd.xml', os.path.join(source, 'repo', 'link'))
+        self.path = os.path.join(self.tempdir, 'bundle.tar.gz')
+        with IndexedArchiveWriter(self.path, jobs=2) as writer:
+            writer.add(os.path.join(source, 'repo'), 'repo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_index(self):
+        self.assertTrue(IndexedArchive.is_indexed(self.path))
+        archive = IndexedArchive(self.path)
+        self.assertEqual(archive.index['version'], 1)
+        entries = dict((entry['name'], entry) for entry in archive.members)
+        for name, data in MEMBERS.items():
+            self.assertEqual(entries[name]['type'], 'file')
+            self.assertEqual(entries[name]['size'], len(data))
+        self.assertEqual(entries['repo']['type'], 'dir')
+        self.assertEqual(entries['repo/link']['linkname'], 'repodata/repomd.xml')
+        # compressed ranges follow each other up to the index
+        offsets = [entry['offset'] for entry in archive.members]
+        self.assertEqual(offsets, sorted(offsets))
+        self.assertEqual(sorted(name for name, _ in list_archive(self.path)), sorted(entries))
+
+    def test_selective_extract(self):
+        archive = IndexedArchive(self.path)
+        wanted = [entry for entry in archive.members if entry['name'].endswith('b-2.0-1.noarch.rpm')]
+        dest = os.path.join(self.tempdir, 'dest')
+        self.assertEqual(archive.extract(dest, wanted), 300000)
+        self.assertEqual(self.read(os.path.join(dest, 'repo/Packages/b-2.0-1.noarch.rpm')), MEMBERS[
+            'repo/Packages/b-2.0-1.noarch.rpm'])
+        self.assertFalse(os.path.exists(os.path.join(dest, 'repo/Packages/a-1.0-1.x86_64.rpm')))
+
+    def test_extract_all(self):
+        dest = os.path.join(self.tempdir, 'dest')
+        IndexedArchive(self.path).extract(dest)
+        for name, data in MEMBERS.items():
+            self.assertEqual(self.read(os.path.join(dest, name)), data)
+        self.assertEqual(os.readlink(os.path.join(dest, 'repo/link')), 'repodata/repomd.xml')
+
+    def test_plain_tar_gz(self):
+        # the index and footer do not bother ordinary readers
+        with tarfile.open(self.path) as tar:
+            names = tar.getnames()
+        self.assertEqual(names[-1], INDEX_FILE)
+        dest = os.path.join(self.tempdir, 'dest')
+        extract_archive(self.path, dest)
+        for name, data in MEMBERS.items():
+            self.assertEqual(self.read(os.path.join(dest, name)), data)
+
+    def corrupt(self, offset, data):
+        with open(self.path, 'r+b') as f:
+            f.seek(offset, os.SEEK_END)
+            f.write(data)
+
+    def test_truncated(self):
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 10)
+        self.assertFalse(IndexedArchive.is_indexed(self.path))
+        self.assertRaises(ValueError, IndexedArchive, self.path)
+
+    def test_truncated_before_footer(self):
+        data = self.read(self.path)
+        # the index location points past the end of what is left
+        with open(self.path, 'wb') as f:
+            f.write(data[:len(data) // 2] + data[-FOOTER_SIZE:])
+        self.assertRaises(ValueError, IndexedArchive, self.path)
+
+    def test_corrupt_footer(self):
+        self.corrupt(-FOOTER_SIZE + 12, b'XX')
+        self.assertRaises(ValueError, IndexedArchive, self.path)
+
+    def test_corrupt_location(self):
+        self.corrupt(-FOOTER_SIZE + 16, b'zz')
+        self.assertRaises(ValueError, IndexedArchive, self.path)
+
+    def test_corrupt_index(self):
+        with open(self.path, 'rb') as f:
+            offset, _ = IndexedArchive._read_footer(f)
+        with open(self.path, 'r+b') as f:
+            f.seek(offset + 20)
+            f.write(b'\x00' * 32)
+        self.assertRaises(ValueError, IndexedArchive, self.path)
+
+    def test_gzip_only(self):
+        self.assertRaises(ValueError, IndexedArchiveWriter, self.path + '.xz', compression='xz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# coding: utf-8
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from rpm_repo_maker.exporter.cache import PackageCache, ResolveCache
+from rpm_repo_maker.exporter.finder import PackageSpec
+from rpm_repo_maker.helper import file_checksum
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import synthrepo  # noqa: E402
+
+PAYLOAD = 10000
+
+
+def _store(root, downloaddir):
+    PackageCache(root, 10 * 1024 * 1024).store(downloaddir)
+
+
+class PackageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.root = self.path('cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *parts):
+        return os.path.join(self.tempdir, *parts)
+
+    def write(self, directory, name, version='1.0'):
+        """Write a package into directory, return its spec."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filename = '{}-{}-1.{}.rpm'.format(name, version, synthrepo.ARCH)
+        path = os.path.join(directory, filename)
+        synthrepo.write_rpm(path, name, version, '1', payload=PAYLOAD)
+        return PackageSpec(name, version, nevra='{}-0:{}-1.{}'.format(name, version, synthrepo.ARCH),
+                           filename=filename, checksum_type='sha256', checksum=file_checksum(path))
+
+    def copy(self, spec, src, dst):
+        if not os.path.isdir(dst):
+            os.makedirs(dst)
+        shutil.copy(os.path.join(src, spec.filename), dst)
+
+    def index(self):
+        with open(os.path.join(self.root, PackageCache.INDEX_FILE)) as f:
+            return json.load(f)
+
+    def test_store_and_fetch(self):
+        spec = self.write(self.path('run1'), 'a')
+        PackageCache(self.root, 1024 * 1024).store(self.path('run1'))
+        cache = PackageCache(self.root, 1024 * 1024)
+        dest = self.path('run2')
+        os.makedirs(dest)
+        other = PackageSpec('b', '1.0', nevra='b-0:1.0-1.x86_64', filename='b-1.0-1.x86_64.rpm',
+                            checksum_type='sha256', checksum='0' * 64)
+        self.assertEqual(cache.fetch([spec, other, PackageSpec('c')], dest), [spec])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(file_checksum(os.path.join(dest, spec.filename)), spec.checksum)
+        # a rebuild with another checksum is another object
+        changed = PackageSpec(spec.name, spec.version, nevra=spec.nevra, filename=spec.filename,
+                              checksum_type='sha256', checksum='1' * 64)
+        self.assertEqual(cache.fetch([changed], self.path('run2')), [])
+
+    def test_eviction(self):
+        size = None
+        specs = []
+        for name in ('a', 'b', 'c'):
+            specs.append(self.write(self.path('run-' + name), name))
+            size = os.path.getsize(self.path('run-' + name, specs[-1].filename))
+        cache = PackageCache(self.root, 2 * size)
+        cache.store(self.path('run-a'))
+        time.sleep(0.01)
+        cache.store(self.path('run-b'))
+        time.sleep(0.01)
+        # a is used again, b becomes the least recently used
+        self.assertEqual(len(cache.fetch([specs[0]], self.path('run-b'))), 1)
+        time.sleep(0.01)
+        cache.store(self.path('run-c'))
+        index = self.index()
+        self.assertEqual(sorted(entry['nevra'] for entry in index.values()), [specs[0].nevra, specs[2].nevra])
+        self.assertTrue(sum(entry['size'] for entry in index.values()) <= 2 * size)
+        objects = [fn for _, _, files in os.walk(os.path.join(self.root, 'objects')) for fn in files]
+        self.assertEqual(len(objects), 2)
+
+    def test_concurrent_writers(self):
+        spec = self.write(self.path('src'), 'a')
+        others = [self.write(self.path('src'), name) for name in ('b', 'c', 'd')]
+        dirs = []
+        for i, other in enumerate(others):
+            # every writer stores the same package plus one of its own
+            dirs.append(self.path('run{}'.format(i)))
+            self.copy(spec, self.path('src'), dirs[-1])
+            self.copy(other, self.path('src'), dirs[-1])
+        procs = [multiprocessing.Process(target=_store, args=(self.root, d)) for d in dirs]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            self.assertEqual(proc.exitcode, 0)
+        index = self.index()
+        self.assertEqual(sorted(entry['nevra'] for entry in index.values()),
+                         sorted(s.nevra for s in [spec] + others))
+        for entry in index.values():
+            self.assertEqual(os.path.getsize(os.path.join(self.root, entry['file'])), entry['size'])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'tmp')), [])
+
+    def test_corrupt_entries(self):
+        specs = [self.write(self.path('run1'), name) for name in ('a', 'b')]
+        PackageCache(self.root, 1024 * 1024).store(self.path('run1'))
+        index = self.index()
+        objects = dict((entry['nevra'], os.path.join(self.root, entry['file'])) for entry in index.values())
+        # one object truncated, the other removed behind the cache's back
+        with open(objects[specs[0].nevra], 'r+b') as f:
+            f.truncate(100)
+        os.remove(objects[specs[1].nevra])
+        cache = PackageCache(self.root, 1024 * 1024)
+        os.makedirs(self.path('run2'))
+        self.assertEqual(cache.fetch(specs, self.path('run2')), [])
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(self.index(), {})
+        self.assertFalse(os.path.exists(objects[specs[0].nevra]))
+        self.assertEqual(os.listdir(self.path('run2')), [])
+
+    def test_broken_index(self):
+        spec = self.write(self.path('run1'), 'a')
+        PackageCache(self.root, 1024 * 1024).store(self.path('run1'))
+        with open(os.path.join(self.root, PackageCache.INDEX_FILE), 'w') as f:
+            f.write('{"torn')
+        cache = PackageCache(self.root, 1024 * 1024)
+        os.makedirs(self.path('run2'))
+        self.assertEqual(cache.fetch([spec], self.path('run2')), [])
+        # storing again repairs it
+        cache.store(self.path('run1'))
+        self.assertEqual(len(self.index()), 1)
+
+
+class ResolveCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def entry(self, key):
+        return os.path.join(self.tempdir, '{}.json'.format(key))
+
+    def test_key(self):
+        key = ResolveCache.make_key('Finder', ['a', 'b>=1'], {'base': 'abc'})
+        self.assertEqual(key, ResolveCache.make_key('Finder', ['a', 'b>=1'], {'base': 'abc'}))
+        self.assertNotEqual(key, ResolveCache.make_key('Finder/empty-root', ['a', 'b>=1'], {'base': 'abc'}))
+        self.assertNotEqual(key, ResolveCache.make_key('Finder', ['a'], {'base': 'abc'}))
+        self.assertNotEqual(key, ResolveCache.make_key('Finder', ['a', 'b>=1'], {'base': 'abd'}))
+
+    def test_get_put(self):
+        cache = ResolveCache(self.tempdir)
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', [{'name': 'a'}])
+        self.assertEqual(cache.get('k'), [{'name': 'a'}])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with open(self.entry('torn'), 'w') as f:
+            f.write('[{"na')
+        self.assertIsNone(cache.get('torn'))
+
+    def test_expiry(self):
+        cache = ResolveCache(self.tempdir)
+        for key in ('old', 'used', 'new'):
+            cache.put(key, [])
+        expired = time.time() - ResolveCache.MAX_AGE - 60
+        for key in ('old', 'used'):
+            os.utime(self.entry(key), (expired, expired))
+        # a hit keeps the entry alive
+        self.assertEqual(cache.get('used'), [])
+        ResolveCache(self.tempdir)
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ['new.json', 'used.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# coding: utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from rpm_repo_maker.archive import list_archive
+from rpm_repo_maker.exporter.base import RPMRepoExporter
+from rpm_repo_maker.exporter.repoindex import RepoSource
+from rpm_repo_maker.importer.base import RPMRepoImporter
+from rpm_repo_maker.manifest import BundleManifest, MANIFEST_FILE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import synthrepo  # noqa: E402
+
+NAME = 'test-offline'
+
+
+class _Exporter(RPMRepoExporter):
+    """Exporter taking its packages from a local directory."""
+
+    def __init__(self, source, *args, **kwargs):
+        super(_Exporter, self).__init__(*args, **kwargs)
+        self.source = source
+
+    def download(self, downloaddir, pkg_list):
+        if not os.path.isdir(downloaddir):
+            os.makedirs(downloaddir)
+        for fn in pkg_list:
+            shutil.copy(os.path.join(self.source, fn), downloaddir)
+
+
+class DeltaBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.source = self.path('source')
+        os.makedirs(self.source)
+        for name, version in (('a', '1.0'), ('b', '1.0'), ('b', '2.0'), ('c', '1.0'), ('d', '1.0')):
+            synthrepo.write_rpm(os.path.join(self.source, self.rpm(name, version)), name, version, '1',
+                                payload=2048)
+        self.imported = self.path('imported')
+        os.makedirs(self.imported)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, *parts):
+        return os.path.join(self.tempdir, *parts)
+
+    @staticmethod
+    def rpm(name, version):
+        return '{}-{}-1.{}.rpm'.format(name, version, synthrepo.ARCH)
+
+    def export(self, out, packages, base=None):
+        os.makedirs(self.path(out))
+        _Exporter(self.source, NAME, self.path(out), repodata='builtin', base=base)(
+            [self.rpm(name, version) for name, version in packages])
+        return self.path(out, NAME + ('.delta' if base else '') + '.tar.gz')
+
+    def import_(self, bundle):
+        importer = RPMRepoImporter(NAME, bundle)
+        importer.REPO_PATH = self.path('repos.d')
+        if not os.path.isdir(importer.REPO_PATH):
+            os.makedirs(importer.REPO_PATH)
+        importer.repo = self.imported
+        importer.desc_name, importer.file_name = NAME, importer.get_file_name()
+        importer.make()
+
+    def rpms(self):
+        return sorted(fn for fn in os.listdir(self.path('imported', NAME)) if fn.endswith('.rpm'))
+
+    def test_delta(self):
+        base = self.export('v1', [('a', '1.0'), ('b', '1.0'), ('c', '1.0')])
+        delta = self.export('v2', [('a', '1.0'), ('b', '2.0'), ('d', '1.0')], base=base)
+
+        manifest = BundleManifest.load(delta)
+        self.assertEqual(manifest.base, BundleManifest.load(base).id)
+        self.assertEqual(manifest.removed, [self.rpm('b', '1.0'), self.rpm('c', '1.0')])
+        self.assertEqual(sorted(manifest.packages), [self.rpm('a', '1.0'), self.rpm('b', '2.0'), self.rpm('d', '1.0')])
+        # only new and changed packages travel, with the complete repodata
+        members = [name for name, _ in list_archive(delta)]
+        self.assertEqual(sorted(name for name in members if name.endswith('.rpm')),
+                         ['{}/{}'.format(NAME, self.rpm('b', '2.0')), '{}/{}'.format(NAME, self.rpm('d', '1.0'))])
+        self.assertEqual(members[0], '{}/{}'.format(NAME, MANIFEST_FILE))
+
+        self.import_(base)
+        self.assertEqual(self.rpms(), [self.rpm('a', '1.0'), self.rpm('b', '1.0'), self.rpm('c', '1.0')])
+        self.import_(delta)
+        self.assertEqual(self.rpms(), sorted(manifest.packages))
+        current = BundleManifest.load(self.path('imported', NAME, MANIFEST_FILE))
+        self.assertEqual(current.id, manifest.id)
+        self.assertEqual(current.id, BundleManifest.from_dir(NAME, self.path('imported', NAME)).id)
+
+        # the repodata describes the merged repository
+        packages = RepoSource(NAME, [self.path('imported', NAME)], self.path('cache')).packages(
+            (synthrepo.ARCH, 'noarch'))
+        self.assertEqual(sorted(pkg.location for pkg in packages), sorted(manifest.packages))
+
+    def test_delta_needs_its_base(self):
+        base = self.export('v1', [('a', '1.0'), ('b', '1.0')])
+        other = self.export('v0', [('a', '1.0')])
+        delta = self.export('v2', [('a', '1.0'), ('d', '1.0')], base=base)
+        # nothing imported yet
+        self.assertRaises(ValueError, self.import_, delta)
+        self.import_(other)
+        self.assertRaises(ValueError, self.import_, delta)
+        self.assertEqual(self.rpms(), [self.rpm('a', '1.0')])
+
+    def test_unchanged(self):
+        base = self.export('v1', [('a', '1.0')])
+        delta = self.export('v2', [('a', '1.0')], base=base)
+        manifest = BundleManifest.load(delta)
+        self.assertEqual(manifest.removed, [])
+        self.assertFalse([name for name, _ in list_archive(delta) if name.endswith('.rpm')])
+        self.import_(base)
+        self.import_(delta)
+        self.assertEqual(self.rpms(), [self.rpm('a', '1.0')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding: utf-8
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+from rpm_repo_maker.exporter.pm_dnf import DnfRepoExporter
+
+# dnf without dnf-plugins-core has no download command
+DNF = '''#!/bin/sh
+if [ "$1" = download ]; then
+    [ -e "$(dirname "$0")/plugins" ] && exit 0
+    echo "No such command: download." >&2
+    exit 1
+fi
+exit 0
+'''
+
+
+class PrepareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.bindir = os.path.join(self.tempdir, 'bin')
+        os.makedirs(self.bindir)
+        dnf = os.path.join(self.bindir, 'dnf')
+        with open(dnf, 'w') as f:
+            f.write(DNF)
+        os.chmod(dnf, os.stat(dnf).st_mode | stat.S_IXUSR)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.bindir + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tempdir)
+
+    def prepare(self, exact):
+        DnfRepoExporter('test', self.tempdir, exact=exact).prepare()
+
+    def test_dnf_download_plugin(self):
+        self.prepare(exact=False)
+        with self.assertRaises(ValueError) as cm:
+            self.prepare(exact=True)
+        self.assertIn('dnf download', str(cm.exception))
+        open(os.path.join(self.bindir, 'plugins'), 'w').close()
+        self.prepare(exact=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# coding: utf-8
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from rpm_repo_maker.exporter.fetcher import HttpFetcher, FetchError
+from rpm_repo_maker.exporter.mirrors import MirrorPool, MirrorStats
+
+CONTENT = os.urandom(300 * 1024)
+CHECKSUM = hashlib.sha256(CONTENT).hexdigest()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('Range')))
+            failure = server.failures.pop(0) if server.failures else None
+        if failure == 'drop':
+            # announce everything, send half of it and hang up
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT[:len(CONTENT) // 2])
+            self.close_connection = True
+            return
+        if failure is not None:
+            self.send_error(failure)
+            return
+        if self.path != '/repo/Packages/pkg.rpm':
+            self.send_error(404)
+            return
+        start, end, status = 0, len(CONTENT) - 1, 200
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:end + 1])
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, failures=()):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.lock = threading.Lock()
+        # statuses (or 'drop') answered to the next requests, in order
+        self.failures = list(failures)
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/repo/'.format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class HttpFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.dest = os.path.join(self.tempdir, 'pkg.rpm')
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def server(self, failures=()):
+        server = _Server(failures)
+        self.servers.append(server)
+        return server
+
+    def fetcher(self, **kwargs):
+        kwargs.setdefault('timeout', 10)
+        return HttpFetcher(**kwargs)
+
+    def assertFetched(self):
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+
+    def test_fetch(self):
+        server = self.server()
+        fetcher = self.fetcher()
+        fetcher.fetch(server.url + 'Packages/pkg.rpm', self.dest, 'sha256', CHECKSUM)
+        self.assertFetched()
+        self.assertEqual(fetcher.downloaded, len(CONTENT))
+
+    def test_retry(self):
+        server = self.server(failures=[503, 500])
+        self.fetcher(retries=2).fetch(server.url + 'Packages/pkg.rpm', self.dest, 'sha256', CHECKSUM)
+        self.assertFetched()
+        self.assertEqual(len(server.requests), 3)
+
+    def test_retries_exhausted(self):
+        server = self.server(failures=[503, 503, 503])
+        self.assertRaises(FetchError, self.fetcher(retries=1).fetch,
+                          server.url + 'Packages/pkg.rpm', self.dest, 'sha256', CHECKSUM)
+        self.assertEqual(len(server.requests), 2)
+
+    def test_permanent_failure_not_retried(self):
+        server = self.server()
+        self.assertRaises(FetchError, self.fetcher(retries=3).fetch,
+                          server.url + 'Packages/missing.rpm', self.dest, 'sha256', CHECKSUM)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_range_resume(self):
+        server = self.server()
+        offset = len(CONTENT) // 3
+        with open(self.dest + '.part', 'wb') as f:
+            f.write(CONTENT[:offset])
+        fetcher = self.fetcher()
+        fetcher.fetch(server.url + 'Packages/pkg.rpm', self.dest, 'sha256', CHECKSUM)
+        self.assertFetched()
+        self.assertEqual(server.requests, [('/repo/Packages/pkg.rpm', 'bytes={}-'.format(offset))])
+        self.assertEqual(fetcher.resumed, 1)
+        self.assertEqual(fetcher.downloaded, len(CONTENT) - offset)
+
+    def test_interrupted_transfer(self):
+        server = self.server(failures=['drop'])
+        self.fetcher(retries=2).fetch(server.url + 'Packages/pkg.rpm', self.dest, 'sha256', CHECKSUM)
+        self.assertFetched()
+        self.assertEqual(len(server.requests), 2)
+
+    def test_checksum_mismatch(self):
+        server = self.server()
+        self.assertRaises(FetchError, self.fetcher(retries=0).fetch,
+                          server.url + 'Packages/pkg.rpm', self.dest, 'sha256', '0' * 64)
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+
+    def test_mirror_failover(self):
+        broken, good = self.server(failures=[500] * 10), self.server()
+        stats = MirrorStats(None)
+        pool = MirrorPool('repo', [broken.url, good.url], stats)
+        # the broken mirror is tried first
+        self.assertEqual(pool.ranked()[0], broken.url)
+        self.fetcher(stats=stats).fetch_mirrored(pool, 'Packages/pkg.rpm', self.dest, len(CONTENT),
+                                                 'sha256', CHECKSUM)
+        self.assertFetched()
+        self.assertEqual(len(broken.requests), 1)
+        self.assertEqual(len(good.requests), 1)
+        self.assertEqual(stats.get(broken.url, 'failures'), 1)
+        self.assertIsNotNone(stats.get(good.url, 'throughput'))
+
+    def test_all_mirrors_fail(self):
+        first, second = self.server(failures=[500] * 10), self.server(failures=[500] * 10)
+        pool = MirrorPool('repo', [first.url, second.url], MirrorStats(None))
+        self.assertRaises(FetchError, self.fetcher().fetch_mirrored, pool, 'Packages/pkg.rpm', self.dest,
+                          len(CONTENT), 'sha256', CHECKSUM)
+
+    def test_segmented(self):
+        first, second = self.server(), self.server()
+        pool = MirrorPool('repo', [first.url, second.url], MirrorStats(None))
+        fetcher = self.fetcher()
+        fetcher.SEGMENT_SIZE = 64 * 1024
+        fetcher.fetch_mirrored(pool, 'Packages/pkg.rpm', self.dest, len(CONTENT), 'sha256', CHECKSUM)
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertTrue(first.requests and second.requests)
+        self.assertTrue(all(rng is not None for _, rng in first.requests + second.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+import unittest
+
+from rpm_repo_maker.exporter.finder import PackageFinderV2, PackageSpec
+from rpm_repo_maker.exporter.repoindex import Package
+
+
+def package(name, version, release, arch='x86_64'):
+    return Package(name, '0', version, release, arch, 'sha256', '{}-{}-{}'.format(version, release, arch), 0,
+                   None, None, 'test')
+
+
+class PackageSpecTest(unittest.TestCase):
+
+    def test_pinned_spec_is_the_build(self):
+        spec = PackageSpec.from_package(package('kern', '4.18.0', '513.el8'), pinned=True)
+        self.assertEqual(spec.spec, 'kern-4.18.0-513.el8.x86_64')
+        self.assertEqual(spec.nevra, 'kern-0:4.18.0-513.el8.x86_64')
+        self.assertEqual(str(PackageSpec.from_package(package('kern', '4.18.0', '513.el8'))), 'kern')
+
+    def test_releases_and_arches_kept_apart(self):
+        specs = set(PackageSpec.from_package(pkg, pinned=True) for pkg in [
+            package('kern', '4.18.0', '477.el8'),
+            package('kern', '4.18.0', '513.el8'),
+            package('kern', '4.18.0', '513.el8', arch='noarch'),
+            package('kern', '4.18.0', '513.el8'),
+        ])
+        self.assertEqual([spec.spec for spec in sorted(specs)], [
+            'kern-4.18.0-477.el8.x86_64',
+            'kern-4.18.0-513.el8.noarch',
+            'kern-4.18.0-513.el8.x86_64',
+        ])
+
+    def test_round_trip(self):
+        spec = PackageSpec.from_package(package('kern', '4.18.0', '513.el8'), pinned=True, repoid='base', size=10)
+        again = PackageSpec.from_dict(spec.to_dict())
+        self.assertEqual(again, spec)
+        self.assertEqual(hash(again), hash(spec))
+        self.assertEqual(again.repoid, 'base')
+
+    def test_unresolved_spec(self):
+        self.assertEqual(PackageSpec('kern', version='4.18.0').spec, 'kern-4.18.0')
+        self.assertNotEqual(PackageSpec('kern', version='4.18.0'), PackageSpec('kern'))
+
+
+class ParsePkgListTest(unittest.TestCase):
+
+    def test_nested_items(self):
+        items = PackageFinderV2._parse_pkg_list(['a', u'b', {'name': 'c', 'version': '1.0'}, ('d', ['e'])])
+        self.assertEqual(items, [{'name': 'a'}, {'name': u'b'}, {'name': 'c', 'version': '1.0'},
+                                 {'name': 'd'}, {'name': 'e'}])
+
+    def test_unknown_type(self):
+        self.assertRaises(ValueError, PackageFinderV2._parse_pkg_list, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rpm_repo_maker.exporter.base import RPMRepoExporter
+from rpm_repo_maker.exporter.finder import PackageSpec
+from rpm_repo_maker.exporter.journal import RunJournal
+
+
+class RunJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_reload(self):
+        journal = RunJournal(self.tempdir)
+        journal.mark('resolve', packages=[{'name': 'a'}])
+        journal.mark('download', file='a-1-1.x86_64.rpm', size=10, sha256='00')
+        journal.mark('downloaded')
+        again = RunJournal(self.tempdir)
+        self.assertTrue(again.done('downloaded'))
+        self.assertFalse(again.done('archive'))
+        self.assertEqual(again.get('resolve')['packages'], [{'name': 'a'}])
+        self.assertEqual(again.downloads(), {'a-1-1.x86_64.rpm': (10, '00')})
+
+    def test_torn_last_line(self):
+        journal = RunJournal(self.tempdir)
+        journal.mark('resolve', packages=[])
+        with open(journal.path, 'a') as f:
+            f.write('{"phase": "downl')
+        again = RunJournal(self.tempdir)
+        self.assertEqual([event['phase'] for event in again.events], ['resolve'])
+
+
+class WorkdirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.workdir = os.path.join(self.tempdir, 'runs', 'bundle')
+        self.exporters = []
+
+    def tearDown(self):
+        for exporter in self.exporters:
+            exporter.release()
+        shutil.rmtree(self.tempdir)
+
+    def exporter(self, **kwargs):
+        exporter = RPMRepoExporter('bundle', self.tempdir, **kwargs)
+        self.exporters.append(exporter)
+        return exporter
+
+    def test_temporary_by_default(self):
+        first, second = self.exporter(), self.exporter()
+        self.assertIsNone(first.journal)
+        self.assertNotEqual(first.tempdir, second.tempdir)
+        first.cleanup()
+        second.cleanup()
+
+    def test_resume(self):
+        spec = PackageSpec('a', version='1.0', nevra='a-0:1.0-1.x86_64', filename='a-1.0-1.x86_64.rpm')
+        exporter = self.exporter(workdir=self.workdir)
+        self.assertIsNone(exporter.resolved())
+        exporter.record_resolved([spec])
+        exporter.release()
+        self.assertEqual(self.exporter(workdir=self.workdir, resume=True).resolved(), [spec])
+
+    def test_fresh_run_starts_over(self):
+        exporter = self.exporter(workdir=self.workdir)
+        exporter.record_resolved([PackageSpec('a')])
+        exporter.release()
+        self.assertIsNone(self.exporter(workdir=self.workdir).resolved())
+
+    def test_concurrent_runs(self):
+        exporter = self.exporter(workdir=self.workdir)
+        exporter.record_resolved([PackageSpec('a')])
+        self.assertRaises(ValueError, self.exporter, workdir=self.workdir)
+        self.assertRaises(ValueError, self.exporter, workdir=self.workdir, resume=True)
+        # the running one keeps its work
+        self.assertTrue(exporter.journal.done('resolve'))
+        self.assertTrue(os.path.isfile(exporter.journal.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+# coding: utf-8
+
+import os
+import sys
+import bz2
+import gzip
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from rpm_repo_maker import rpmheader as rh
+from rpm_repo_maker.repodata import RepodataGenerator, NS_COMMON, NS_REPO, NS_RPM, DB_VERSION
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import synthrepo  # noqa: E402
+
+_COMMON = '{%s}' % NS_COMMON
+_REPO = '{%s}' % NS_REPO
+_RPM = '{%s}' % NS_RPM
+
+GE = rh.RPMSENSE_GREATER | rh.RPMSENSE_EQUAL
+LT = rh.RPMSENSE_LESS
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class RepodataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        synthrepo.write_rpm(
+            os.path.join(self.repo, 'app-1.0-1.x86_64.rpm'), 'app', '1.0', '1', epoch=3,
+            requires=[('lib', GE, '1.0-2'), ('old', LT, '2:3.0'), '/bin/sh', ('setup', rh.RPMSENSE_SCRIPT_PRE, ''),
+                      ('rpmlib(CompressedFileNames)', rh.RPMSENSE_LESS | rh.RPMSENSE_EQUAL, '3.0.4-1'),
+                      ('lib', GE, '1.0-2')],
+            provides=[('webapp', 0, '')],
+            files=['/usr/bin/app', '/usr/share/app/data'], payload=1000)
+        synthrepo.write_rpm(os.path.join(self.repo, 'lib-1.0-2.noarch.rpm'), 'lib', '1.0', '2', arch='noarch',
+                            files=['/usr/lib/lib.so'])
+        RepodataGenerator(jobs=2).generate(self.repo)
+        self.repomd = ElementTree.parse(os.path.join(self.repo, 'repodata', 'repomd.xml')).getroot()
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def records(self):
+        records = {}
+        for data in self.repomd.findall(_REPO + 'data'):
+            records[data.get('type')] = dict(
+                path=os.path.join(self.repo, data.find(_REPO + 'location').get('href')),
+                checksum=data.findtext(_REPO + 'checksum'),
+                open_checksum=data.findtext(_REPO + 'open-checksum'),
+                size=int(data.findtext(_REPO + 'size')),
+                open_size=int(data.findtext(_REPO + 'open-size')),
+                database_version=data.findtext(_REPO + 'database_version'))
+        return records
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def uncompressed(self, path):
+        if path.endswith('.gz'):
+            with gzip.open(path, 'rb') as f:
+                return f.read()
+        return bz2.decompress(self.read(path))
+
+    def primary(self):
+        root = ElementTree.fromstring(self.uncompressed(self.records()['primary']['path']))
+        return dict((pkg.findtext(_COMMON + 'name'), pkg) for pkg in root.findall(_COMMON + 'package'))
+
+    def db(self, typ):
+        path = os.path.join(self.repo, 'db-{}.sqlite'.format(typ))
+        with open(path, 'wb') as f:
+            f.write(self.uncompressed(self.records()[typ + '_db']['path']))
+        conn = sqlite3.connect(path)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_read_header(self):
+        hdr = rh.read_header(os.path.join(self.repo, 'app-1.0-1.x86_64.rpm'))
+        self.assertEqual((hdr.name, hdr.epoch, hdr.version, hdr.release, hdr.arch), ('app', 3, '1.0', '1', 'x86_64'))
+        self.assertEqual(hdr.nevra, 'app-3:1.0-1.x86_64')
+        self.assertEqual([fn for fn, _, _ in hdr.files()], ['/usr/bin/app', '/usr/share/app/data'])
+        requires = hdr.dependencies(rh.RPMTAG_REQUIRENAME, rh.RPMTAG_REQUIREFLAGS, rh.RPMTAG_REQUIREVERSION)
+        self.assertEqual(requires[0], ('lib', GE, '1.0-2'))
+        self.assertEqual(requires[2], ('/bin/sh', 0, ''))
+        provides = hdr.dependencies(rh.RPMTAG_PROVIDENAME, rh.RPMTAG_PROVIDEFLAGS, rh.RPMTAG_PROVIDEVERSION)
+        self.assertEqual(provides, [('app', rh.RPMSENSE_EQUAL, '3:1.0-1'), ('webapp', 0, '')])
+        self.assertTrue(0 < hdr.start < hdr.end)
+
+    def test_repomd_matches_files(self):
+        records = self.records()
+        self.assertEqual(sorted(records), ['filelists', 'filelists_db', 'other', 'other_db', 'primary', 'primary_db'])
+        for typ, record in records.items():
+            data = self.read(record['path'])
+            self.assertEqual(sha256(data), record['checksum'], typ)
+            self.assertEqual(len(data), record['size'], typ)
+            self.assertTrue(os.path.basename(record['path']).startswith(record['checksum'] + '-'), typ)
+            opened = self.uncompressed(record['path'])
+            self.assertEqual(sha256(opened), record['open_checksum'], typ)
+            self.assertEqual(len(opened), record['open_size'], typ)
+            self.assertEqual(record['database_version'], str(DB_VERSION) if typ.endswith('_db') else None)
+        # nothing left behind but the files repomd.xml lists
+        listed = set(os.path.basename(record['path']) for record in records.values())
+        self.assertEqual(set(os.listdir(os.path.join(self.repo, 'repodata'))), listed | set(['repomd.xml']))
+
+    def test_db_info_checksum(self):
+        records = self.records()
+        for typ in ('primary', 'filelists', 'other'):
+            dbversion, checksum = self.db(typ).execute("SELECT dbversion, checksum FROM db_info").fetchone()
+            self.assertEqual(dbversion, DB_VERSION)
+            self.assertEqual(checksum, records[typ]['checksum'])
+
+    def test_package_entries(self):
+        app = self.primary()['app']
+        self.assertEqual(app.find(_COMMON + 'version').attrib, {'epoch': '3', 'ver': '1.0', 'rel': '1'})
+        self.assertEqual(app.findtext(_COMMON + 'checksum'),
+                         sha256(self.read(os.path.join(self.repo, 'app-1.0-1.x86_64.rpm'))))
+        self.assertEqual(app.find(_COMMON + 'location').get('href'), 'app-1.0-1.x86_64.rpm')
+        fmt = app.find(_COMMON + 'format')
+        # only files createrepo lists in primary
+        self.assertEqual([f.text for f in fmt.findall(_COMMON + 'file')], ['/usr/bin/app'])
+        self.assertEqual(self.primary()['lib'].find(_COMMON + 'version').get('epoch'), '0')
+
+    def test_dependency_encoding(self):
+        fmt = self.primary()['app'].find(_COMMON + 'format')
+        requires = [e.attrib for e in fmt.find(_RPM + 'requires')]
+        # versioned entries carry flags and an explicit epoch, rpmlib() and duplicates are dropped
+        self.assertEqual(requires, [
+            {'name': 'lib', 'flags': 'GE', 'epoch': '0', 'ver': '1.0', 'rel': '2'},
+            {'name': 'old', 'flags': 'LT', 'epoch': '2', 'ver': '3.0'},
+            {'name': '/bin/sh'},
+            {'name': 'setup', 'pre': '1'},
+        ])
+        provides = [e.attrib for e in fmt.find(_RPM + 'provides')]
+        self.assertEqual(provides, [
+            {'name': 'app', 'flags': 'EQ', 'epoch': '3', 'ver': '1.0', 'rel': '1'},
+            {'name': 'webapp'},
+        ])
+        rows = self.db('primary').execute(
+            "SELECT name, flags, epoch, version, release, pre FROM requires ORDER BY rowid").fetchall()
+        self.assertEqual([tuple(row) for row in rows], [
+            ('lib', 'GE', '0', '1.0', '2', 'FALSE'),
+            ('old', 'LT', '2', '3.0', None, 'FALSE'),
+            ('/bin/sh', None, None, None, None, 'FALSE'),
+            ('setup', None, None, None, None, 'TRUE'),
+        ])
+
+    def test_filelists_db(self):
+        rows = self.db('filelists').execute(
+            "SELECT p.pkgId, f.dirname, f.filenames, f.filetypes FROM filelist f JOIN packages p USING (pkgKey)"
+            " ORDER BY f.dirname").fetchall()
+        self.assertEqual([tuple(row[1:]) for row in rows], [
+            ('/usr/bin', 'app', 'f'), ('/usr/lib', 'lib.so', 'f'), ('/usr/share/app', 'data', 'f')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# coding: utf-8
+
+import unittest
+
+from rpm_repo_maker.rpmver import rpmvercmp, compare_evr, ranges_overlap
+from rpm_repo_maker.exporter.repoindex import Package
+from rpm_repo_maker.exporter.versionindex import VersionIndex
+
+
+def package(name, version, release='1', epoch='0', arch='x86_64'):
+    return Package(name, epoch, version, release, arch, 'sha256', None, 0, None, None, 'test')
+
+
+class RpmvercmpTest(unittest.TestCase):
+    # (a, b, expected) pairs from the rpmvercmp tests of librpm
+    VECTORS = [
+        ('1.0', '1.0', 0),
+        ('1.0', '2.0', -1),
+        ('2.0.1', '2.0', 1),
+        ('2.0.1a', '2.0.1', 1),
+        ('5.5p1', '5.5p2', -1),
+        ('5.5p10', '5.5p1', 1),
+        ('10xyz', '10.1xyz', -1),
+        ('xyz10', 'xyz10.1', -1),
+        ('1.0aa', '1.0a', 1),
+        ('10', '9', 1),
+        ('1.05', '1.5', 0),
+        ('a', '1', -1),
+        ('1.0~rc1', '1.0', -1),
+        ('1.0~rc1', '1.0~rc2', -1),
+        ('1.0~rc1~git123', '1.0~rc1', -1),
+        ('1.0^', '1.0', 1),
+        ('1.0^git1', '1.0', 1),
+        ('1.0^git1', '1.01', -1),
+        ('1.0^git1~pre', '1.0^git1', -1),
+        ('6.0.rc1', '6.0', 1),
+        ('1_0', '1.0', 0),
+    ]
+
+    def test_vectors(self):
+        for a, b, expected in self.VECTORS:
+            self.assertEqual(rpmvercmp(a, b), expected, "{} <=> {}".format(a, b))
+            self.assertEqual(rpmvercmp(b, a), -expected, "{} <=> {}".format(b, a))
+
+    def test_compare_evr(self):
+        self.assertEqual(compare_evr(('1', '1.0', '1'), ('0', '9.0', '1')), 1)
+        self.assertEqual(compare_evr(('0', '1.0', '2'), ('0', '1.0', '10')), -1)
+        # a missing release matches every release
+        self.assertEqual(compare_evr(('0', '1.0', None), ('0', '1.0', '5')), 0)
+
+    def test_ranges_overlap(self):
+        self.assertTrue(ranges_overlap('EQ', ('0', '2.0', '1'), 'GE', ('0', '1.0', None)))
+        self.assertFalse(ranges_overlap('EQ', ('0', '1.0', '1'), 'GT', ('0', '1.0', None)))
+        self.assertTrue(ranges_overlap(None, None, 'LT', ('0', '1.0', None)))
+
+
+class VersionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = VersionIndex([
+            package('kern', '4.18.0', '477.el8'),
+            package('kern', '4.18.0', '513.el8'),
+            package('kern', '4.18.0', '513.el8', arch='noarch'),
+            package('kern', '5.14.0', '70.el9'),
+            package('kern', '5.14.0~rc1', '1'),
+            package('kern', '1.0', '1', epoch='1'),
+        ], arches=('x86_64', 'noarch'))
+
+    def select(self, selector, arch=None):
+        pkg = self.index.select(selector, arch)
+        return None if pkg is None else (pkg.epoch, pkg.version, pkg.release, pkg.arch)
+
+    def test_latest(self):
+        # the epoch wins over the version
+        self.assertEqual(self.select('@latest'), ('1', '1.0', '1', 'x86_64'))
+        self.assertEqual(self.select('@latest-1'), ('0', '5.14.0', '70.el9', 'x86_64'))
+        self.assertEqual(self.select('@latest-2'), ('0', '5.14.0~rc1', '1', 'x86_64'))
+        self.assertEqual(self.select('@latest-3'), ('0', '4.18.0', '513.el8', 'x86_64'))
+        self.assertEqual(self.select('@latest-4'), ('0', '4.18.0', '477.el8', 'x86_64'))
+        self.assertIsNone(self.select('@latest-5'))
+
+    def test_best_arch(self):
+        self.assertEqual(self.select('4.18.0-513.el8'), ('0', '4.18.0', '513.el8', 'x86_64'))
+        self.assertEqual(self.select('4.18.0-513.el8', arch='noarch'), ('0', '4.18.0', '513.el8', 'noarch'))
+        self.assertEqual(self.select('@latest', arch='noarch'), ('0', '4.18.0', '513.el8', 'noarch'))
+
+    def test_exact(self):
+        # a bare version is the newest release of that version
+        self.assertEqual(self.select('4.18.0'), ('0', '4.18.0', '513.el8', 'x86_64'))
+        self.assertEqual(self.select('4.18.0-477.el8'), ('0', '4.18.0', '477.el8', 'x86_64'))
+        self.assertEqual(self.select('1:1.0'), ('1', '1.0', '1', 'x86_64'))
+        self.assertIsNone(self.select('3.10'))
+
+    def test_ranges(self):
+        self.assertEqual(self.select('<5.14.0'), ('0', '5.14.0~rc1', '1', 'x86_64'))
+        self.assertEqual(self.select('>=4.18,<5'), ('0', '4.18.0', '513.el8', 'x86_64'))
+        self.assertEqual(self.select('<=4.18.0-477.el8'), ('0', '4.18.0', '477.el8', 'x86_64'))
+        self.assertEqual(self.select('~=4.18.0'), ('0', '4.18.0', '513.el8', 'x86_64'))
+        self.assertIsNone(self.select('>1:1.0'))
+        # ~= needs at least two version components
+        self.assertRaises(ValueError, self.index.select, '~=4')
+
+
+if __name__ == '__main__':
+    unittest.main()
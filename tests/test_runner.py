@@ -0,0 +1,110 @@
+# coding: utf-8
+
+import os
+import time
+import unittest
+
+from rpm_repo_maker.runner import Command, CommandError, check_command, run_command, run_commands
+
+
+def alive(pid):
+    """Whether a process runs, zombies waiting for their parent do not."""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, OSError):
+        return False
+
+
+def wait_gone(pid, seconds=5):
+    deadline = time.time() + seconds
+    while alive(pid) and time.time() < deadline:
+        time.sleep(0.05)
+    return not alive(pid)
+
+
+class CommandTest(unittest.TestCase):
+
+    def test_output(self):
+        lines = []
+        result = run_command("echo one; echo two >&2; echo three", on_stdout=lines.append)
+        self.assertTrue(result.ok)
+        self.assertEqual(lines, ['one', 'three'])
+        self.assertEqual((result.stdout, result.stderr), ('one\nthree', 'two'))
+
+    def test_failure(self):
+        result = run_command("echo broken >&2; exit 3")
+        self.assertFalse(result.ok)
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.reason, 'exit status 3: broken')
+        with self.assertRaises(CommandError) as cm:
+            check_command("exit 3")
+        self.assertEqual(cm.exception.result.returncode, 3)
+
+    def test_bounded_tail(self):
+        lines = []
+        result = run_command("seq 1 1000", on_stdout=lines.append, tail=10)
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(result.stdout.split('\n'), [str(i) for i in range(991, 1001)])
+
+    def test_long_lines(self):
+        pieces, chunks = [], []
+        size = Command.MAX_LINE * 2 + 10
+        result = run_command("printf '%0{}d\\n' 0 | tr 0 x".format(size),
+                             on_stdout=pieces.append, on_stdout_bytes=chunks.append)
+        self.assertTrue(result.ok)
+        self.assertEqual([len(piece) for piece in pieces], [Command.MAX_LINE, Command.MAX_LINE, 10])
+        self.assertEqual(b''.join(chunks), b'x' * size + b'\n')
+
+    def test_timeout(self):
+        started = time.time()
+        result = run_command("sleep 30", timeout=0.5)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.ok)
+        self.assertIn('timed out', result.reason)
+        self.assertTrue(time.time() - started < 10)
+
+    def test_cancel_kills_process_group(self):
+        pids = []
+        # the shell waits for a background child, both have to go
+        command = Command("sleep 30 & echo $!; wait", on_stdout=pids.append).start()
+        deadline = time.time() + 5
+        while not pids and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(pids), 1)
+        child = int(pids[0])
+        self.assertTrue(alive(child))
+        command.cancel()
+        result = command.wait()
+        self.assertTrue(result.cancelled)
+        self.assertFalse(result.ok)
+        self.assertTrue(wait_gone(child))
+
+
+class _Broken(Command):
+
+    def start(self):
+        raise RuntimeError("cannot start")
+
+
+class RunCommandsTest(unittest.TestCase):
+
+    def test_order_and_jobs(self):
+        started = time.time()
+        results = run_commands(["sleep 0.{}; echo {}".format(5 - i, i) for i in range(4)], jobs=2)
+        elapsed = time.time() - started
+        self.assertEqual([result.stdout for result in results], ['0', '1', '2', '3'])
+        # two at a time: (0.5, 0.4) then (0.3, 0.2), not 1.4s one after another
+        self.assertTrue(0.7 <= elapsed < 1.3, elapsed)
+
+    def test_interrupted(self):
+        running = Command("sleep 30")
+        started = time.time()
+        self.assertRaises(RuntimeError, run_commands, [running, _Broken("true")], jobs=2)
+        self.assertTrue(running.cancelled)
+        self.assertTrue(running.done())
+        self.assertTrue(time.time() - started < 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# coding: utf-8
+
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from rpm_repo_maker.repodata import NS_COMMON, NS_REPO, NS_RPM
+from rpm_repo_maker.exporter.repoindex import Package, PackageIndex, RepoSource
+from rpm_repo_maker.exporter.solver import Solver, parse_rich
+
+ARCHES = ('x86_64', 'noarch')
+
+
+def dep(name, flags=None, version=None):
+    return (name, flags, ('0', version, None) if flags else None)
+
+
+def package(name, version, arch='x86_64', provides=(), requires=(), obsoletes=(), files=()):
+    return Package(name, '0', version, '1', arch, 'sha256', None, 0, None, None, 'test',
+                   provides=tuple(provides), requires=tuple(requires), obsoletes=tuple(obsoletes), files=tuple(files))
+
+
+def names(pkgs):
+    return ["{}-{}.{}".format(pkg.name, pkg.version, pkg.arch) for pkg in pkgs]
+
+
+class SolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.packages = [
+            package('app', '1.0',
+                    requires=[dep('lib', 'GE', '2.0'), dep('/bin/sh'), dep('rpmlib(CompressedFileNames)')]),
+            package('legacy', '1.0', requires=[dep('lib', 'EQ', '1.0')]),
+            package('lib', '1.0'),
+            package('lib', '2.0'),
+            package('lib', '2.0', arch='noarch'),
+            package('bash', '5.1', files=['/bin/sh', '/bin/bash']),
+            package('picky', '1.0', requires=[dep('(tls-impl or nss)')]),
+            package('openssl', '3.0', provides=[dep('tls-impl')]),
+            package('nss', '3.9'),
+            package('broken', '1.0', requires=[dep('missing', 'GE', '1.0')]),
+        ]
+        self.index = PackageIndex(self.packages)
+        self.solver = Solver(self.index, ARCHES)
+
+    def find(self, name, version, arch='x86_64'):
+        for pkg in self.packages:
+            if (pkg.name, pkg.version, pkg.arch) == (name, version, arch):
+                return pkg
+        raise KeyError(name)
+
+    def test_whatprovides(self):
+        self.assertEqual(names(self.index.whatprovides('lib', 'GE', ('0', '2.0', None))),
+                         ['lib-2.0.x86_64', 'lib-2.0.noarch'])
+        self.assertEqual(names(self.index.whatprovides('/bin/sh')), ['bash-5.1.x86_64'])
+        self.assertEqual(names(self.index.whatprovides('tls-impl')), ['openssl-3.0.x86_64'])
+
+    def test_closure_picks_newest_best_arch(self):
+        closure = self.solver.closure([self.find('app', '1.0')])
+        self.assertEqual(names(closure), ['app-1.0.x86_64', 'bash-5.1.x86_64', 'lib-2.0.x86_64'])
+
+    def test_closure_honours_versioned_requires(self):
+        closure = self.solver.closure([self.find('legacy', '1.0')])
+        self.assertEqual(names(closure), ['legacy-1.0.x86_64', 'lib-1.0.x86_64'])
+
+    def test_rich_dependency(self):
+        self.assertEqual(parse_rich('(tls-impl or nss)'),
+                         ('or', [('dep', dep('tls-impl')), ('dep', dep('nss'))]))
+        closure = self.solver.closure([self.find('picky', '1.0')])
+        self.assertEqual(names(closure), ['openssl-3.0.x86_64', 'picky-1.0.x86_64'])
+        # an installed alternative already satisfies it
+        closure = self.solver.closure([self.find('picky', '1.0'), self.find('nss', '3.9')])
+        self.assertEqual(names(closure), ['nss-3.9.x86_64', 'picky-1.0.x86_64'])
+
+    def test_unsatisfiable(self):
+        with self.assertRaises(ValueError) as ctx:
+            self.solver.closure([self.find('broken', '1.0')])
+        self.assertIn('nothing provides missing GE 1.0, needed by', str(ctx.exception))
+
+    def test_obsoleted(self):
+        index = PackageIndex([package('old', '1.0'), package('new', '2.0', obsoletes=[dep('old', 'LT', '2.0')])])
+        self.assertEqual(names(index.obsoleted), ['old-1.0.x86_64'])
+
+
+PRIMARY_PACKAGE = '''<package type="rpm">
+  <name>{name}</name><arch>{arch}</arch>
+  <version epoch="0" ver="{version}" rel="1"/>
+  <checksum type="sha256" pkgid="YES">{checksum}</checksum>
+  <size package="1024" installed="2048" archive="2048"/>
+  <location href="Packages/{name}-{version}-1.{arch}.rpm"/>
+  <format>
+    <rpm:provides><rpm:entry name="{name}" flags="EQ" epoch="0" ver="{version}" rel="1"/></rpm:provides>
+    <rpm:requires>{requires}</rpm:requires>
+    {files}
+  </format>
+</package>
+'''
+
+
+def write_repo(root, packages):
+    """Write repodata with xml primary metadata of (name, version, arch, requires, files)."""
+    entries = []
+    for name, version, arch, requires, files in packages:
+        entries.append(PRIMARY_PACKAGE.format(
+            name=name, version=version, arch=arch,
+            checksum=hashlib.sha256(name.encode('utf-8')).hexdigest(),
+            requires=''.join('<rpm:entry name="{}"/>'.format(req) for req in requires),
+            files=''.join('<file>{}</file>'.format(fn) for fn in files)))
+    primary = ('<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns="{}" xmlns:rpm="{}" packages="{}">\n{}'
+               '</metadata>\n').format(NS_COMMON, NS_RPM, len(entries), ''.join(entries)).encode('utf-8')
+    os.makedirs(os.path.join(root, 'repodata'))
+    path = os.path.join(root, 'repodata', 'primary.xml.gz')
+    with gzip.open(path, 'wb') as f:
+        f.write(primary)
+    with open(path, 'rb') as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    with open(os.path.join(root, 'repodata', 'repomd.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<repomd xmlns="{}">\n<data type="primary">'
+                '<checksum type="sha256">{}</checksum><location href="repodata/primary.xml.gz"/></data>\n'
+                '</repomd>\n'.format(NS_REPO, checksum))
+
+
+class RepodataSolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.repo = os.path.join(self.tempdir, 'repo')
+        write_repo(self.repo, [
+            ('web', '1.0', 'x86_64', ['libweb', '/usr/bin/python3'], []),
+            ('libweb', '1.0', 'x86_64', [], []),
+            ('libweb', '1.1', 'x86_64', [], []),
+            ('python3', '3.9', 'x86_64', [], ['/usr/bin/python3']),
+            ('docs', '1.0', 'noarch', [], []),
+            ('web', '1.0', 'aarch64', ['libweb'], []),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_packages(self):
+        source = RepoSource('synthetic', [self.repo], os.path.join(self.tempdir, 'cache'))
+        packages = source.packages(ARCHES)
+        self.assertEqual(sorted(names(packages)), ['docs-1.0.noarch', 'libweb-1.0.x86_64', 'libweb-1.1.x86_64',
+                                                   'python3-3.9.x86_64', 'web-1.0.x86_64'])
+        web = [pkg for pkg in packages if pkg.name == 'web'][0]
+        self.assertEqual(web.url, source.baseurl + 'Packages/web-1.0-1.x86_64.rpm')
+        self.assertEqual(web.size, 1024)
+        # parsed once, read back from the pickled index
+        again = RepoSource('synthetic', [self.repo], os.path.join(self.tempdir, 'cache')).packages(ARCHES)
+        self.assertEqual(sorted(names(again)), sorted(names(packages)))
+
+    def test_closure(self):
+        packages = RepoSource('synthetic', [self.repo], os.path.join(self.tempdir, 'cache')).packages(ARCHES)
+        web = [pkg for pkg in packages if pkg.name == 'web'][0]
+        closure = Solver(PackageIndex(packages), ARCHES).closure([web])
+        self.assertEqual(names(closure), ['libweb-1.1.x86_64', 'python3-3.9.x86_64', 'web-1.0.x86_64'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rpm_repo_maker.exporter.pm_zypper_nir import ZypperNIRPackageFinder
+from rpm_repo_maker.runner import Command
+
+OUTPUT = u'''<?xml version='1.0'?>
+<stream>
+<message type="info">Loading repository data...</message>
+<install-summary download-size="2048" space-usage-diff="4096" packages-to-change="2">
+<to-install>
+<solvable type="package" name="docker" edition="20.10.12-1" arch="x86_64" repository="{}"/>
+<solvable type="pattern" name="container" edition="1-1" arch="noarch" repository="main"/>
+<solvable type="package" name="containerd" edition="1:1.5.9-2" arch="x86_64" repository="main"/>
+</to-install>
+</install-summary>
+</stream>
+'''
+
+
+class ZypperSolveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='rpm-repo-maker-test-')
+        self.output = os.path.join(self.tempdir, 'zypper.xml')
+        output = self.output
+
+        class Finder(ZypperNIRPackageFinder):
+
+            @classmethod
+            def _zypper(cls, args):
+                return "cat {}".format(output)
+
+        self.finder = Finder
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, repository):
+        with open(self.output, 'wb') as f:
+            f.write(OUTPUT.format(repository).encode('utf-8'))
+
+    def test_solvables(self):
+        self.write(u'main')
+        solvables = self.finder._solve(['docker'])
+        self.assertEqual([(s['name'], s['edition']) for s in solvables],
+                         [('docker', '20.10.12-1'), ('containerd', '1:1.5.9-2')])
+
+    def test_long_lines(self):
+        # a solvable longer than the runner's lines, with a multibyte
+        # character across the piece boundary
+        prefix = OUTPUT.split('\n')[5].index('{')
+        repository = u'x' * (Command.MAX_LINE - prefix - 1) + u'\xe9' * 1000
+        self.write(repository)
+        solvables = self.finder._solve(['docker'])
+        self.assertEqual(solvables[0]['repository'], repository)
+        self.assertEqual(len(solvables), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()